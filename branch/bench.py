@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Throughput benchmark of every predictor, with regression gating against a saved baseline.
+
+Every predictor in ``predictors/`` is run over synthetic traces of the requested sizes, through the per-branch
+``predict``/``update`` loop, for predictors with a ``run_trace`` of their own the batch path and for TwoLevel and GShare
+the loop specialize.py generates for the configuration, exactly as ``branch.py`` drives them. Each case runs in a fresh
+process, so its peak RSS is its own, and reports the best branches/second of a few repeats. No toolchain or real traces
+are needed: the traces are generated from a fixed seed by tracegen.py with its default workload and kept as ``.btrace``
+files in ``--trace-dir`` between runs.
+
+    ./bench.py --save baseline.json                  # record a baseline
+    ./bench.py --compare baseline.json               # exits 1 if any case got more than 10% slower
+    ./bench.py --sizes 10000 10000000 -p TwoLevel GShare --paths batch --compare baseline.json --threshold 0.2
+
+Predictors missing from ``BENCH_ARGS`` are constructed without arguments; predictors that can't be constructed (such as
+an unimplemented Custom) are reported and skipped.
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+import typing
+
+from branch import get_predictor, new_results, simulate_chunk
+from btrace import write_btrace
+from profiling import peak_rss_kb
+from specialize import SUPPORTED_PREDICTORS, specialize
+from tracegen import generate
+from tracereader import read_chunks
+
+DEFAULT_SIZES = [10 ** 4, 10 ** 5, 10 ** 6]
+DEFAULT_SEED = 0
+DEFAULT_THRESHOLD = 0.1
+PATHS = ['per-branch', 'batch', 'specialized']
+
+# constructor arguments of the benchmarked configuration of each predictor
+BENCH_ARGS = {
+    'Bimodal': {'counter_bits': 2, 'table_size': 4096},
+    'TwoLevel': {'num_bhrs': 256, 'history_size_bits': 8, 'num_pht_entries': 4096},
+    'GShare': {'history_size_bits': 12},
+}
+
+
+def list_predictors() -> typing.List[str]:
+    directory = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'predictors')
+    return sorted(predictor.replace('.py', '') for predictor in os.listdir(directory)
+                  if predictor.endswith('.py') and not predictor.startswith('_'))
+
+
+def synthetic_trace(num_branches: int, seed: int, trace_dir: str) -> str:
+    """
+    Returns the path of the synthetic trace of ``num_branches`` branches in ``trace_dir``, generating it if needed.
+    """
+    path = os.path.join(trace_dir, f'tracegen-{num_branches}-{seed}.btrace')
+    if not os.path.exists(path):
+        os.makedirs(trace_dir, exist_ok=True)
+        write_btrace(generate(num_branches, seed=seed), path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return path
+
+
+def run_case(predictor_name: str, path: str, trace: str, repeat: int) -> typing.Dict:
+    """
+    Times ``predictor_name`` over ``trace`` through the given path, returning the best of ``repeat`` runs. Meant to run
+    in a process of its own.
+    """
+    predictor = get_predictor(predictor_name)(**BENCH_ARGS.get(predictor_name, dict()))
+    if path == 'specialized':
+        specialize(predictor)
+    best = None
+    for _ in range(repeat):
+        predictor.reset()
+        results = new_results(trace)
+        start = time.perf_counter()
+        for chunk in read_chunks(trace):
+            simulate_chunk(predictor, results, chunk, batch=path != 'per-branch')
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'branches': results['total_predictions'],
+        'seconds': best,
+        'branches_per_second': results['total_predictions'] / best if best else 0.0,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def case_key(predictor_name: str, path: str, branches: int) -> str:
+    return f'{predictor_name}/{path}/{branches}'
+
+
+def benchmark(predictor_names: typing.List[str], paths: typing.List[str], sizes: typing.List[int], seed: int,
+              trace_dir: str, repeat: int, baseline: typing.Dict = None,
+              threshold: float = DEFAULT_THRESHOLD) -> typing.Tuple[typing.Dict, typing.List[str]]:
+    """
+    Runs every (predictor, path, size) case, printing one CSV row per case. Returns the measured cases by key and the
+    keys of the cases which regressed by more than ``threshold`` against ``baseline``.
+    """
+    cases = dict()  # type: typing.Dict[str, typing.Dict]
+    regressions = []
+
+    columns = ['predictor', 'path', 'branches', 'branches_per_second', 'peak_rss_kb']
+    if baseline is not None:
+        columns += ['baseline_branches_per_second', 'change']
+    print(','.join(columns), flush=True)
+
+    # spawn rather than fork, so each case's peak RSS doesn't include the parent's
+    context = multiprocessing.get_context('spawn')
+    for size in sizes:
+        trace = synthetic_trace(size, seed, trace_dir)
+        for predictor_name in predictor_names:
+            try:
+                predictor_class = get_predictor(predictor_name)
+                predictor_class(**BENCH_ARGS.get(predictor_name, dict()))
+                supports_batch = predictor_class.supports_batch()
+            except Exception as e:
+                print(f'skipping {predictor_name}: {type(e).__name__}: {e}', file=sys.stderr)
+                continue
+            for path in paths:
+                if path == 'batch' and not supports_batch or \
+                        path == 'specialized' and predictor_class not in SUPPORTED_PREDICTORS:
+                    continue
+                with context.Pool(1) as pool:
+                    case = pool.apply(run_case, (predictor_name, path, trace, repeat))
+                key = case_key(predictor_name, path, size)
+                cases[key] = case
+
+                row = [predictor_name, path, str(case['branches']), f"{case['branches_per_second']:.0f}",
+                       str(case['peak_rss_kb'])]
+                if baseline is not None:
+                    previous = baseline['cases'].get(key)
+                    if previous is None:
+                        row += ['', '']
+                    else:
+                        change = case['branches_per_second'] / previous['branches_per_second'] - 1
+                        row += [f"{previous['branches_per_second']:.0f}", f'{change:+.1%}']
+                        if change < -threshold:
+                            regressions.append(key)
+                print(','.join(row), flush=True)
+    return cases, regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Benchmark the throughput (branches/second) and peak memory of every predictor on synthetic "
+                    "traces, optionally saving a baseline or failing on regressions against one."
+    )
+    parser.add_argument(
+        "-p", "--predictors",
+        help="the predictors to benchmark. if omitted, every predictor in predictors/",
+        nargs='+'
+    )
+    parser.add_argument(
+        "--paths",
+        help="which simulation paths to benchmark",
+        nargs='+',
+        choices=PATHS,
+        default=PATHS
+    )
+    parser.add_argument(
+        "--sizes",
+        help=f"trace sizes in branches (default: {' '.join(map(str, DEFAULT_SIZES))})",
+        nargs='+',
+        type=int,
+        default=DEFAULT_SIZES
+    )
+    parser.add_argument(
+        "--seed",
+        help="seed of the synthetic traces",
+        type=int,
+        default=DEFAULT_SEED
+    )
+    parser.add_argument(
+        "--trace-dir",
+        help="where synthetic traces are kept between runs",
+        default=os.path.join(tempfile.gettempdir(), 'branch-bench')
+    )
+    parser.add_argument(
+        "--repeat",
+        help="number of timed runs per case, the fastest is reported",
+        type=int,
+        default=3
+    )
+    parser.add_argument(
+        "--save",
+        help="save the results as a JSON baseline"
+    )
+    parser.add_argument(
+        "--compare",
+        help="compare against a JSON baseline and exit with status 1 if any case regressed"
+    )
+    parser.add_argument(
+        "--threshold",
+        help=f"tolerated throughput loss against the baseline, as a fraction (default: {DEFAULT_THRESHOLD})",
+        type=float,
+        default=DEFAULT_THRESHOLD
+    )
+
+    parsed = parser.parse_args()
+
+    baseline_results = None
+    if parsed.compare:
+        with open(parsed.compare, 'r') as fp:
+            baseline_results = json.load(fp)
+
+    measured, regressed = benchmark(parsed.predictors or list_predictors(), parsed.paths, parsed.sizes, parsed.seed,
+                                    parsed.trace_dir, parsed.repeat, baseline_results, parsed.threshold)
+
+    if parsed.save:
+        with open(parsed.save, 'w') as fp:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'seed': parsed.seed,
+                'cases': measured,
+            }, fp, indent=2)
+
+    if regressed:
+        print(f'{len(regressed)} case(s) regressed by more than {parsed.threshold:.0%}: {", ".join(regressed)}',
+              file=sys.stderr)
+        exit(1)
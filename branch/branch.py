@@ -12,14 +12,28 @@
 #
 #                        Branch Sweep Project | Sampson & Devic 2025
 
+import collections
 import importlib
+import itertools
+import operator
 import argparse
 import json
-import pprint
+import time
 import typing
 import os
 
 from predictors import AbstractBasePredictor, Predict
+from profiling import Profiler
+from checkpoint import DEFAULT_CHECKPOINT_EVERY, Checkpointer
+from resultcache import DEFAULT_CACHE_PATH, ResultCache
+from sampling import DEFAULT_CONFIDENCE, DEFAULT_SAMPLE_SIZE, DEFAULT_WARMUP, Sampler
+from siteindex import SiteIndex
+from segments import DEFAULT_SEGMENT_WARMUP, Segmenter
+from siteprofile import SiteProfiler
+from specialize import is_specializable, specialize
+from timeline import DEFAULT_CAPACITY, TimelineRecorder
+from tracereader import is_range, is_stream, list_traces, read_chunks, read_stream
+from writers import FORMATS, open_writer
 
 
 def get_predictor(predictor_module_name) -> typing.Type[AbstractBasePredictor]:
@@ -28,11 +42,41 @@ def get_predictor(predictor_module_name) -> typing.Type[AbstractBasePredictor]:
     return pred_class
 
 
-def test_predictor_single_trace(predictor: AbstractBasePredictor, trace: str, reset=True) -> typing.Dict:
-    if reset:
-        predictor.reset()
+def tally_predictions(results: typing.Dict, opcodes, predictions, outcomes):
+    """
+    Adds a chunk of batch predictions (as returned by ``AbstractBasePredictor.run_trace``) to the running result
+    counters of ``test_predictor_single_trace``.
+    """
+    if hasattr(predictions, 'tolist'):  # numpy arrays and memoryviews, iterating plain ints is much faster
+        predictions = predictions.tolist()
+    correct = bytes(map(operator.eq, predictions, outcomes))
 
-    results = {
+    # Predict.TAKEN == 1 and Predict.NOT_TAKEN == 0, so summing outcomes counts the taken branches
+    total = len(correct)
+    total_correct = sum(correct)
+    total_taken = sum(outcomes)
+    correct_takes = sum(itertools.compress(outcomes, correct))
+    correct_not_takes = total_correct - correct_takes
+
+    results['total_predictions'] += total
+    results['correct_predicts'] += total_correct
+    results['correct_takes'] += correct_takes
+    results['correct_not_takes'] += correct_not_takes
+    results['incorrect_predicts'] += total - total_correct
+    results['incorrect_takes'] += total_taken - correct_takes
+    results['incorrect_not_takes'] += (total - total_taken) - correct_not_takes
+
+    histogram = results['opcode_histogram']
+    correct_opcodes = collections.Counter(itertools.compress(opcodes, correct))
+    for opcode, count in collections.Counter(opcodes).items():
+        if opcode not in histogram:
+            histogram[opcode] = [0, 0]
+        histogram[opcode][0] += count
+        histogram[opcode][1] += correct_opcodes[opcode]
+
+
+def new_results(trace: str) -> typing.Dict:
+    return {
         'trace': trace,
         'total_predictions': 0,
         'correct_predicts': 0,
@@ -44,58 +88,231 @@ def test_predictor_single_trace(predictor: AbstractBasePredictor, trace: str, re
         'opcode_histogram': dict()
     }
 
-    with open(trace, 'r') as fp:
-        for line in fp.readlines():
-            if not line.strip():
-                continue
 
-            # parse the trace file
-            opcode, pc, target, taken = line.split(',')
-            pc = int(pc, 16)
-            target = int(target, 16)
-            taken = taken.strip()
-            if taken != '0' and taken != '1':
-                raise ValueError('result type not valid')
-            taken_result = Predict.TAKEN if taken == '1' else Predict.NOT_TAKEN
-
-            results['total_predictions'] += 1
-            if opcode not in results['opcode_histogram']:
-                results['opcode_histogram'][opcode] = [0, 0]
-            results['opcode_histogram'][opcode][0] += 1
-
-            # test the predictor
-            pred_result = predictor.predict(opcode, pc, target)
-
-            # update the predictor
-            predictor.update(opcode, pc, target, taken_result)
-
-            # check the result
-            if pred_result == taken_result:  # correct prediction
-                results['correct_predicts'] += 1
-                results['opcode_histogram'][opcode][1] += 1
-                if taken_result == Predict.TAKEN:  # correct taken prediction
-                    results['correct_takes'] += 1
-                if taken_result == Predict.NOT_TAKEN:  # correct not taken prediction
-                    results['correct_not_takes'] += 1
-            else:  # incorrect prediction
-                results['incorrect_predicts'] += 1
-                if taken_result == Predict.TAKEN:  # incorrect taken prediction
-                    results['incorrect_takes'] += 1
-                if taken_result == Predict.NOT_TAKEN:  # incorrect not taken prediction
-                    results['incorrect_not_takes'] += 1
-
-    return results
-
-
-def test_predictor_all_traces(predictor: AbstractBasePredictor, trace_dir: str = 'traces', reset=True) -> typing.Dict:
-    combo_results = dict()
-    for trace_file in os.listdir(trace_dir):
-        trace_loc = os.path.join(trace_dir, trace_file)
-        combo_results[trace_loc] = test_predictor_single_trace(predictor, trace_loc, reset)
+def batch_predictions(predictor: AbstractBasePredictor, chunk):
+    """
+    Runs ``predictor`` over one chunk of branches and returns its predictions, through its own ``run_trace`` if it
+    can be used (see ``supports_batch``), otherwise through the default one calling ``predict`` and ``update``.
+    """
+    opcodes, pcs, targets, outcomes = chunk
+    if predictor.supports_batch():
+        return predictor.run_trace(pcs, targets, opcodes, outcomes)
+    return AbstractBasePredictor.run_trace(predictor, pcs, targets, opcodes, outcomes)
+
+
+def simulate_chunk(predictor: AbstractBasePredictor, results: typing.Dict, chunk, batch=True):
+    """
+    Runs ``predictor`` over one chunk of branches (see tracereader.py), adding the outcome to ``results``. Predictors
+    with a ``run_trace`` of their own take the batch path unless ``batch`` is false.
+    """
+    opcodes, pcs, targets, outcomes = chunk
+    if batch and predictor.supports_batch():
+        tally_predictions(results, opcodes, predictor.run_trace(pcs, targets, opcodes, outcomes), outcomes)
+        return
+
+    for opcode, pc, target, taken_result in zip(opcodes, pcs, targets, outcomes):
+        results['total_predictions'] += 1
+        if opcode not in results['opcode_histogram']:
+            results['opcode_histogram'][opcode] = [0, 0]
+        results['opcode_histogram'][opcode][0] += 1
+
+        # test the predictor
+        pred_result = predictor.predict(opcode, pc, target)
+
+        # update the predictor
+        predictor.update(opcode, pc, target, taken_result)
+
+        # check the result
+        if pred_result == taken_result:  # correct prediction
+            results['correct_predicts'] += 1
+            results['opcode_histogram'][opcode][1] += 1
+            if taken_result == Predict.TAKEN:  # correct taken prediction
+                results['correct_takes'] += 1
+            if taken_result == Predict.NOT_TAKEN:  # correct not taken prediction
+                results['correct_not_takes'] += 1
+        else:  # incorrect prediction
+            results['incorrect_predicts'] += 1
+            if taken_result == Predict.TAKEN:  # incorrect taken prediction
+                results['incorrect_takes'] += 1
+            if taken_result == Predict.NOT_TAKEN:  # incorrect not taken prediction
+                results['incorrect_not_takes'] += 1
+
+
+def test_predictors_single_trace(predictors: typing.List[AbstractBasePredictor], trace: str, reset=True,
+                                 cache: ResultCache = None, site_index=True, profiler: Profiler = None,
+                                 site_profiler: SiteProfiler = None, timeline: TimelineRecorder = None,
+                                 chunks: typing.Iterable = None) -> typing.List[typing.Dict]:
+    """
+    Evaluates several predictors on ``trace`` while decoding it only once: every chunk of branches is fed to each
+    predictor in turn. With ``site_index``, stateless predictors are instead evaluated from the trace's per-site index
+    (see siteindex.py), which is built during the pass if it doesn't exist yet. Returns one result dict per predictor,
+    in the same order. With a ``profiler`` (see profiling.py) the pass is timed, and with a ``site_profiler`` (see
+    siteprofile.py) every predictor's mispredictions are also counted per branch site, and with a ``timeline`` (see
+    timeline.py) its accuracy is recorded window by window; any of them bypasses the cache.
+    ``chunks`` may give the trace's branches already decoded (as by server.py), instead of reading ``trace``.
+    """
+    all_results = [None] * len(predictors)  # type: typing.List[typing.Optional[typing.Dict]]
+    keys = [None] * len(predictors)  # type: typing.List[typing.Optional[str]]
+
+    # a result only depends on the predictor's configuration if it starts from a freshly reset state
+    if cache is not None and reset and profiler is None and site_profiler is None and timeline is None:
+        for i, predictor in enumerate(predictors):
+            keys[i] = cache.key(predictor, trace, reset)
+            cached = cache.get(keys[i])
+            if cached is not None:
+                cached['trace'] = trace
+                all_results[i] = cached
+
+    pending = [i for i, results in enumerate(all_results) if results is None]
+    if not pending:
+        return all_results
+
+    for i in pending:
+        if reset:
+            predictors[i].reset()
+        all_results[i] = new_results(trace)
+
+    timing = profiler.begin(trace, len(predictors)) if profiler is not None else None
+    site_profiles = site_profiler.begin(trace, len(predictors)) if site_profiler is not None else None
+    timelines = timeline.begin(trace, len(predictors)) if timeline is not None else None
+    indexed = [i for i in pending
+               if site_index and not is_range(trace) and site_profiles is None and timelines is None
+               and predictors[i].is_stateless()]
+    replayed = [i for i in pending if i not in indexed]
+    index = building = None
+    if indexed:
+        index = SiteIndex.load(trace)
+        if index is None:
+            index = building = SiteIndex(trace)
+
+    if replayed or building is not None:
+        if chunks is None:
+            chunks = read_chunks(trace)
+        for chunk in (chunks if timing is None else timing.timed_chunks(chunks)):
+            for i in replayed:
+                if site_profiles is not None:
+                    site_profiles[i].simulate_chunk(predictors[i], all_results[i], chunk)
+                elif timelines is not None:
+                    timelines[i].simulate_chunk(predictors[i], all_results[i], chunk)
+                elif timing is None:
+                    simulate_chunk(predictors[i], all_results[i], chunk)
+                else:
+                    timing.simulate_chunk(i, predictors[i], all_results[i], chunk)
+            if building is not None:
+                building.add_chunk(chunk)
+        if building is not None:
+            building.save()
+
+    for i in indexed:
+        if timing is None:
+            index.evaluate(predictors[i], all_results[i])
+        else:
+            timing.evaluate_index(i, index, predictors[i], all_results[i])
+
+    if timing is not None:
+        profiler.end(timing)
+
+    for i in pending:
+        if keys[i] is not None:
+            cache.put(keys[i], all_results[i])
+    return all_results
+
+
+def test_predictors_stream(predictors: typing.List[AbstractBasePredictor], trace: str,
+                           emit: typing.Callable[[int, typing.Dict], None], every_branches: int = 1000000,
+                           every_seconds: float = 10.0, reset=True) -> typing.List[typing.Dict]:
+    """
+    Evaluates several predictors on the live stream ``trace`` (stdin or a named pipe) as its branches arrive. Every
+    ``every_branches`` branches or ``every_seconds`` seconds, whichever comes first, and once more at the end of the
+    stream, ``emit`` is called with each predictor's index and a snapshot of its results so far: the counters of
+    ``test_predictor_single_trace`` plus the running 'accuracy', the 'window' of branches since the previous snapshot
+    and whether the snapshot is 'final'. Returns the final result dict per predictor.
+    """
+    all_results = [new_results(trace) for _ in predictors]
+    for predictor in predictors:
+        if reset:
+            predictor.reset()
+    window_starts = [(0, 0) for _ in predictors]  # (total, correct) predictions at the previous snapshot
+
+    def snapshot(final):
+        for i, results in enumerate(all_results):
+            total, correct = results['total_predictions'], results['correct_predicts']
+            window_total, window_correct = total - window_starts[i][0], correct - window_starts[i][1]
+            window_starts[i] = (total, correct)
+            record = json.loads(json.dumps(results))
+            record['accuracy'] = correct / total if total else 0.0
+            record['window'] = {
+                'total_predictions': window_total,
+                'correct_predicts': window_correct,
+                'accuracy': window_correct / window_total if window_total else 0.0
+            }
+            record['final'] = final
+            emit(i, record)
+
+    branches, last_branches, last_time = 0, 0, time.monotonic()
+    chunks = read_stream(trace, min(every_branches, 1 << 16), min(every_seconds, 1.0))
+    for chunk in chunks:
+        # chunks are cut where the next snapshot is due, so snapshots land on every ``every_branches``th branch
+        start, length = 0, len(chunk[0])
+        while start < length:
+            end = min(length, start + every_branches - (branches - last_branches))
+            part = chunk if end - start == length else tuple(column[start:end] for column in chunk)
+            for predictor, results in zip(predictors, all_results):
+                simulate_chunk(predictor, results, part)
+            branches += end - start
+            start = end
+            if branches - last_branches >= every_branches or time.monotonic() - last_time >= every_seconds:
+                snapshot(False)
+                last_branches, last_time = branches, time.monotonic()
+    snapshot(True)
+    return all_results
+
+
+def test_predictor_single_trace(predictor: AbstractBasePredictor, trace: str, reset=True,
+                                cache: ResultCache = None) -> typing.Dict:
+    return test_predictors_single_trace([predictor], trace, reset, cache)[0]
+
+
+def test_predictors_all_traces(predictors: typing.List[AbstractBasePredictor], trace_dir: str = 'traces', reset=True,
+                               cache: ResultCache = None, site_index=True, profiler: Profiler = None,
+                               site_profiler: SiteProfiler = None) -> typing.List[typing.Dict]:
+    """
+    Evaluates several predictors on every trace in ``trace_dir``, decoding each trace once. Returns one
+    ``test_predictor_all_traces`` style dict per predictor, in the same order.
+    """
+    combo_results = [dict() for _ in predictors]
+    for trace_loc in list_traces(trace_dir):
+        for combo, results in zip(combo_results, test_predictors_single_trace(predictors, trace_loc, reset, cache,
+                                                                              site_index, profiler, site_profiler)):
+            combo[trace_loc] = results
     return combo_results
 
 
+def test_predictor_all_traces(predictor: AbstractBasePredictor, trace_dir: str = 'traces', reset=True,
+                              cache: ResultCache = None) -> typing.Dict:
+    return test_predictors_all_traces([predictor], trace_dir, reset, cache)[0]
+
+
+def parse_predictor_spec(spec: str, default_kwargs: typing.Dict) -> typing.Tuple[str, typing.Dict]:
+    """
+    Parses a predictor spec of the form ``Name`` or ``Name:key=value,key=value``. Specs without inline arguments take
+    ``default_kwargs`` (from --predictor-args).
+    """
+    if ':' not in spec:
+        return spec, dict(default_kwargs)
+    name, args = spec.split(':', 1)
+    kwargs = dict()
+    for arg in filter(None, args.split(',')):
+        if "=" not in arg:
+            raise ValueError(f"Invalid argument '{arg}' in '{spec}'. Arguments must be in the format key=value.")
+        key, value = arg.split("=", 1)
+        kwargs[key] = eval(value)
+    return name, kwargs
+
+
 if __name__ == '__main__':
+    import server
+
     parser = argparse.ArgumentParser(
         description="Branch Prediction Design Space Exploration and Evaluation script. Results outputted are standard "
                     "branch statistics such as the number of correctly predicted branches, broken down by whether the "
@@ -106,8 +323,10 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         'predictor',
-        help="the name of the predictor to use. Use --list-predictors for available predictors",
-        nargs='?'
+        help="the name of the predictor to use. Use --list-predictors for available predictors. Several predictors "
+             "may be given to evaluate them all in a single pass over each trace, each optionally with its own "
+             "arguments as Name:key=value,key=value",
+        nargs='*'
     )
     parser.add_argument(
         "--list-predictors",
@@ -120,13 +339,15 @@ if __name__ == '__main__':
     )
     parser.add_argument(
         "-f", "--format",
-        help="whether output should be in CSV or JSON format",
-        choices=['csv', 'json'],
+        help="output format. json gives one document, the others are written trace by trace as results complete: csv, "
+             "ndjson (one JSON result per line) or the columnar parquet and arrow formats (require pyarrow)",
+        choices=FORMATS,
         default='json'
     )
     parser.add_argument(
         "-t", "--trace",
-        help="run the specified trace(s). if omitted, run all available traces",
+        help="run the specified trace(s). if omitted, run all available traces. 'TRACE[START:END]' runs only the "
+             "branches START up to END of a trace, either bound may be omitted",
         action='append',  # python < 3.8, compatible with all future however
         # action='extend',  # python >= 3.8
         nargs='*'
@@ -136,8 +357,167 @@ if __name__ == '__main__':
         help="space-seperated key=word arguments to send to the predictor's constructor",
         nargs=argparse.REMAINDER
     )
+    parser.add_argument(
+        "--no-cache",
+        help="always re-run the simulation instead of returning previously cached results",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cache-path",
+        help="location of the result cache database",
+        default=DEFAULT_CACHE_PATH
+    )
+    parser.add_argument(
+        "--server",
+        help=f"socket of the evaluation server (see server.py). runs are forwarded to it while it is listening "
+             f"(default: {server.DEFAULT_SOCKET})",
+        default=server.DEFAULT_SOCKET,
+        metavar="SOCKET"
+    )
+    parser.add_argument(
+        "--no-server",
+        help="always evaluate in this process, even if an evaluation server is running",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sites",
+        help="also count mispredictions per branch site (PC), adding the K sites with the most mispredictions (all "
+             "sites if 0) and, for table predictors, table aliasing statistics to the output. implies --no-cache",
+        type=int,
+        metavar="K"
+    )
+    parser.add_argument(
+        "--timeline",
+        help="also record every predictor's accuracy, mispredictions per thousand branches and taken rate over "
+             "windows of N branches, adding them to the output (in _meta, so not in the flat formats). implies "
+             "--no-cache",
+        type=int,
+        metavar="N"
+    )
+    parser.add_argument(
+        "--timeline-capacity",
+        help=f"number of windows kept, the oldest are overwritten unless --timeline-downsample is given "
+             f"(default: {DEFAULT_CAPACITY})",
+        type=int,
+        default=DEFAULT_CAPACITY
+    )
+    parser.add_argument(
+        "--timeline-downsample",
+        help="once the timeline is full, merge adjacent windows into windows twice as long instead of overwriting the "
+             "oldest, so the whole trace is kept at a lower resolution",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--report-every",
+        help="when reading a live stream (-t - for stdin, or a named pipe), emit partial results every this many "
+             "branches. streams always output NDJSON, one line per predictor per report",
+        type=int,
+        default=1000000,
+        metavar="N"
+    )
+    parser.add_argument(
+        "--report-interval",
+        help="when reading a live stream, also emit partial results at least every this many seconds",
+        type=float,
+        default=10.0,
+        metavar="SECONDS"
+    )
+    parser.add_argument(
+        "--specialize",
+        help="run TwoLevel and GShare predictors through a batch loop generated for their configuration, with the same "
+             "results but several times the throughput. other predictors are run as usual",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sample",
+        help="estimate the results from one detailed interval of --sample-size branches in every PERIOD branches, "
+             "each after a warmup window of --sample-warmup branches, skipping the rest of the trace. the counters "
+             "only cover the intervals; the estimated accuracy and mispredictions per thousand branches, with "
+             "confidence bounds, and the fraction of the trace simulated are added to the output. implies --no-cache",
+        type=int,
+        metavar="PERIOD"
+    )
+    parser.add_argument(
+        "--sample-size",
+        help=f"branches per detailed interval (default: {DEFAULT_SAMPLE_SIZE})",
+        type=int,
+        default=DEFAULT_SAMPLE_SIZE
+    )
+    parser.add_argument(
+        "--sample-warmup",
+        help=f"branches of warmup before each interval, run without being counted (default: {DEFAULT_WARMUP})",
+        type=int,
+        default=DEFAULT_WARMUP
+    )
+    parser.add_argument(
+        "--sample-random",
+        help="place each interval at a random position within its period instead of at its end",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--sample-seed",
+        help="seed of --sample-random",
+        type=int,
+        default=0
+    )
+    parser.add_argument(
+        "--confidence",
+        help=f"confidence level of the sampling bounds (default: {DEFAULT_CONFIDENCE})",
+        type=float,
+        default=DEFAULT_CONFIDENCE
+    )
+    parser.add_argument(
+        "--segments",
+        help="split each trace into K segments simulated in parallel, each after a warmup window of --segment-warmup "
+             "branches before it, and merge their counters. an approximation of the serial results, see "
+             "--segment-check. implies --no-cache",
+        type=int,
+        metavar="K"
+    )
+    parser.add_argument(
+        "--segment-warmup",
+        help=f"branches before each segment run without being counted (default: {DEFAULT_SEGMENT_WARMUP})",
+        type=int,
+        default=DEFAULT_SEGMENT_WARMUP
+    )
+    parser.add_argument(
+        "--segment-check",
+        help="also simulate each trace serially and add the error of the segmented results, and both timings, to the "
+             "output",
+        action="store_true"
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes of --segments. defaults to the number of cores",
+        type=int
+    )
+    parser.add_argument(
+        "--checkpoint",
+        help="save the predictors' state and the progress of the run into this file every --checkpoint-every branches, "
+             "and resume from it if it exists. the file is removed when the run completes. implies --no-cache",
+        metavar="PATH"
+    )
+    parser.add_argument(
+        "--checkpoint-every",
+        help=f"branches between checkpoints (default: {DEFAULT_CHECKPOINT_EVERY})",
+        type=int,
+        default=DEFAULT_CHECKPOINT_EVERY,
+        metavar="N"
+    )
+    parser.add_argument(
+        "--profile",
+        help="time each trace and add its throughput, wall/CPU time, per-phase breakdown and peak RSS to the output. "
+             "implies --no-cache",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--profile-stats",
+        help="also run each trace under cProfile and dump its stats into this directory. implies --profile",
+        metavar="DIR"
+    )
 
     parsed = parser.parse_args()
+    parsed.profile = parsed.profile or parsed.profile_stats is not None
 
     try:
         pkwargs = dict()
@@ -146,6 +526,7 @@ if __name__ == '__main__':
                 raise ValueError(f"Invalid argument '{arg}'. Arguments must be in the format key=value.")
             key, value = arg.split("=", 1)
             pkwargs[key] = eval(value)
+        predictor_specs = [parse_predictor_spec(spec, pkwargs) for spec in parsed.predictor]
     except ValueError as e:
         print(e)
         exit(1)
@@ -162,149 +543,134 @@ if __name__ == '__main__':
         print(f'{parser.prog}: error: the following arguments are required: predictor')
         exit(1)
 
-    predictor_class = get_predictor(parsed.predictor)
-    predictor_object = predictor_class(**pkwargs)
+    predictor_objects = [get_predictor(name)(**kwargs) for name, kwargs in predictor_specs]
+    if parsed.specialize:
+        predictor_objects = [specialize(predictor_object) if is_specializable(predictor_object) else predictor_object
+                             for predictor_object in predictor_objects]
+
+    # each of these changes how traces are evaluated, so at most one may be given
+    modes = [flag for flag, given in (('--profile', parsed.profile), ('--sites', parsed.sites is not None),
+                                      ('--timeline', parsed.timeline is not None),
+                                      ('--sample', parsed.sample is not None),
+                                      ('--segments', parsed.segments is not None),
+                                      ('--checkpoint', parsed.checkpoint is not None)) if given]
+    if len(modes) > 1:
+        print(f'{parser.prog}: error: {" and ".join(modes)} can\'t be combined')
+        exit(1)
+    try:
+        sampler = Sampler(parsed.sample, parsed.sample_size, parsed.sample_warmup, parsed.sample_random,
+                          parsed.sample_seed, parsed.confidence) if parsed.sample is not None else None
+        segmenter = Segmenter(parsed.segments, parsed.segment_warmup, parsed.jobs, parsed.segment_check) \
+            if parsed.segments is not None else None
+        timeline_recorder = TimelineRecorder(parsed.timeline, parsed.timeline_capacity, parsed.timeline_downsample) \
+            if parsed.timeline is not None else None
+    except ValueError as e:
+        print(f'{parser.prog}: error: {e}')
+        exit(1)
+    checkpointer = Checkpointer(parsed.checkpoint, parsed.checkpoint_every) if parsed.checkpoint else None
+
+    result_cache = None if parsed.no_cache or modes else ResultCache(parsed.cache_path)
+    profiler = Profiler(parsed.profile_stats) if parsed.profile else None
+    site_profiler = SiteProfiler(parsed.sites) if parsed.sites is not None else None
+    # runs in any of those modes, and specialized runs, are about this process, so they are never forwarded
+    use_server = not parsed.no_server and not parsed.specialize and not modes and server.can_forward(parsed.server)
 
     flattened_traces = [item for sublist in (parsed.trace or []) for item in sublist]
     # flattened_traces = parsed.trace  # if >=py3.8 array is flattened when in extend mode
-    if flattened_traces:
-        result = dict()
-        for parsed_trace_file in flattened_traces:
-            result[parsed_trace_file] = test_predictor_single_trace(predictor_object, parsed_trace_file)
-    else:
-        result = test_predictor_all_traces(predictor_object)
-
-    result['_meta'] = {
+    metas = [{
         'predictor': predictor_object.name(),
-        'kwargs': pkwargs
-    }
+        'kwargs': kwargs,
+        'storage_bits': predictor_object.storage_bits()
+    } for predictor_object, (_, kwargs) in zip(predictor_objects, predictor_specs)]
+
+    if any(is_stream(trace_file) for trace_file in flattened_traces):
+        if len(flattened_traces) > 1:
+            print(f'{parser.prog}: error: a stream must be the only trace')
+            exit(1)
+        if sampler is not None or segmenter is not None or checkpointer is not None:
+            print(f'{parser.prog}: error: {modes[0]} can\'t be used with a stream')
+            exit(1)
+        result_writer = open_writer(parsed.output, 'ndjson')
+
+        def emit_line(i, record):
+            record['_meta'] = metas[i]
+            result_writer.write(record)
+
+        try:
+            test_predictors_stream(predictor_objects, flattened_traces[0], emit_line, parsed.report_every,
+                                   parsed.report_interval)
+        finally:
+            result_writer.close()
+        exit()
 
-    if parsed.output:
-        with open(parsed.output, 'w') as of:
-            if parsed.format == 'json':
-                json.dump(result, of, indent=2)
-            elif parsed.format == 'csv':
-                meta = result['_meta']
-                del result['_meta']
-                of.write(','.join([
-                    'predictor',
-                    'args',
-                    'trace',
-                    'total_predictions',
-                    'correct_predicts',
-                    'correct_takes',
-                    'correct_not_takes',
-                    'incorrect_predicts',
-                    'incorrect_takes',
-                    'incorrect_not_takes',
-                    'opcode_histogram.beq.total_predictions',
-                    'opcode_histogram.beq.correct_predicts',
-                    'opcode_histogram.bne.total_predictions',
-                    'opcode_histogram.bne.correct_predicts',
-                    'opcode_histogram.blt.total_predictions',
-                    'opcode_histogram.blt.correct_predicts',
-                    'opcode_histogram.bltu.total_predictions',
-                    'opcode_histogram.bltu.correct_predicts',
-                    'opcode_histogram.bge.total_predictions',
-                    'opcode_histogram.bge.correct_predicts',
-                    'opcode_histogram.bgeu.total_predictions',
-                    'opcode_histogram.bgeu.correct_predicts',
-                    'opcode_histogram.beqz.total_predictions',
-                    'opcode_histogram.beqz.correct_predicts',
-                    'opcode_histogram.bnez.total_predictions',
-                    'opcode_histogram.bnez.correct_predicts',
-                ]))
-                of.write('\n')
-                for trace in result:
-                    of.write(','.join([
-                        meta['predictor'],
-                        ' '.join([f"{k}={v}" for k, v in meta['kwargs'].items()]),
-                        str(result[trace]['trace']),
-                        str(result[trace]['total_predictions']),
-                        str(result[trace]['correct_predicts']),
-                        str(result[trace]['correct_takes']),
-                        str(result[trace]['correct_not_takes']),
-                        str(result[trace]['incorrect_predicts']),
-                        str(result[trace]['incorrect_takes']),
-                        str(result[trace]['incorrect_not_takes']),
-                        str(result[trace]['opcode_histogram'].get('beq', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('beq', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('bne', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('bne', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('blt', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('blt', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('bltu', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('bltu', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('bge', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('bge', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('bgeu', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('bgeu', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('beqz', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('beqz', [0, 0])[1]),
-                        str(result[trace]['opcode_histogram'].get('bnez', [0, 0])[0]),
-                        str(result[trace]['opcode_histogram'].get('bnez', [0, 0])[1]),
-                    ]))
-                    of.write('\n')
+    trace_files = flattened_traces or list_traces('traces')
+    if sampler is not None:
+        evaluations = ((trace_file, sampler.evaluate(predictor_objects, trace_file)) for trace_file in trace_files)
+    elif segmenter is not None:
+        evaluations = ((trace_file, segmenter.evaluate(predictor_objects, trace_file)) for trace_file in trace_files)
+    elif checkpointer is not None:
+        evaluations = ((trace_file, checkpointer.evaluate(predictor_objects, trace_file)) for trace_file in trace_files)
+    elif use_server:
+        evaluations = server.evaluate_remote(predictor_specs, trace_files, use_cache=not parsed.no_cache,
+                                             socket_path=parsed.server)
     else:
+        evaluations = ((trace_file, test_predictors_single_trace(predictor_objects, trace_file, cache=result_cache,
+                                                                 profiler=profiler, site_profiler=site_profiler,
+                                                                 timeline=timeline_recorder))
+                       for trace_file in trace_files)
+
+    try:
         if parsed.format == 'json':
-            pprint.pprint(result, indent=2)
+            by_trace = dict(evaluations)
+            results = [{trace_file: by_trace[trace_file][i] for trace_file in trace_files} for i in range(len(metas))]
+            for i, (result, meta) in enumerate(zip(results, metas)):
+                result['_meta'] = meta
+                if profiler is not None:
+                    meta['profile'] = {trace: profiles[i] for trace, profiles in profiler.profiles.items()}
+                if site_profiler is not None:
+                    meta['sites'] = site_profiler.summaries(i)
+                if timeline_recorder is not None:
+                    meta['timeline'] = timeline_recorder.summaries(i)
+                if sampler is not None:
+                    meta['sampling'] = {trace: estimates[i] for trace, estimates in sampler.estimates.items()}
+                if segmenter is not None:
+                    meta['segments'] = {trace: reports[i] for trace, reports in segmenter.reports.items()}
+            # a single predictor keeps the original output layout, several give a list of per-predictor blocks
+            output = results[0] if len(results) == 1 else results
+
+            if parsed.output:
+                with open(parsed.output, 'w') as of:
+                    json.dump(output, of, indent=2)
+            else:
+                print(json.dumps(output, indent=2))
         else:
-            meta = result['_meta']
-            del result['_meta']
-            print(','.join([
-                'predictor',
-                'args',
-                'trace',
-                'total_predictions',
-                'correct_predicts',
-                'correct_takes',
-                'correct_not_takes',
-                'incorrect_predicts',
-                'incorrect_takes',
-                'incorrect_not_takes',
-                'opcode_histogram.beq.total_predictions',
-                'opcode_histogram.beq.correct_predicts',
-                'opcode_histogram.bne.total_predictions',
-                'opcode_histogram.bne.correct_predicts',
-                'opcode_histogram.blt.total_predictions',
-                'opcode_histogram.blt.correct_predicts',
-                'opcode_histogram.bltu.total_predictions',
-                'opcode_histogram.bltu.correct_predicts',
-                'opcode_histogram.bge.total_predictions',
-                'opcode_histogram.bge.correct_predicts',
-                'opcode_histogram.bgeu.total_predictions',
-                'opcode_histogram.bgeu.correct_predicts',
-                'opcode_histogram.beqz.total_predictions',
-                'opcode_histogram.beqz.correct_predicts',
-                'opcode_histogram.bnez.total_predictions',
-                'opcode_histogram.bnez.correct_predicts',
-            ]))
-            for trace in result:
-                print(','.join([
-                    meta['predictor'],
-                    ' '.join([f"{k}={v}" for k, v in meta['kwargs'].items()]),
-                    str(result[trace]['trace']),
-                    str(result[trace]['total_predictions']),
-                    str(result[trace]['correct_predicts']),
-                    str(result[trace]['correct_takes']),
-                    str(result[trace]['correct_not_takes']),
-                    str(result[trace]['incorrect_predicts']),
-                    str(result[trace]['incorrect_takes']),
-                    str(result[trace]['incorrect_not_takes']),
-                    str(result[trace]['opcode_histogram'].get('beq', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('beq', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('bne', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('bne', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('blt', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('blt', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('bltu', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('bltu', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('bge', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('bge', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('bgeu', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('bgeu', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('beqz', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('beqz', [0, 0])[1]),
-                    str(result[trace]['opcode_histogram'].get('bnez', [0, 0])[0]),
-                    str(result[trace]['opcode_histogram'].get('bnez', [0, 0])[1]),
-                ]))
+            try:
+                result_writer = open_writer(parsed.output, parsed.format)
+            except (ImportError, ValueError) as e:
+                print(e)
+                exit(1)
+            try:
+                for trace_file, trace_results in evaluations:
+                    for i, trace_result in enumerate(trace_results):
+                        trace_result['_meta'] = dict(metas[i])
+                        if profiler is not None:
+                            trace_result['_meta']['profile'] = {trace_file: profiler.profiles[trace_file][i]}
+                        if site_profiler is not None:
+                            trace_result['_meta']['sites'] = \
+                                {trace_file: site_profiler.profiles[trace_file][i].summary(site_profiler.top_k)}
+                        if timeline_recorder is not None:
+                            trace_result['_meta']['timeline'] = \
+                                {trace_file: timeline_recorder.timelines[trace_file][i].summary()}
+                        if sampler is not None:
+                            trace_result['_meta']['sampling'] = {trace_file: sampler.estimates[trace_file][i]}
+                        if segmenter is not None:
+                            trace_result['_meta']['segments'] = {trace_file: segmenter.reports[trace_file][i]}
+                        result_writer.write(trace_result)
+            finally:
+                result_writer.close()
+    except RuntimeError as e:  # a trace failed on the server
+        print(e)
+        exit(1)
+
+    if checkpointer is not None:
+        checkpointer.finish()
@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+
+"""
+Compact binary columnar trace format (``.btrace``).
+
+A ``.btrace`` file holds the same information as a text ``opcode,pc,target,taken`` trace, but laid out as fixed-width
+little-endian columns so the driver can map it into memory and walk it without parsing a single string:
+
+    header    magic (8 bytes) | branch count (u64) | opcode count (u32) | reserved (u32)
+    opcodes   opcode count entries of length (u8) + utf-8 name, zero padded to an 8 byte boundary
+    pc        branch count * u64
+    target    branch count * u64
+    opcode    branch count * u8, index into the opcode table
+    taken     branch count * u8, 0 (not taken) or 1 (taken)
+
+Convert existing traces once with ``./btrace.py traces/*.trace -o btraces`` and pass the ``.btrace`` files to
+``branch.py`` as usual; the driver detects the format from the file's magic bytes.
+"""
+
+import argparse
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import typing
+from array import array
+
+MAGIC = b'BTRACE\x00\x01'
+HEADER = struct.Struct('<8sQII')
+EXTENSION = '.btrace'
+MAX_OPCODES = 256
+
+# number of branches buffered in memory per column before spilling to disk during conversion
+_SPILL_SIZE = 1 << 16
+
+
+def is_btrace(path: str) -> bool:
+    """
+    Returns whether the file at ``path`` is a binary trace, judged by its magic bytes rather than its extension.
+    """
+    with open(path, 'rb') as fp:
+        return fp.read(len(MAGIC)) == MAGIC
+
+
+def _pad(size: int) -> int:
+    return (-size) % 8
+
+
+class OpcodeColumn(typing.Sequence[str]):
+    """
+    A read-only view of the opcode column which resolves interned opcode ids to their names on access.
+    """
+    def __init__(self, ids: typing.Sequence[int], names: typing.List[str]):
+        self.ids = ids
+        self.names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return OpcodeColumn(self.ids[item], self.names)
+        return self.names[self.ids[item]]
+
+    def __iter__(self):
+        names = self.names
+        return (names[i] for i in self.ids)
+
+
+class BTrace:
+    """
+    A memory-mapped binary trace. The ``pcs``, ``targets``, ``opcode_ids`` and ``outcomes`` columns are memoryviews
+    directly over the mapped file, so opening a trace copies nothing regardless of its size.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        self._fp = open(path, 'rb')
+        try:
+            self._mm = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        except Exception:
+            self._fp.close()
+            raise
+
+        magic, count, num_opcodes, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"'{path}' is not a binary trace")
+
+        offset = HEADER.size
+        self.opcodes = []  # type: typing.List[str]
+        for _ in range(num_opcodes):
+            length = self._mm[offset]
+            self.opcodes.append(self._mm[offset + 1:offset + 1 + length].decode('utf-8'))
+            offset += 1 + length
+        offset += _pad(offset - HEADER.size)
+
+        expected = offset + 18 * count
+        if len(self._mm) < expected:
+            self.close()
+            raise ValueError(f"'{path}' is truncated, expected {expected} bytes but found {len(self._mm)}")
+
+        self._buffer = memoryview(self._mm)
+        self.pcs = self._column(offset, count, 'Q')
+        self.targets = self._column(offset + 8 * count, count, 'Q')
+        self.opcode_ids = self._column(offset + 16 * count, count, 'B')
+        self.outcomes = self._column(offset + 17 * count, count, 'B')
+
+    def _column(self, offset: int, count: int, typecode: str) -> typing.Sequence[int]:
+        width = array(typecode).itemsize
+        view = self._buffer[offset:offset + width * count]
+        if sys.byteorder == 'little' or width == 1:
+            return view.cast(typecode)
+        column = array(typecode, view.tobytes())  # big-endian host, a copy can't be avoided
+        column.byteswap()
+        return column
+
+    def __len__(self):
+        return len(self.outcomes)
+
+    @property
+    def opcode_column(self) -> OpcodeColumn:
+        return OpcodeColumn(self.opcode_ids, self.opcodes)
+
+    def records(self) -> typing.Iterator[typing.Tuple[str, int, int, int]]:
+        """
+        Yields ``(opcode, pc, target, taken)`` for every branch in trace order.
+        """
+        return zip(self.opcode_column, self.pcs, self.targets, self.outcomes)
+
+    def close(self):
+        for name in ('pcs', 'targets', 'opcode_ids', 'outcomes', '_buffer'):
+            column = self.__dict__.pop(name, None)
+            if isinstance(column, memoryview):
+                column.release()
+        if getattr(self, '_mm', None) is not None:
+            try:
+                self._mm.close()
+            except BufferError:
+                pass  # a caller still holds a slice of a column, the map is unmapped once that is collected
+            self._mm = None
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+
+def write_btrace(records: typing.Iterable[typing.Tuple[str, int, int, int]], out_path: str) -> int:
+    """
+    Writes ``(opcode, pc, target, taken)`` records to ``out_path`` in the binary format. Columns are spilled to
+    temporary files as they grow so memory use stays flat regardless of trace length. Returns the number of branches.
+    """
+    opcode_ids = dict()  # type: typing.Dict[str, int]
+    columns = [array('Q'), array('Q'), array('B'), array('B')]
+    spills = [tempfile.TemporaryFile() for _ in columns]
+    count = 0
+
+    def spill():
+        for column, spill_fp in zip(columns, spills):
+            if sys.byteorder != 'little':
+                column.byteswap()
+            column.tofile(spill_fp)
+            del column[:]
+
+    try:
+        pcs, targets, ops, outcomes = columns
+        for opcode, pc, target, taken in records:
+            if opcode not in opcode_ids:
+                if len(opcode_ids) == MAX_OPCODES:
+                    raise ValueError(f'binary traces support at most {MAX_OPCODES} distinct opcodes')
+                opcode_ids[opcode] = len(opcode_ids)
+            pcs.append(pc)
+            targets.append(target)
+            ops.append(opcode_ids[opcode])
+            outcomes.append(taken)
+            count += 1
+            if len(outcomes) == _SPILL_SIZE:
+                spill()
+        spill()
+
+        with open(out_path, 'wb') as of:
+            of.write(HEADER.pack(MAGIC, count, len(opcode_ids), 0))
+            table = b''
+            for opcode in opcode_ids:
+                name = opcode.encode('utf-8')
+                table += bytes([len(name)]) + name
+            of.write(table + b'\x00' * _pad(len(table)))
+            for spill_fp in spills:
+                spill_fp.seek(0)
+                shutil.copyfileobj(spill_fp, of)
+    finally:
+        for spill_fp in spills:
+            spill_fp.close()
+
+    return count
+
+
+def _stem(path: str) -> str:
+    root, ext = os.path.splitext(path)
+    if ext in ('.gz', '.xz', '.bz2', '.zst'):
+        root = os.path.splitext(root)[0]
+    return root
+
+
+def convert(trace: str, out_path: str = None) -> str:
+    """
+    Converts the (possibly compressed) text trace ``trace`` into a binary trace, written next to it with a ``.btrace``
+    extension unless ``out_path`` is given. Returns the path written.
+    """
+    import tracereader  # imported here as the reader itself dispatches back to this module
+
+    if out_path is None:
+        out_path = _stem(trace) + EXTENSION
+    write_btrace(tracereader.read_trace(trace), out_path)
+    return out_path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Convert text opcode,pc,target,taken traces into the compact binary .btrace format read by "
+                    "branch.py."
+    )
+    parser.add_argument(
+        'traces',
+        help="the text trace(s) to convert",
+        nargs='+'
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="output file (single trace) or directory (several traces). defaults to alongside each input"
+    )
+
+    parsed = parser.parse_args()
+
+    for trace_file in parsed.traces:
+        out_file = parsed.output
+        if out_file and (len(parsed.traces) > 1 or os.path.isdir(out_file)):
+            os.makedirs(out_file, exist_ok=True)
+            out_file = os.path.join(out_file, _stem(os.path.basename(trace_file)) + EXTENSION)
+        print(f'{trace_file} -> {convert(trace_file, out_file)}')
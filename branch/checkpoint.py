@@ -0,0 +1,124 @@
+"""
+Resumable evaluation.
+
+A long run lost to a crash, a reboot or a Ctrl-C normally has to start over. With a :class:`Checkpointer`
+(``--checkpoint PATH`` on the command line) the state of every predictor (see ``AbstractBasePredictor.save_state``),
+their counters and the position in the trace are saved to the checkpoint file every ``--checkpoint-every`` branches,
+along with the results of the traces already finished. Running the same command again picks up from the last
+checkpoint: finished traces aren't evaluated again and the interrupted one continues from the saved position, skipping
+what came before it (binary traces are sliced, text traces skipped without being parsed). The results are the same as
+those of an uninterrupted run.
+
+A checkpoint is only used by the same predictors with the same arguments, and a trace's progress only if the trace
+hasn't changed since (same size and modification time). The file is removed once the run completes.
+"""
+
+import copy
+import os
+import pickle
+import sys
+import typing
+
+from predictors import AbstractBasePredictor
+
+DEFAULT_CHECKPOINT_EVERY = 10000000
+
+
+def trace_stamp(trace: str) -> typing.Tuple[int, int]:
+    from tracereader import split_range
+
+    stat = os.stat(split_range(trace)[0])
+    return stat.st_size, stat.st_mtime_ns
+
+
+class Checkpointer:
+    """
+    Evaluates predictors trace by trace, saving checkpoints to ``path`` every ``every`` branches and resuming from the
+    one found there. ``resumed[trace]`` gives the position each resumed trace was picked up from.
+    """
+    def __init__(self, path: str, every: int = DEFAULT_CHECKPOINT_EVERY):
+        self.path = path
+        self.every = every
+        self.state = None  # type: typing.Optional[typing.Dict]
+        self.resumed = dict()  # type: typing.Dict[str, int]
+
+    def _load(self, predictors: typing.List[AbstractBasePredictor]) -> typing.Dict:
+        specs = [(predictor.name(), predictor.init_args, predictor.init_kwargs) for predictor in predictors]
+        if self.state is not None and self.state['predictors'] == specs:
+            return self.state
+
+        self.state = None
+        if os.path.exists(self.path):
+            with open(self.path, 'rb') as fp:
+                state = pickle.load(fp)
+            if state['predictors'] == specs:
+                self.state = state
+            else:
+                print(f"warning: ignoring checkpoint '{self.path}', it was saved by other predictors", file=sys.stderr)
+        if self.state is None:
+            self.state = {'predictors': specs, 'completed': dict(), 'trace': None}
+        return self.state
+
+    def _save(self):
+        # written aside and moved into place, so an interruption never leaves a torn checkpoint
+        with open(self.path + '.tmp', 'wb') as fp:
+            pickle.dump(self.state, fp)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(self.path + '.tmp', self.path)
+
+    def evaluate(self, predictors: typing.List[AbstractBasePredictor], trace: str,
+                 reset=True) -> typing.List[typing.Dict]:
+        """
+        Evaluates several predictors on ``trace`` in a single pass like ``test_predictors_single_trace``, resuming
+        from and saving checkpoints.
+        """
+        from branch import new_results, simulate_chunk
+        from tracereader import read_chunks, read_ranges
+
+        state = self._load(predictors)
+        stamp = trace_stamp(trace)
+        completed = state['completed'].get(trace)
+        if completed is not None and completed[0] == stamp:
+            self.resumed[trace] = completed[1][0]['total_predictions'] if completed[1] else 0
+            return copy.deepcopy(completed[1])
+
+        position = 0
+        if state['trace'] == trace and state['stamp'] == stamp:
+            position = state['position']
+            all_results = state['results']
+            for predictor, predictor_state in zip(predictors, state['states']):
+                predictor.load_state(predictor_state)
+            self.resumed[trace] = position
+            print(f'resuming {trace} from branch {position}', file=sys.stderr)
+            chunks = (chunk for _, chunk in read_ranges(trace, [(position, sys.maxsize)]))
+        else:
+            if reset:
+                for predictor in predictors:
+                    predictor.reset()
+            all_results = [new_results(trace) for _ in predictors]
+            chunks = read_chunks(trace)
+
+        since = 0
+        for chunk in chunks:
+            for predictor, results in zip(predictors, all_results):
+                simulate_chunk(predictor, results, chunk)
+            position += len(chunk[0])
+            since += len(chunk[0])
+            if since >= self.every:
+                state.update(trace=trace, stamp=stamp, position=position, results=all_results,
+                             states=[predictor.save_state() for predictor in predictors])
+                self._save()
+                since = 0
+
+        state['completed'][trace] = (stamp, copy.deepcopy(all_results))
+        state.update(trace=None, stamp=None, position=None, results=None, states=None)
+        self._save()
+        return all_results
+
+    def finish(self):
+        """
+        Removes the checkpoint once the whole run has completed.
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+
+"""
+Seekable offset index of a text trace.
+
+Reading a region of a text trace, such as the branches after the first 10M of initialisation, would otherwise mean
+reading every line before it. The offset index maps every ``interval``-th branch of the trace (its non-blank lines,
+blank lines are skipped as by the parser) to its byte offset in the (decompressed) text and records the trace's
+length, so readers can jump straight to the index point before a region and only skip the lines from there. Plain
+text traces are seeked to the offset directly. Compressed traces are fast-forwarded to it by decompressing without
+splitting or parsing a single line, which is far cheaper than reading lines but still linear in the offset; convert
+traces which are sliced often to ``.btrace`` (see btrace.py), which need no index at all.
+
+An index is built the first time a region of a trace is read and saved next to it as a hidden
+``.<trace name>.offsets`` file (see sidecar.py). Build indexes ahead of time, and print the length of each trace, with
+``./offsetindex.py traces/*.trace``.
+"""
+
+import argparse
+import typing
+from array import array
+
+from sidecar import TraceIndex
+from tracereader import open_binary
+
+DEFAULT_INTERVAL = 1 << 16
+
+
+class OffsetIndex(TraceIndex):
+    """
+    Byte offsets of every ``interval``-th branch of a text trace, and its number of branches.
+    """
+    extension = '.offsets'
+    version = 2
+
+    def __init__(self, trace: str, interval: int = DEFAULT_INTERVAL):
+        super().__init__(trace)
+        self.interval = interval
+        self.offsets = array('Q')
+        self.length = 0
+
+    @classmethod
+    def build(cls, trace: str, interval: int = DEFAULT_INTERVAL) -> 'OffsetIndex':
+        index = cls(trace, interval)
+        offsets = index.offsets
+        offset = length = 0
+        with open_binary(trace) as fp:
+            for line in fp:
+                if not line.isspace():
+                    if length % interval == 0:
+                        offsets.append(offset)
+                    length += 1
+                offset += len(line)
+        index.length = length
+        return index
+
+    def to_json(self) -> typing.Dict:
+        return {'interval': self.interval, 'length': self.length, 'offsets': self.offsets.tolist()}
+
+    @classmethod
+    def from_json(cls, trace: str, data: typing.Dict) -> 'OffsetIndex':
+        index = cls(trace, data['interval'])
+        index.offsets = array('Q', data['offsets'])
+        index.length = data['length']
+        return index
+
+    def seek_point(self, branch: int) -> typing.Tuple[int, int]:
+        """
+        Returns the last index point at or before ``branch``, as its branch number and byte offset.
+        """
+        point = min(branch // self.interval, len(self.offsets) - 1)
+        if point < 0:
+            return 0, 0
+        return point * self.interval, self.offsets[point]
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the offset index of text traces, so regions of them (-t 'trace[start:end]') can be read "
+                    "without reading everything before, and print the number of branches in each."
+    )
+    parser.add_argument(
+        'traces',
+        help="the text traces to index",
+        nargs='+'
+    )
+    parser.add_argument(
+        "--rebuild",
+        help="rebuild indexes even if they are up to date",
+        action="store_true"
+    )
+
+    parsed = parser.parse_args()
+
+    for trace_file in parsed.traces:
+        offset_index = OffsetIndex.load(trace_file) if not parsed.rebuild else None
+        if offset_index is None:
+            offset_index = OffsetIndex.build(trace_file)
+            offset_index.save()
+        print(f'{trace_file}: {offset_index.length} branches, {len(offset_index.offsets)} index points')
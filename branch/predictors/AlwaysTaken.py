@@ -1,10 +1,12 @@
-from . import AbstractBasePredictor, Predict
+from . import AbstractBasePredictor, Predict, numpy
 
 
 class AlwaysTaken(AbstractBasePredictor):
     """
     A static predictor that assumes all branches are always taken.
     """
+    stateless = True
+
     def __init__(self, **kwargs):
         super().__init__()
 
@@ -16,3 +18,8 @@ class AlwaysTaken(AbstractBasePredictor):
 
     def reset(self):
         return
+
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        if numpy is not None:
+            return numpy.full(len(outcomes), Predict.TAKEN, dtype=numpy.uint8)
+        return bytes([Predict.TAKEN]) * len(outcomes)
@@ -1,4 +1,6 @@
-from . import AbstractBasePredictor, Predict
+import operator
+
+from . import AbstractBasePredictor, Predict, numpy
 
 
 class BackTakeForwardNot(AbstractBasePredictor):
@@ -6,6 +8,8 @@ class BackTakeForwardNot(AbstractBasePredictor):
     A static predictor that assumes backward branches (usually loops) are taken, while forward branches
     (e.g., if conditions) are not taken.
     """
+    stateless = True
+
     def __init__(self, **kwargs):
         super().__init__()
 
@@ -18,3 +22,10 @@ class BackTakeForwardNot(AbstractBasePredictor):
 
     def reset(self):
         return
+
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        # Predict.TAKEN == 1 and Predict.NOT_TAKEN == 0, so the comparison itself is the prediction
+        if numpy is not None:
+            backward = numpy.asarray(targets, dtype=numpy.uint64) < numpy.asarray(pcs, dtype=numpy.uint64)
+            return backward.astype(numpy.uint8)
+        return bytes(map(operator.lt, targets, pcs))
@@ -1,4 +1,4 @@
-from predictors import AbstractBasePredictor, Predict
+from predictors import AbstractBasePredictor, Predict, counter_array
 
 
 class Bimodal(AbstractBasePredictor):
@@ -6,25 +6,53 @@ class Bimodal(AbstractBasePredictor):
     A dynamic predictor that uses an n-bit saturating counter to predict the next state. 0 indicates strongly not
     taken, while 2^n-1 indicates strongly taken. Updates decrease or increase the counter based on the actual outcome.
     """
+    __slots__ = ('counter_bits', 'initial_state', 'prediction_table', 'table_size', 'threshold', 'saturated')
+
     def __init__(self, counter_bits: int, table_size: int, initial_state: int = 0, **kwargs):
         super().__init__()
         assert 0 <= initial_state < 2 ** counter_bits, f"Initial state must be in range [0, {2 ** counter_bits})"
         self.counter_bits = counter_bits
         self.initial_state = initial_state
-        self.prediction_table = [initial_state] * table_size
+        self.table_size = table_size
+        self.threshold = 2 ** (counter_bits - 1)
+        self.saturated = (2 ** counter_bits) - 1
+        self.prediction_table = counter_array(initial_state, table_size, counter_bits)
 
     def predict(self, opcode: str, current_pc: int, target_pc: int) -> Predict:
-        index = current_pc % len(self.prediction_table)
-        state = self.prediction_table[index]
-        return Predict.TAKEN if state >= 2 ** (self.counter_bits - 1) else Predict.NOT_TAKEN
+        state = self.prediction_table[current_pc % self.table_size]
+        return Predict.TAKEN if state >= self.threshold else Predict.NOT_TAKEN
 
     def update(self, opcode: str, current_pc: int, target_pc: int, result: Predict):
-        index = current_pc % len(self.prediction_table)
+        index = current_pc % self.table_size
         state = self.prediction_table[index]
         if result == Predict.TAKEN:
-            self.prediction_table[index] = min(state + 1, (2 ** self.counter_bits) - 1)
-        else:
-            self.prediction_table[index] = max(state - 1, 0)
+            if state < self.saturated:
+                self.prediction_table[index] = state + 1
+        elif state > 0:
+            self.prediction_table[index] = state - 1
 
     def reset(self):
-        self.prediction_table = [self.initial_state] * len(self.prediction_table)
+        self.prediction_table = counter_array(self.initial_state, self.table_size, self.counter_bits)
+
+    def storage_bits(self) -> int:
+        return self.table_size * self.counter_bits
+
+    def table_indices(self, pcs, outcomes):
+        size = self.table_size
+        return [pc % size for pc in pcs]
+
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        table, size, threshold, saturated = self.prediction_table, self.table_size, self.threshold, self.saturated
+        taken = Predict.TAKEN
+        predictions = bytearray(len(outcomes))
+        for i, (pc, result) in enumerate(zip(pcs, outcomes)):
+            index = pc % size
+            state = table[index]
+            if state >= threshold:
+                predictions[i] = taken
+            if result == taken:
+                if state < saturated:
+                    table[index] = state + 1
+            elif state > 0:
+                table[index] = state - 1
+        return predictions
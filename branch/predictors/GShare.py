@@ -7,6 +7,8 @@ class GShare(TwoLevel):
     A dynamic predictor similar to the Two-Level predictor that uses the XOR of the PC address and the global BHR
     to index into a PHT. The PHT houses a bimodal saturating counter which predicts the outcome of that branch.
     """
+    __slots__ = ()
+
     def __init__(self,
                  history_size_bits: int,
                  pht_counter_bits: int = 2,
@@ -24,28 +26,54 @@ class GShare(TwoLevel):
         # no need to change anything in init
 
     def predict(self, opcode: str, current_pc: int, target_pc: int) -> Predict:
-        bhr_index = 0
-        history = self.bhr[bhr_index]       # Set bhr_index to 0?           
-        pht_index = ((history << self.pc_bits) ^ (current_pc & ((2 ** self.pc_bits) - 1))) % len(self.pht)
-        pht_state = self.pht[pht_index]
-        return Predict.TAKEN if pht_state >= 2 ** (self.pht_counter_bits - 1) else Predict.NOT_TAKEN
+        history = self.bhr[0]
+        pht_index = ((history << self.pc_bits) ^ (current_pc & self.pc_mask)) % self.num_pht_entries
+        return Predict.TAKEN if self.pht[pht_index] >= self.threshold else Predict.NOT_TAKEN
 
     def update(self, opcode: str, current_pc: int, target_pc: int, result: Predict):
-        bhr_index = 0
-        history = self.bhr[bhr_index]
-        pht_index = ((history << self.pc_bits) ^ (current_pc & ((2 ** self.pc_bits) - 1))) % len(self.pht)
+        history = self.bhr[0]
+        pht_index = ((history << self.pc_bits) ^ (current_pc & self.pc_mask)) % self.num_pht_entries
         pht_state = self.pht[pht_index]
 
         if result == Predict.TAKEN:
-            self.pht[pht_index] = min(pht_state + 1, (2 ** self.pht_counter_bits) - 1)
+            if pht_state < self.saturated:
+                self.pht[pht_index] = pht_state + 1
+            self.bhr[0] = ((history << 1) | 1) & self.history_mask
         else:
-            self.pht[pht_index] = max(pht_state - 1, 0)
+            if pht_state > 0:
+                self.pht[pht_index] = pht_state - 1
+            self.bhr[0] = (history << 1) & self.history_mask
 
-        history <<= 1
-        history |= 1 if result == Predict.TAKEN else 0
-        history &= (2 ** self.history_size_bits) - 1
-        self.bhr[bhr_index] = history
+    def table_indices(self, pcs, outcomes):
+        num_pht_entries, pc_bits, pc_mask, history_mask = \
+            self.num_pht_entries, self.pc_bits, self.pc_mask, self.history_mask
+        history = self.bhr[0]
+        indices = []
+        for pc, result in zip(pcs, outcomes):
+            indices.append(((history << pc_bits) ^ (pc & pc_mask)) % num_pht_entries)
+            history = ((history << 1) | result) & history_mask
+        return indices
 
-    def reset(self):
-        self.bhr = [self.initial_bhr_state] * len(self.bhr)
-        self.pht = [self.initial_pht_state] * len(self.pht)
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        bhr, pht = self.bhr, self.pht
+        num_pht_entries, pc_bits, pc_mask, history_mask = \
+            self.num_pht_entries, self.pc_bits, self.pc_mask, self.history_mask
+        threshold, saturated = self.threshold, self.saturated
+        taken = Predict.TAKEN
+        history = bhr[0]
+        predictions = bytearray(len(outcomes))
+        for i, (pc, result) in enumerate(zip(pcs, outcomes)):
+            pht_index = ((history << pc_bits) ^ (pc & pc_mask)) % num_pht_entries
+            state = pht[pht_index]
+            if state >= threshold:
+                predictions[i] = taken
+            if result == taken:
+                if state < saturated:
+                    pht[pht_index] = state + 1
+                history = ((history << 1) | 1) & history_mask
+            else:
+                if state > 0:
+                    pht[pht_index] = state - 1
+                history = (history << 1) & history_mask
+        bhr[0] = history
+        return predictions
@@ -1,4 +1,4 @@
-from predictors import AbstractBasePredictor, Predict
+from predictors import AbstractBasePredictor, Predict, counter_array
 
 
 class TwoLevel(AbstractBasePredictor):
@@ -7,6 +7,10 @@ class TwoLevel(AbstractBasePredictor):
     (or BHR) which stores the history of that branch. The history of the branch is then used to index into a Pattern
     History Table (or PHT) which stores a bimodal saturating counter for each pattern.
     """
+    __slots__ = ('bhr', 'pht', 'pc_bits', 'history_size_bits', 'pht_counter_bits', 'initial_bhr_state',
+                 'initial_pht_state', 'num_bhrs', 'num_pht_entries', 'pc_mask', 'history_mask', 'threshold',
+                 'saturated')
+
     def __init__(self,
                  num_bhrs: int,
                  history_size_bits: int,
@@ -23,37 +27,81 @@ class TwoLevel(AbstractBasePredictor):
         assert num_pht_entries >= 2 ** history_size_bits, \
             f"The number of PHT entries must be greater than or equal to the number of history bits"
 
-        self.bhr = [initial_bhr_state] * num_bhrs
-        self.pht = [initial_pht_state] * num_pht_entries
+        self.bhr = counter_array(initial_bhr_state, num_bhrs, history_size_bits)
+        self.pht = counter_array(initial_pht_state, num_pht_entries, pht_counter_bits)
         self.pc_bits = num_pht_entries - (2 ** history_size_bits)
         self.history_size_bits = history_size_bits
         self.pht_counter_bits = pht_counter_bits
         self.initial_bhr_state = initial_bhr_state
         self.initial_pht_state = initial_pht_state
 
+        # fixed after construction, so computed once instead of on every prediction
+        self.num_bhrs = num_bhrs
+        self.num_pht_entries = num_pht_entries
+        self.pc_mask = (2 ** self.pc_bits) - 1
+        self.history_mask = (2 ** history_size_bits) - 1
+        self.threshold = 2 ** (pht_counter_bits - 1)
+        self.saturated = (2 ** pht_counter_bits) - 1
+
     def predict(self, opcode: str, current_pc: int, target_pc: int) -> Predict:
-        bhr_index = current_pc % len(self.bhr)
-        history = self.bhr[bhr_index]
-        pht_index = ((history << self.pc_bits) | (current_pc & ((2 ** self.pc_bits) - 1))) % len(self.pht)
-        pht_state = self.pht[pht_index]
-        return Predict.TAKEN if pht_state >= 2 ** (self.pht_counter_bits - 1) else Predict.NOT_TAKEN
+        history = self.bhr[current_pc % self.num_bhrs]
+        pht_index = ((history << self.pc_bits) | (current_pc & self.pc_mask)) % self.num_pht_entries
+        return Predict.TAKEN if self.pht[pht_index] >= self.threshold else Predict.NOT_TAKEN
 
     def update(self, opcode: str, current_pc: int, target_pc: int, result: Predict):
-        bhr_index = current_pc % len(self.bhr)
+        bhr_index = current_pc % self.num_bhrs
         history = self.bhr[bhr_index]
-        pht_index = ((history << self.pc_bits) | (current_pc & ((2 ** self.pc_bits) - 1))) % len(self.pht)
+        pht_index = ((history << self.pc_bits) | (current_pc & self.pc_mask)) % self.num_pht_entries
         pht_state = self.pht[pht_index]
 
         if result == Predict.TAKEN:
-            self.pht[pht_index] = min(pht_state + 1, (2 ** self.pht_counter_bits) - 1)
+            if pht_state < self.saturated:
+                self.pht[pht_index] = pht_state + 1
+            self.bhr[bhr_index] = ((history << 1) | 1) & self.history_mask
         else:
-            self.pht[pht_index] = max(pht_state - 1, 0)
-
-        history <<= 1
-        history |= 1 if result == Predict.TAKEN else 0
-        history &= (2 ** self.history_size_bits) - 1
-        self.bhr[bhr_index] = history
+            if pht_state > 0:
+                self.pht[pht_index] = pht_state - 1
+            self.bhr[bhr_index] = (history << 1) & self.history_mask
 
     def reset(self):
-        self.bhr = [self.initial_bhr_state] * len(self.bhr)
-        self.pht = [self.initial_pht_state] * len(self.pht)
+        self.bhr = counter_array(self.initial_bhr_state, self.num_bhrs, self.history_size_bits)
+        self.pht = counter_array(self.initial_pht_state, self.num_pht_entries, self.pht_counter_bits)
+
+    def storage_bits(self) -> int:
+        return self.num_bhrs * self.history_size_bits + self.num_pht_entries * self.pht_counter_bits
+
+    def table_indices(self, pcs, outcomes):
+        bhr = self.bhr[:]  # the histories evolve with the actual outcomes only, replayed here on a copy
+        num_bhrs, num_pht_entries = self.num_bhrs, self.num_pht_entries
+        pc_bits, pc_mask, history_mask = self.pc_bits, self.pc_mask, self.history_mask
+        indices = []
+        for pc, result in zip(pcs, outcomes):
+            bhr_index = pc % num_bhrs
+            history = bhr[bhr_index]
+            indices.append(((history << pc_bits) | (pc & pc_mask)) % num_pht_entries)
+            bhr[bhr_index] = ((history << 1) | result) & history_mask
+        return indices
+
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        bhr, pht = self.bhr, self.pht
+        num_bhrs, num_pht_entries = self.num_bhrs, self.num_pht_entries
+        pc_bits, pc_mask, history_mask = self.pc_bits, self.pc_mask, self.history_mask
+        threshold, saturated = self.threshold, self.saturated
+        taken = Predict.TAKEN
+        predictions = bytearray(len(outcomes))
+        for i, (pc, result) in enumerate(zip(pcs, outcomes)):
+            bhr_index = pc % num_bhrs
+            history = bhr[bhr_index]
+            pht_index = ((history << pc_bits) | (pc & pc_mask)) % num_pht_entries
+            state = pht[pht_index]
+            if state >= threshold:
+                predictions[i] = taken
+            if result == taken:
+                if state < saturated:
+                    pht[pht_index] = state + 1
+                bhr[bhr_index] = ((history << 1) | 1) & history_mask
+            else:
+                if state > 0:
+                    pht[pht_index] = state - 1
+                bhr[bhr_index] = (history << 1) & history_mask
+        return predictions
@@ -1,9 +1,56 @@
+import pickle
+import typing
+from array import array
+
+try:
+    import numpy
+except ImportError:  # numpy is optional, predictors fall back to pure Python batch kernels without it
+    numpy = None
+
+
+def counter_array(initial_state: int, size: int, bits: int):
+    """
+    Returns a compact table of ``size`` entries, each wide enough for a ``bits``-bit value, all set to
+    ``initial_state``. Falls back to a plain list for values too wide for a machine integer.
+    """
+    for typecode in ('B', 'H', 'I', 'L', 'Q'):
+        if bits <= 8 * array(typecode).itemsize:
+            return array(typecode, [initial_state]) * size
+    return [initial_state] * size
+
+
+def _defined_by(cls: type, name: str) -> type:
+    # the class of ``cls.__mro__`` the attribute ``name`` of ``cls`` comes from
+    return next(klass for klass in cls.__mro__ if name in vars(klass))
+
+
+def _written_against(cls: type, name: str, methods: typing.Iterable[str]) -> bool:
+    # whether the class defining ``name`` is the one, or a subclass of the ones, defining the effective ``methods``:
+    # otherwise a subclass overrides one of them below it and ``name`` doesn't know about the override
+    owner = _defined_by(cls, name)
+    return all(issubclass(owner, _defined_by(cls, method)) for method in methods)
+
+
 class Predict:
     NOT_TAKEN = 0
     TAKEN = 1
 
 
 class AbstractBasePredictor:
+    __slots__ = ('init_args', 'init_kwargs')
+
+    # set by predictors whose prediction for a branch depends only on its opcode, PC and target, never on history;
+    # the driver may then evaluate them per static branch site (see siteindex.py) instead of per dynamic branch. Only
+    # honoured on the class defining predict and update, see is_stateless
+    stateless = False
+
+    def __new__(cls, *args, **kwargs):
+        # remember the constructor arguments, they identify the configuration for result caching and reporting
+        self = super().__new__(cls)
+        self.init_args = args
+        self.init_kwargs = kwargs
+        return self
+
     def __init__(self, **kwargs):
         pass
 
@@ -16,6 +63,76 @@ class AbstractBasePredictor:
     def reset(self):
         raise NotImplementedError
 
+    def run_trace(self, pcs, targets, opcodes, outcomes):
+        """
+        Batch entry point: predicts and then updates on every branch given as parallel columns of PCs, target PCs,
+        opcodes and actual outcomes, returning a sequence of predictions (one ``Predict`` value per branch). Predictor
+        state carries over between calls, so a trace may be fed in consecutive chunks. Subclasses may override this
+        with a faster implementation; the default simply loops over ``predict`` and ``update``.
+        """
+        predictions = bytearray(len(outcomes))
+        predict, update = self.predict, self.update
+        for i, (opcode, pc, target, result) in enumerate(zip(opcodes, pcs, targets, outcomes)):
+            predictions[i] = predict(opcode, pc, target)
+            update(opcode, pc, target, result)
+        return predictions
+
+    def table_indices(self, pcs, outcomes):
+        """
+        Returns the prediction table slot each branch, given as columns of PCs and actual outcomes, would be predicted
+        from if the chunk were run from the current state, without changing that state. Used to measure aliasing
+        between branches (see siteprofile.py); predictors without a table return None.
+        """
+        return None
+
+    def save_state(self) -> bytes:
+        """
+        Returns a snapshot of the predictor's state, its tables, histories and everything else it holds, which
+        ``load_state`` restores into a predictor of the same configuration, e.g. to resume an interrupted run. The
+        default pickles every attribute; predictors holding something that can't be pickled must override both.
+        """
+        names = [name for cls in type(self).__mro__ for name in getattr(cls, '__slots__', ())
+                 if name not in AbstractBasePredictor.__slots__ and name != '__dict__']
+        state = {name: getattr(self, name) for name in names if hasattr(self, name)}
+        state.update(getattr(self, '__dict__', dict()))
+        return pickle.dumps((self.name(), self.init_args, self.init_kwargs, state))
+
+    def load_state(self, data: bytes):
+        """
+        Restores a snapshot taken by ``save_state``. Raises ValueError if it was taken of another configuration.
+        """
+        name, args, kwargs, state = pickle.loads(data)
+        if (name, args, kwargs) != (self.name(), self.init_args, self.init_kwargs):
+            raise ValueError(f'the state of {name} {kwargs} can\'t be loaded into {self.name()} {self.init_kwargs}')
+        for attribute, value in state.items():
+            setattr(self, attribute, value)
+
+    def storage_bits(self) -> int:
+        """
+        Returns the number of bits of state a hardware implementation of this predictor would need, so its accuracy
+        can be weighed against its budget. Stateless predictors need none.
+        """
+        return 0
+
+    @classmethod
+    def supports_batch(cls) -> bool:
+        """
+        Returns whether this predictor overrides ``run_trace`` with its own batch implementation, written for its
+        effective ``predict``, ``update`` and ``reset``. A subclass overriding any of those inherits a ``run_trace``
+        which would ignore the override, so it runs branch by branch instead.
+        """
+        return cls.run_trace is not AbstractBasePredictor.run_trace and \
+            _written_against(cls, 'run_trace', ('predict', 'update', 'reset'))
+
+    @classmethod
+    def is_stateless(cls) -> bool:
+        """
+        Returns whether this predictor is ``stateless``, as declared by the class defining its effective ``predict``
+        and ``update``. A subclass overriding either, e.g. to keep some history, inherits ``stateless`` without
+        having declared it, so it isn't taken for stateless.
+        """
+        return cls.stateless and _written_against(cls, 'stateless', ('predict', 'update'))
+
     @classmethod
     def name(cls):
         return cls.__name__
@@ -0,0 +1,160 @@
+"""
+Throughput and hot-path profiling of driver runs.
+
+A :class:`Profiler` passed to ``test_predictors_single_trace`` times every pass over a trace: wall and CPU time,
+branches per second and peak RSS, plus a breakdown of where the time went:
+
+    parse_seconds        waiting on the trace reader (decompression, parsing or slicing chunks)
+    predict_seconds      in ``predictor.predict`` (per-branch predictors)
+    update_seconds       in ``predictor.update`` (per-branch predictors)
+    run_trace_seconds    in ``predictor.run_trace`` (batch predictors, where predict and update can't be separated)
+    site_index_seconds   evaluating stateless predictors from the trace's site index (see siteindex.py)
+    accounting_seconds   tallying the predictions into the result counters
+
+Timing every call of a per-branch predictor adds some overhead of its own, which lands in predict/update. Parse, wall
+and CPU time are shared by every predictor evaluated in the same pass. Optionally, each pass is also run under
+cProfile and its stats dumped into a directory, one ``.prof`` file per trace, for inspection with ``pstats`` or
+snakeviz.
+"""
+
+import cProfile
+import os
+import time
+import typing
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+from predictors import AbstractBasePredictor
+
+PHASES = ['parse_seconds', 'predict_seconds', 'update_seconds', 'run_trace_seconds', 'site_index_seconds',
+          'accounting_seconds']
+PROFILE_COLUMNS = ['branches', 'wall_seconds', 'cpu_seconds', 'branches_per_second'] + PHASES + ['peak_rss_kb']
+
+
+def peak_rss_kb() -> typing.Optional[int]:
+    """
+    Returns the peak resident set size of this process in KiB, or None where it can't be measured.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if os.uname().sysname == 'Darwin' else peak  # bytes on macOS, KiB elsewhere
+
+
+class TraceProfile:
+    """
+    Timings of one pass over a trace, kept per predictor evaluated in that pass.
+    """
+    def __init__(self, trace: str, num_predictors: int, stats_dir: str = None):
+        self.trace = trace
+        self.branches = 0
+        self.parse_seconds = 0.0
+        self.phases = [dict.fromkeys(PHASES[1:], 0.0) for _ in range(num_predictors)]
+        self.stats_dir = stats_dir
+        self._cprofile = cProfile.Profile() if stats_dir else None
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        if self._cprofile is not None:
+            self._cprofile.enable()
+
+    def timed_chunks(self, chunks: typing.Iterable):
+        """
+        Wraps a chunk iterator, adding the time spent waiting on each chunk to ``parse_seconds``.
+        """
+        chunks = iter(chunks)
+        while True:
+            start = time.perf_counter()
+            try:
+                chunk = next(chunks)
+            except StopIteration:
+                self.parse_seconds += time.perf_counter() - start
+                return
+            self.parse_seconds += time.perf_counter() - start
+            self.branches += len(chunk[3])
+            yield chunk
+
+    def simulate_chunk(self, i: int, predictor: AbstractBasePredictor, results: typing.Dict, chunk):
+        """
+        The timed equivalent of ``branch.simulate_chunk`` for the ``i``th predictor of the pass.
+        """
+        from branch import tally_predictions
+
+        opcodes, pcs, targets, outcomes = chunk
+        phases = self.phases[i]
+        clock = time.perf_counter
+        if predictor.supports_batch():
+            start = clock()
+            predictions = predictor.run_trace(pcs, targets, opcodes, outcomes)
+            phases['run_trace_seconds'] += clock() - start
+        else:
+            predictions = bytearray(len(outcomes))
+            predict, update = predictor.predict, predictor.update
+            predict_seconds = update_seconds = 0.0
+            for j, (opcode, pc, target, result) in enumerate(zip(opcodes, pcs, targets, outcomes)):
+                start = clock()
+                predictions[j] = predict(opcode, pc, target)
+                middle = clock()
+                update(opcode, pc, target, result)
+                end = clock()
+                predict_seconds += middle - start
+                update_seconds += end - middle
+            phases['predict_seconds'] += predict_seconds
+            phases['update_seconds'] += update_seconds
+
+        start = clock()
+        tally_predictions(results, opcodes, predictions, outcomes)
+        phases['accounting_seconds'] += clock() - start
+
+    def evaluate_index(self, i: int, index, predictor: AbstractBasePredictor, results: typing.Dict):
+        """
+        The timed equivalent of ``SiteIndex.evaluate`` for the ``i``th predictor of the pass.
+        """
+        start = time.perf_counter()
+        index.evaluate(predictor, results)
+        self.phases[i]['site_index_seconds'] += time.perf_counter() - start
+        self.branches = self.branches or results['total_predictions']
+
+    def finish(self) -> typing.List[typing.Dict]:
+        """
+        Stops timing the pass and returns one profile dict (keyed by ``PROFILE_COLUMNS``) per predictor.
+        """
+        wall = time.perf_counter() - self._wall
+        cpu = time.process_time() - self._cpu
+        if self._cprofile is not None:
+            self._cprofile.disable()
+            os.makedirs(self.stats_dir, exist_ok=True)
+            name = os.path.normpath(self.trace).strip(os.sep).replace(os.sep, '_')
+            self._cprofile.dump_stats(os.path.join(self.stats_dir, f'{name}.prof'))
+
+        profiles = []
+        for phases in self.phases:
+            profile = {
+                'branches': self.branches,
+                'wall_seconds': wall,
+                'cpu_seconds': cpu,
+                'branches_per_second': self.branches / wall if wall else 0.0,
+                'parse_seconds': self.parse_seconds,
+            }
+            profile.update(phases)
+            profile['peak_rss_kb'] = peak_rss_kb()
+            profiles.append(profile)
+        return profiles
+
+
+class Profiler:
+    """
+    Collects a :class:`TraceProfile` for every trace evaluated, optionally dumping cProfile stats into ``stats_dir``.
+    ``profiles[trace]`` holds the per-predictor profile dicts of each finished trace.
+    """
+    def __init__(self, stats_dir: str = None):
+        self.stats_dir = stats_dir
+        self.profiles = dict()  # type: typing.Dict[str, typing.List[typing.Dict]]
+
+    def begin(self, trace: str, num_predictors: int) -> TraceProfile:
+        return TraceProfile(trace, num_predictors, self.stats_dir)
+
+    def end(self, trace_profile: TraceProfile):
+        self.profiles[trace_profile.trace] = trace_profile.finish()
@@ -0,0 +1,141 @@
+"""
+Persistent, content-addressed cache of evaluation results.
+
+Results of ``test_predictor_single_trace`` are stored in a SQLite database keyed by a hash of everything that can
+change them: the source of the predictor's module (and of every predictor class it inherits from), its constructor
+arguments, the contents of the trace and the ``reset`` flag. Editing unrelated code therefore keeps cached results
+valid, while touching the predictor or the trace invalidates them. Trace digests are remembered per (path, size,
+mtime), so unchanged traces are only hashed once. The least recently used entries are evicted once the cache grows
+past its entry or size limit.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import sqlite3
+import time
+import typing
+
+from predictors import AbstractBasePredictor
+from tracereader import split_range
+
+# bump whenever the layout of the result dict changes, invalidating every cached entry
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_PATH = os.path.join(
+    os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'branch', 'results.sqlite')
+DEFAULT_MAX_ENTRIES = 100000
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+_source_digests = dict()  # type: typing.Dict[type, str]
+
+
+def predictor_digest(predictor_class: typing.Type[AbstractBasePredictor]) -> str:
+    """
+    Returns a digest of the source files defining ``predictor_class`` and the classes it inherits from.
+    """
+    if predictor_class not in _source_digests:
+        digest = hashlib.sha256()
+        for cls in predictor_class.__mro__:
+            if cls is object:
+                continue
+            with open(inspect.getsourcefile(cls), 'rb') as fp:
+                digest.update(fp.read())
+        _source_digests[predictor_class] = digest.hexdigest()
+    return _source_digests[predictor_class]
+
+
+class ResultCache:
+    """
+    A SQLite-backed result cache which is safe to share between processes.
+    """
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES,
+                 max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=60)
+        with self._db:
+            self._db.execute('CREATE TABLE IF NOT EXISTS results '
+                             '(key TEXT PRIMARY KEY, result TEXT, size INTEGER, last_used REAL)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)')
+            self._db.execute('CREATE TABLE IF NOT EXISTS traces '
+                             '(path TEXT PRIMARY KEY, size INTEGER, mtime INTEGER, digest TEXT)')
+
+    def trace_digest(self, trace: str) -> str:
+        """
+        Returns a digest of the contents of ``trace``, re-hashing the file only if its size or mtime changed. The
+        digest of a region of interest of a trace (see ``tracereader.split_range``) also covers its bounds.
+        """
+        trace, low, high = split_range(trace)
+        region = f'[{low}:{"" if high is None else high}]' if (low, high) != (0, None) else ''
+        path = os.path.abspath(trace)
+        stat = os.stat(path)
+        row = self._db.execute('SELECT size, mtime, digest FROM traces WHERE path = ?', (path,)).fetchone()
+        if row is not None and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2] + region
+
+        digest = hashlib.sha256()
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                digest.update(block)
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO traces VALUES (?, ?, ?, ?)',
+                             (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+        return digest.hexdigest() + region
+
+    def key(self, predictor: AbstractBasePredictor, trace: str, reset: bool = True) -> str:
+        """
+        Returns the cache key for evaluating ``predictor`` on ``trace``.
+        """
+        identity = json.dumps([
+            CACHE_VERSION,
+            predictor.name(),
+            predictor_digest(type(predictor)),
+            [repr(arg) for arg in predictor.init_args],
+            {k: repr(v) for k, v in predictor.init_kwargs.items()},
+            self.trace_digest(trace),
+            bool(reset),
+        ], sort_keys=True)
+        return hashlib.sha256(identity.encode('utf-8')).hexdigest()
+
+    def get(self, key: str) -> typing.Optional[typing.Dict]:
+        row = self._db.execute('SELECT result FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._db:
+            self._db.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        return json.loads(row[0])
+
+    def put(self, key: str, result: typing.Dict):
+        blob = json.dumps(result)
+        with self._db:
+            self._db.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)', (key, blob, len(blob), time.time()))
+        self.evict()
+
+    def evict(self):
+        """
+        Drops least recently used results until the cache is within both its entry and size limits.
+        """
+        with self._db:
+            entries, size = self._db.execute('SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results').fetchone()
+            rows = self._db.execute('SELECT key, size FROM results ORDER BY last_used')
+            evicted = []
+            for key, entry_size in rows:
+                if entries <= self.max_entries and size <= self.max_bytes:
+                    break
+                evicted.append((key,))
+                entries -= 1
+                size -= entry_size
+            self._db.executemany('DELETE FROM results WHERE key = ?', evicted)
+
+    def clear(self):
+        with self._db:
+            self._db.execute('DELETE FROM results')
+            self._db.execute('DELETE FROM traces')
+
+    def close(self):
+        self._db.close()
@@ -0,0 +1,197 @@
+"""
+Sampled simulation of long traces.
+
+Simulating every branch of a trace of billions of branches only to learn a predictor's accuracy takes hours. A
+:class:`Sampler` (``--sample PERIOD`` on the command line) instead simulates one detailed interval of
+``--sample-size`` branches in every period of ``PERIOD`` branches, at the end of the period or, with
+``--sample-random``, at a random position within it. Each interval is preceded by a functional warmup window of
+``--sample-warmup`` branches which trains the predictor without being counted, so the interval starts from a state
+close to the one a full run would have reached; predictor state also carries over from one interval to the next. The
+rest of the trace is skipped: binary traces are sliced directly and text traces skipped without being parsed.
+
+The result counters only cover the detailed intervals. The sampling estimate added to the output gives the accuracy
+and misprediction rate, per thousand branches (``mpkb``, the traces don't count other instructions), with confidence
+bounds, and the fraction of the trace actually simulated. The bounds come from the spread of the per-interval
+accuracies (a ratio estimator over the intervals, with the finite population correction), so they are only
+meaningful with a good number of intervals; they don't cover any bias left by a warmup window too short for the
+predictor's tables.
+"""
+
+import math
+import random
+import typing
+from array import array
+
+from predictors import AbstractBasePredictor
+
+DEFAULT_SAMPLE_SIZE = 10000
+DEFAULT_WARMUP = 50000
+DEFAULT_CONFIDENCE = 0.95
+SAMPLING_COLUMNS = [
+    'mode',
+    'period',
+    'interval_branches',
+    'warmup_branches',
+    'intervals',
+    'detailed_branches',
+    'simulated_branches',
+    'trace_branches',
+    'simulated_fraction',
+    'confidence',
+    'accuracy',
+    'accuracy_low',
+    'accuracy_high',
+    'mpkb',
+    'mpkb_low',
+    'mpkb_high',
+]
+
+
+def normal_quantile(p: float) -> float:
+    """
+    Returns the ``p`` quantile of the standard normal distribution.
+    """
+    low, high = -10.0, 10.0
+    for _ in range(100):
+        middle = (low + high) / 2
+        if (1 + math.erf(middle / math.sqrt(2))) / 2 < p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def train(predictor: AbstractBasePredictor, chunk):
+    """
+    Runs ``predictor`` over one chunk of branches without counting its predictions.
+    """
+    opcodes, pcs, targets, outcomes = chunk
+    if predictor.supports_batch():
+        predictor.run_trace(pcs, targets, opcodes, outcomes)
+        return
+    predict, update = predictor.predict, predictor.update
+    for opcode, pc, target, taken_result in zip(opcodes, pcs, targets, outcomes):
+        predict(opcode, pc, target)
+        update(opcode, pc, target, taken_result)
+
+
+class Sampler:
+    """
+    Evaluates predictors on a sample of intervals of each trace. ``estimates[trace]`` holds the sampling estimate of
+    each trace evaluated, in predictor order.
+    """
+    def __init__(self, period: int, size: int = DEFAULT_SAMPLE_SIZE, warmup: int = DEFAULT_WARMUP,
+                 randomized: bool = False, seed: int = 0, confidence: float = DEFAULT_CONFIDENCE):
+        if size < 1 or warmup < 0 or size + warmup > period:
+            raise ValueError(f'the sample size ({size}) and warmup ({warmup}) must fit in the period ({period})')
+        if not 0 < confidence < 1:
+            raise ValueError(f'the confidence ({confidence}) must be between 0 and 1')
+        self.period = period
+        self.size = size
+        self.warmup = warmup
+        self.randomized = randomized
+        self.seed = seed
+        self.confidence = confidence
+        self.estimates = dict()  # type: typing.Dict[str, typing.List[typing.Dict]]
+
+    def schedule(self) -> typing.Iterator[typing.Tuple[int, int]]:
+        """
+        Yields the endless sequence of ``[start, end)`` ranges to read: each interval with its warmup window before it.
+        """
+        rng = random.Random(self.seed)
+        base = 0
+        while True:
+            start = base + (rng.randint(self.warmup, self.period - self.size) if self.randomized
+                            else self.period - self.size)
+            yield start - self.warmup, start + self.size
+            base += self.period
+
+    def evaluate(self, predictors: typing.List[AbstractBasePredictor], trace: str,
+                 reset=True) -> typing.List[typing.Dict]:
+        """
+        Evaluates several predictors on the sampled intervals of ``trace`` in a single pass, returning their result
+        dicts (counting the detailed intervals only) and saving their estimates.
+        """
+        from branch import new_results, simulate_chunk
+        from tracereader import is_stream, read_ranges
+
+        if is_stream(trace):
+            raise ValueError(f"'{trace}' is a stream, streams can't be sampled")
+        if reset:
+            for predictor in predictors:
+                predictor.reset()
+        all_results = [new_results(trace) for _ in predictors]
+        interval_totals = array('Q')
+        interval_correct = [array('Q') for _ in predictors]
+        warmed = 0
+
+        ranges = read_ranges(trace, self.schedule())
+        current, position = -1, 0
+        while True:
+            try:
+                index, chunk = next(ranges)
+            except StopIteration as stop:
+                length = stop.value
+                break
+            if index != current:
+                current, position = index, 0
+            warm = max(0, min(self.warmup - position, len(chunk[0])))
+            position += len(chunk[0])
+            if warm:
+                warm_chunk = tuple(column[:warm] for column in chunk)
+                for predictor in predictors:
+                    train(predictor, warm_chunk)
+                warmed += warm
+                if warm == len(chunk[0]):
+                    continue
+                chunk = tuple(column[warm:] for column in chunk)
+
+            if len(interval_totals) <= index:  # indices may skip intervals cut off by the end of the trace
+                interval_totals.append(0)
+                for correct in interval_correct:
+                    correct.append(0)
+            interval_totals[-1] += len(chunk[0])
+            for predictor, results, correct in zip(predictors, all_results, interval_correct):
+                before = results['correct_predicts']
+                simulate_chunk(predictor, results, chunk)
+                correct[-1] += results['correct_predicts'] - before
+
+        self.estimates[trace] = [self.estimate(interval_totals, correct, warmed, length)
+                                 for correct in interval_correct]
+        return all_results
+
+    def estimate(self, totals: typing.Sequence[int], correct: typing.Sequence[int], warmed: int,
+                 length: typing.Optional[int]) -> typing.Dict:
+        """
+        Returns the sampling estimate of one predictor from the branches and correct predictions of every interval.
+        """
+        detailed = sum(totals)
+        intervals = len(totals)
+        accuracy = sum(correct) / detailed if detailed else 0.0
+        low = high = None
+        if intervals > 1:
+            mean_size = detailed / intervals
+            variance = sum((c - accuracy * n) ** 2 for n, c in zip(totals, correct)) / \
+                ((intervals - 1) * intervals * mean_size ** 2)
+            if length:  # the intervals sampled out of all the trace's intervals
+                variance *= max(0.0, 1 - detailed / length)
+            margin = normal_quantile((1 + self.confidence) / 2) * math.sqrt(variance)
+            low, high = max(0.0, accuracy - margin), min(1.0, accuracy + margin)
+        return {
+            'mode': 'random' if self.randomized else 'periodic',
+            'period': self.period,
+            'interval_branches': self.size,
+            'warmup_branches': self.warmup,
+            'intervals': intervals,
+            'detailed_branches': detailed,
+            'simulated_branches': detailed + warmed,
+            'trace_branches': length,
+            'simulated_fraction': (detailed + warmed) / length if length else None,
+            'confidence': self.confidence,
+            'accuracy': accuracy,
+            'accuracy_low': low,
+            'accuracy_high': high,
+            'mpkb': 1000 * (1 - accuracy),
+            'mpkb_low': None if high is None else 1000 * (1 - high),
+            'mpkb_high': None if low is None else 1000 * (1 - low),
+        }
@@ -0,0 +1,332 @@
+#!/usr/bin/env python3
+
+"""
+Budget-aware design-space search by successive halving.
+
+Takes the same grid spec as sweep.py and a hardware storage budget in bits. Every configuration in the grid whose
+``storage_bits`` fits the budget is a candidate. Rather than running every candidate over every full trace, the search
+proceeds in rungs:
+
+  1. every remaining candidate is evaluated on the first ``--min-branches`` branches of each of its traces,
+  2. candidates are ranked by Pareto layer over (accuracy, storage): the non-dominated candidates first, then those
+     dominated only by the first layer, and so on. Whole layers are kept until ``1 / --eta`` of the candidates are,
+     the last layer being cut by accuracy, but the first layer is always kept whole so no candidate which might end up
+     on the frontier is dropped only for being small,
+  3. the prefix is made ``--eta`` times longer and the survivors go through the next rung,
+
+until at most ``--eta`` candidates remain or a rung no longer drops any. The survivors are then run over the full
+traces, through the result cache, and the accuracy-vs-storage Pareto frontier of their full results is output. If the
+prefixes of a rung already cover the whole traces, that rung's results are final. Accuracy is pooled over a candidate's
+traces (correct predictions over all predictions), so candidates should share their traces to be comparable.
+
+    ./search.py grid.yaml --budget 65536
+    ./search.py grid.yaml --budget 32768 --min-branches 50000 --eta 4 -f json -o frontier.json
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import itertools
+import json
+import math
+import sys
+import typing
+
+import sweep
+from branch import get_predictor, test_predictor_single_trace, test_predictors_single_trace
+from resultcache import DEFAULT_CACHE_PATH
+from specialize import is_specializable, specialize
+from tracereader import head_chunks, read_chunks
+
+DEFAULT_MIN_BRANCHES = 100000
+DEFAULT_ETA = 3
+
+Candidate = typing.Tuple[str, typing.Dict, typing.List[str]]
+
+
+def expand_candidates(spec: typing.Dict) -> typing.List[Candidate]:
+    """
+    Returns every ``(predictor name, kwargs, traces)`` configuration described by a grid spec.
+    """
+    candidates = []
+    for entry in spec['predictors']:
+        traces = sweep.expand_traces(entry.get('traces', spec.get('traces', ['traces'])))
+        args = entry.get('args') or dict()
+        keys = list(args)
+        for values in itertools.product(*(sweep.expand_values(args[key]) for key in keys)):
+            candidates.append((entry['name'], dict(zip(keys, values)), traces))
+    return candidates
+
+
+def evaluate(predictor_name: str, kwargs: typing.Dict, trace: str, num_branches: typing.Optional[int],
+             specialized: bool = False) -> typing.Dict:
+    """
+    Evaluates one configuration on the first ``num_branches`` branches of ``trace``, or on all of it (through the
+    worker's result cache, see ``sweep.init_worker``) if ``num_branches`` is None.
+    """
+    predictor = get_predictor(predictor_name)(**kwargs)
+    if specialized and is_specializable(predictor):
+        specialize(predictor)
+    if num_branches is None:
+        return test_predictor_single_trace(predictor, trace, cache=sweep._cache)
+    # the site index covers the whole trace, so stateless predictors are simulated over the prefix like the others
+    return test_predictors_single_trace([predictor], trace, site_index=False,
+                                        chunks=head_chunks(read_chunks(trace), num_branches))[0]
+
+
+def pareto_frontier(points: typing.Sequence[typing.Tuple[int, float]],
+                    among: typing.Iterable[int] = None) -> typing.List[int]:
+    """
+    Returns the indices of the ``(storage_bits, accuracy)`` points (of those in ``among``, if given) which no other
+    point beats on both, in order of storage.
+    """
+    indices = sorted(range(len(points)) if among is None else among, key=lambda i: (points[i][0], -points[i][1]))
+    frontier = []
+    for i in indices:
+        if not frontier or points[i][1] > points[frontier[-1]][1]:
+            frontier.append(i)
+    return frontier
+
+
+def pareto_layers(points: typing.Sequence[typing.Tuple[int, float]]) -> typing.List[typing.List[int]]:
+    """
+    Splits the indices of ``points`` into successive Pareto frontiers: the frontier, then the frontier of the rest, etc.
+    """
+    remaining = set(range(len(points)))
+    layers = []
+    while remaining:
+        layer = pareto_frontier(points, remaining)
+        layers.append(layer)
+        remaining.difference_update(layer)
+    return layers
+
+
+def select(points: typing.Sequence[typing.Tuple[int, float]], quota: int) -> typing.List[int]:
+    """
+    Returns the indices of the points surviving a rung: whole Pareto layers up to ``quota`` points, the last one cut
+    by accuracy, and always the whole first layer.
+    """
+    kept = []
+    for layer in pareto_layers(points):
+        if kept and len(kept) + len(layer) > quota:
+            kept.extend(sorted(layer, key=lambda i: -points[i][1])[:quota - len(kept)])
+        else:
+            kept.extend(layer)
+        if len(kept) >= quota:
+            break
+    return kept
+
+
+class Search:
+    """
+    The state of one search. ``evaluated_branches`` counts the branches simulated so far and ``trace_lengths`` the
+    length of every trace seen in full, so the cost can be compared with a full sweep.
+    """
+    def __init__(self, candidates: typing.List[Candidate], budget: int, min_branches: int = DEFAULT_MIN_BRANCHES,
+                 eta: int = DEFAULT_ETA, workers: int = None, cache_path: typing.Optional[str] = DEFAULT_CACHE_PATH,
+                 specialized: bool = False, log: typing.TextIO = sys.stderr):
+        self.budget = budget
+        self.min_branches = min_branches
+        self.eta = eta
+        self.workers = workers
+        self.cache_path = cache_path
+        self.specialized = specialized
+        self.log = log
+        self.evaluated_branches = 0
+        self.trace_lengths = dict()  # type: typing.Dict[str, int]
+
+        # candidates with their storage, keeping those within the budget
+        self.candidates = []  # type: typing.List[Candidate]
+        self.storage = []  # type: typing.List[int]
+        self.over_budget = 0
+        for name, kwargs, traces in candidates:
+            try:
+                storage_bits = get_predictor(name)(**kwargs).storage_bits()
+            except Exception as e:
+                print(f'skipping {name} {kwargs}: {type(e).__name__}: {e}', file=log)
+                continue
+            if storage_bits > budget:
+                self.over_budget += 1
+                continue
+            self.candidates.append((name, kwargs, traces))
+            self.storage.append(storage_bits)
+
+    def _rung(self, pool, alive: typing.List[int],
+              num_branches: typing.Optional[int]) -> typing.Tuple[typing.Dict[int, typing.List[typing.Dict]], bool]:
+        """
+        Evaluates the ``alive`` candidates on prefixes of ``num_branches`` branches (full traces if None). Returns the
+        results of each candidate that didn't fail, and whether every prefix covered its whole trace.
+        """
+        futures = dict()
+        for i in alive:
+            name, kwargs, traces = self.candidates[i]
+            for trace in traces:
+                futures[pool.submit(evaluate, name, kwargs, trace, num_branches, self.specialized)] = i
+        results = {i: [] for i in alive}
+        failed = set()
+        for future in concurrent.futures.as_completed(futures):
+            i = futures[future]
+            try:
+                results[i].append(future.result())
+            except Exception as e:
+                if i not in failed:
+                    print(f'dropping {self.candidates[i][0]} {self.candidates[i][1]}: {type(e).__name__}: {e}',
+                          file=self.log)
+                failed.add(i)
+
+        exhausted = True
+        for i in failed:
+            del results[i]
+        for trace_results in results.values():
+            for result in trace_results:
+                self.evaluated_branches += result['total_predictions']
+                if num_branches is not None and result['total_predictions'] >= num_branches:
+                    exhausted = False
+                else:
+                    self.trace_lengths[result['trace']] = result['total_predictions']
+        return results, exhausted
+
+    def run(self) -> typing.List[typing.Dict]:
+        """
+        Runs the search, returning the frontier as dicts of the predictor, its kwargs, storage_bits, pooled accuracy
+        and number of branches, in order of storage.
+        """
+        print(f'{len(self.candidates)} candidates within {self.budget} bits ({self.over_budget} over budget)',
+              file=self.log)
+        alive = list(range(len(self.candidates)))
+        num_branches = self.min_branches
+        final = None
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers, initializer=sweep.init_worker,
+                                                    initargs=(self.cache_path,)) as pool:
+            while len(alive) > self.eta:
+                results, exhausted = self._rung(pool, alive, num_branches)
+                alive = list(results)
+                if exhausted:  # the prefixes were the whole traces, nothing more to learn from longer ones
+                    final = results
+                    break
+                points = [(self.storage[i], accuracy(results[i])) for i in alive]
+                kept = [alive[j] for j in select(points, math.ceil(len(alive) / self.eta))]
+                print(f'rung of {num_branches} branches per trace: kept {len(kept)} of {len(alive)} candidates',
+                      file=self.log)
+                if len(kept) == len(alive):  # the frontier itself is over the quota, so halving can't go on
+                    break
+                alive = kept
+                num_branches *= self.eta
+            if final is None:
+                final, _ = self._rung(pool, alive, None)
+                print(f'full traces: {len(final)} candidates', file=self.log)
+
+        alive = list(final)
+        points = [(self.storage[i], accuracy(final[i])) for i in alive]
+        return [{
+            'predictor': self.candidates[alive[j]][0],
+            'kwargs': self.candidates[alive[j]][1],
+            'storage_bits': points[j][0],
+            'accuracy': points[j][1],
+            'branches': sum(result['total_predictions'] for result in final[alive[j]]),
+        } for j in pareto_frontier(points)]
+
+    def full_sweep_branches(self) -> typing.Optional[int]:
+        """
+        Returns the number of branches a full sweep of every candidate would simulate, or None if the length of some
+        trace is unknown (no candidate reached its end).
+        """
+        traces = [trace for _, _, candidate_traces in self.candidates for trace in candidate_traces]
+        if any(trace not in self.trace_lengths for trace in traces):
+            return None
+        return sum(self.trace_lengths[trace] for trace in traces)
+
+
+def accuracy(results: typing.List[typing.Dict]) -> float:
+    total = sum(result['total_predictions'] for result in results)
+    return sum(result['correct_predicts'] for result in results) / total if total else 0.0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Search a grid spec (see sweep.py) for the configurations with the best accuracy for their storage "
+                    "within a budget, evaluating on trace prefixes first and dropping the worst by successive halving, "
+                    "and output the accuracy-vs-storage Pareto frontier."
+    )
+    parser.add_argument(
+        'spec',
+        help="the grid spec (JSON, or YAML with PyYAML installed)"
+    )
+    parser.add_argument(
+        "--budget",
+        help="storage budget in bits, configurations needing more are not considered",
+        type=int,
+        required=True
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="save the frontier into a file. if omitted, it is printed to the console"
+    )
+    parser.add_argument(
+        "-f", "--format",
+        help="output format of the frontier",
+        choices=['csv', 'json'],
+        default='csv'
+    )
+    parser.add_argument(
+        "--min-branches",
+        help=f"branches per trace of the first rung (default: {DEFAULT_MIN_BRANCHES})",
+        type=int,
+        default=DEFAULT_MIN_BRANCHES
+    )
+    parser.add_argument(
+        "--eta",
+        help=f"each rung keeps 1/eta of the candidates and runs eta times longer prefixes (default: {DEFAULT_ETA})",
+        type=int,
+        default=DEFAULT_ETA
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes. defaults to the number of cores",
+        type=int
+    )
+    parser.add_argument(
+        "--specialize",
+        help="run TwoLevel and GShare candidates through their specialized loops (see specialize.py)",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="always re-run the full-trace simulations instead of returning previously cached results",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cache-path",
+        help="location of the result cache database",
+        default=DEFAULT_CACHE_PATH
+    )
+
+    parsed = parser.parse_args()
+    if parsed.eta < 2 or parsed.min_branches < 1:
+        print(f'{parser.prog}: error: --eta must be at least 2 and --min-branches at least 1')
+        exit(1)
+
+    search = Search(expand_candidates(sweep.load_spec(parsed.spec)), parsed.budget, parsed.min_branches, parsed.eta,
+                    parsed.jobs, None if parsed.no_cache else parsed.cache_path, parsed.specialize)
+    frontier = search.run()
+
+    full_branches = search.full_sweep_branches()
+    if full_branches:
+        print(f'simulated {search.evaluated_branches} branches, {search.evaluated_branches / full_branches:.1%} of '
+              f'the {full_branches} of a full sweep', file=sys.stderr)
+    else:
+        print(f'simulated {search.evaluated_branches} branches', file=sys.stderr)
+
+    fp = open(parsed.output, 'w') if parsed.output else sys.stdout
+    try:
+        if parsed.format == 'json':
+            fp.write(json.dumps(frontier, indent=2) + '\n')
+        else:
+            writer = csv.writer(fp, lineterminator='\n')
+            writer.writerow(['predictor', 'args', 'storage_bits', 'accuracy', 'branches'])
+            for point in frontier:
+                writer.writerow([point['predictor'], ' '.join(f'{k}={v}' for k, v in point['kwargs'].items()),
+                                 point['storage_bits'], point['accuracy'], point['branches']])
+    finally:
+        if fp is not sys.stdout:
+            fp.close()
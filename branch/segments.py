@@ -0,0 +1,163 @@
+"""
+Segmented parallel simulation of a single trace.
+
+A trace is inherently sequential, every prediction depends on the state left by all the branches before it, so a
+single long trace keeps one core busy however many there are. A :class:`Segmenter` (``--segments K`` on the command
+line) splits the trace into K segments of equal length and simulates them on a process pool. Each segment's
+predictors start from a freshly reset state and are first run, without counting, over the ``--segment-warmup``
+branches before the segment, so that the state they start the segment with approximates the one a serial run would
+have reached there. The per-segment counters are then merged. Binary traces suit this best, as each segment is sliced
+straight out of the file, while text traces have to be skipped over (without parsing) up to each segment's start.
+
+The result is an approximation: the warmup can't recreate state trained further back than the warmup window. With
+``--segment-check`` the trace is also simulated serially, and the error of the segmented results against the serial
+ones, along with both timings, is added to the output.
+"""
+
+import concurrent.futures
+import os
+import time
+import typing
+
+from predictors import AbstractBasePredictor
+
+DEFAULT_SEGMENT_WARMUP = 100000
+SEGMENT_COLUMNS = [
+    'segments',
+    'warmup_branches',
+    'seconds',
+    'serial_seconds',
+    'speedup',
+    'accuracy',
+    'serial_accuracy',
+    'accuracy_error',
+    'misprediction_error',
+    'relative_misprediction_error',
+]
+
+PredictorSpec = typing.Tuple[str, typing.Tuple, typing.Dict, bool]
+
+
+def merge_results(into: typing.Dict, results: typing.Dict):
+    """
+    Adds the counters and opcode histogram of ``results`` to ``into``.
+    """
+    for key, value in results.items():
+        if key == 'opcode_histogram':
+            histogram = into['opcode_histogram']
+            for opcode, (total, correct) in value.items():
+                if opcode not in histogram:
+                    histogram[opcode] = [0, 0]
+                histogram[opcode][0] += total
+                histogram[opcode][1] += correct
+        elif key != 'trace':
+            into[key] += value
+
+
+def simulate_segment(predictor_specs: typing.List[PredictorSpec], trace: str, start: int, end: int,
+                     warmup: int) -> typing.List[typing.Dict]:
+    """
+    Simulates freshly constructed predictors over the branches ``[start, end)`` of ``trace``, after training them on
+    up to ``warmup`` branches before ``start``. Meant to run in a worker process.
+    """
+    from branch import get_predictor, new_results, simulate_chunk
+    from sampling import train
+    from specialize import specialize
+    from tracereader import read_ranges
+
+    predictors = []
+    for name, args, kwargs, specialized in predictor_specs:
+        predictor = get_predictor(name)(*args, **kwargs)
+        predictors.append(specialize(predictor) if specialized else predictor)
+    all_results = [new_results(trace) for _ in predictors]
+
+    to_warm = min(warmup, start)
+    for _, chunk in read_ranges(trace, [(start - to_warm, end)]):
+        warm = min(to_warm, len(chunk[0]))
+        if warm:
+            warm_chunk = tuple(column[:warm] for column in chunk)
+            for predictor in predictors:
+                train(predictor, warm_chunk)
+            to_warm -= warm
+            if warm == len(chunk[0]):
+                continue
+            chunk = tuple(column[warm:] for column in chunk)
+        for predictor, results in zip(predictors, all_results):
+            simulate_chunk(predictor, results, chunk)
+    return all_results
+
+
+def _accuracy(results: typing.Dict) -> float:
+    return results['correct_predicts'] / results['total_predictions'] if results['total_predictions'] else 0.0
+
+
+class Segmenter:
+    """
+    Evaluates predictors on segments of each trace in parallel. ``reports[trace]`` holds the report of each trace
+    evaluated, in predictor order. With ``check``, traces are also simulated serially to measure the error.
+    """
+    def __init__(self, segments: int, warmup: int = DEFAULT_SEGMENT_WARMUP, workers: int = None, check: bool = False):
+        if segments < 1 or warmup < 0:
+            raise ValueError(f'need at least one segment ({segments}) and a non-negative warmup ({warmup})')
+        self.segments = segments
+        self.warmup = warmup
+        self.workers = min(segments, workers or os.cpu_count() or 1)
+        self.check = check
+        self.reports = dict()  # type: typing.Dict[str, typing.List[typing.Dict]]
+
+    def evaluate(self, predictors: typing.List[AbstractBasePredictor], trace: str) -> typing.List[typing.Dict]:
+        """
+        Evaluates several predictors on ``trace`` segment by segment, returning their merged result dicts (starting
+        from a freshly reset state, as the segments always do) and saving their reports.
+        """
+        from branch import new_results, test_predictors_single_trace
+        from specialize import is_specialized
+        from tracereader import is_stream, trace_length
+
+        if is_stream(trace):
+            raise ValueError(f"'{trace}' is a stream, streams can't be split into segments")
+        predictor_specs = [(predictor.name(), predictor.init_args, predictor.init_kwargs, is_specialized(predictor))
+                           for predictor in predictors]
+
+        start_time = time.perf_counter()
+        length = trace_length(trace)
+        bounds = [length * k // self.segments for k in range(self.segments + 1)]
+        all_results = [new_results(trace) for _ in predictors]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as pool:
+            futures = [pool.submit(simulate_segment, predictor_specs, trace, start, end, self.warmup)
+                       for start, end in zip(bounds, bounds[1:]) if end > start]
+            for future in futures:  # merged in trace order, so opcodes keep their order of appearance
+                for results, segment_results in zip(all_results, future.result()):
+                    merge_results(results, segment_results)
+        seconds = time.perf_counter() - start_time
+
+        serial, serial_seconds = [None] * len(predictors), None
+        if self.check:
+            start_time = time.perf_counter()
+            serial = test_predictors_single_trace(predictors, trace)
+            serial_seconds = time.perf_counter() - start_time
+
+        self.reports[trace] = [self.report(results, serial_results, seconds, serial_seconds)
+                               for results, serial_results in zip(all_results, serial)]
+        return all_results
+
+    def report(self, results: typing.Dict, serial: typing.Optional[typing.Dict], seconds: float,
+               serial_seconds: typing.Optional[float]) -> typing.Dict:
+        report = {
+            'segments': self.segments,
+            'warmup_branches': self.warmup,
+            'seconds': seconds,
+            'accuracy': _accuracy(results),
+        }
+        if serial is not None:
+            error = results['incorrect_predicts'] - serial['incorrect_predicts']
+            report.update({
+                'serial_seconds': serial_seconds,
+                'speedup': serial_seconds / seconds if seconds else None,
+                'serial_accuracy': _accuracy(serial),
+                'accuracy_error': _accuracy(results) - _accuracy(serial),
+                'misprediction_error': error,
+                'relative_misprediction_error': error / serial['incorrect_predicts']
+                if serial['incorrect_predicts'] else None,
+            })
+        return report
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+
+"""
+Resident evaluation server.
+
+Every ``branch.py`` run pays for interpreter start-up, importing the predictors and decoding each trace before the
+first branch is simulated. The server pays for those once: it listens on a Unix socket and keeps decoded traces and
+imported predictor classes in memory between requests. Traces are spread over worker processes by path, so each trace
+is decoded by one worker only and stays hot there (in compact arrays, up to ``--max-branches`` branches per worker,
+least recently used traces are dropped first). Predictor modules, and the ``predictors`` package with their base
+class, are reloaded when their source changes, so editing a predictor doesn't require a restart.
+
+    ./server.py &                                       # start the server
+    ./branch.py GShare:history_size_bits=12 -f csv       # forwarded to the server while it runs
+    ./server.py --stop                                  # stop it
+
+``branch.py`` forwards plain evaluations to the server whenever one is listening on its socket (see ``--server`` and
+``--no-server``), as long as the socket is owned by the same user and its directory isn't writable by everyone. The
+protocol is one JSON request per line, answered by one JSON line per trace as it completes and a final
+``{"done": true}`` line:
+
+    {"op": "evaluate", "predictors": [["Bimodal", {"counter_bits": 2, "table_size": 1024}]], "traces": ["/abs/a.trace"],
+     "reset": true, "cache": true}
+    {"trace": "/abs/a.trace", "results": [{...}]}       # one result dict per predictor, or {"trace": ..., "error": ...}
+
+along with ``{"op": "ping"}`` and ``{"op": "shutdown"}``.
+"""
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import importlib
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+import traceback
+import typing
+import zlib
+from array import array
+from concurrent.futures.process import BrokenProcessPool
+
+import resultcache
+from branch import get_predictor, test_predictors_single_trace
+from btrace import OpcodeColumn
+from resultcache import DEFAULT_CACHE_PATH, ResultCache
+from tracereader import Chunk, read_chunks, split_range
+
+# without a runtime directory, the socket goes into a private directory of its own rather than straight into the
+# temporary directory, where anyone could have created it first
+if os.environ.get('XDG_RUNTIME_DIR'):
+    DEFAULT_SOCKET = os.path.join(os.environ['XDG_RUNTIME_DIR'], f'branch-{os.getuid()}.sock')
+else:
+    DEFAULT_SOCKET = os.path.join(tempfile.gettempdir(), f'branch-{os.getuid()}', 'server.sock')
+# branches of decoded traces each worker keeps in memory, at roughly 18 bytes per branch
+DEFAULT_MAX_BRANCHES = 50000000
+
+
+def decode_trace(trace: str) -> typing.List[Chunk]:
+    """
+    Reads ``trace`` into a list of compact, self-contained chunks: interned opcodes, PCs and targets as unsigned 64-bit
+    arrays and outcomes as bytes.
+    """
+    names = []  # type: typing.List[str]
+    opcode_ids = dict()  # type: typing.Dict[str, int]
+    chunks = []
+    for opcodes, pcs, targets, outcomes in read_chunks(trace):
+        for opcode in set(opcodes):
+            if opcode not in opcode_ids:
+                opcode_ids[opcode] = len(names)
+                names.append(opcode)
+        ids = bytes(map(opcode_ids.__getitem__, opcodes)) if len(names) <= 256 else list(opcodes)
+        chunks.append((OpcodeColumn(ids, names) if isinstance(ids, bytes) else ids,
+                       array('Q', pcs), array('Q', targets), bytes(outcomes)))
+    return chunks
+
+
+class TraceCache:
+    """
+    Decoded traces by path, least recently used first, invalidated when a trace's size or mtime changes.
+    """
+    def __init__(self, max_branches: int = DEFAULT_MAX_BRANCHES):
+        self.max_branches = max_branches
+        self.traces = collections.OrderedDict()  # type: typing.Dict[str, typing.Tuple[typing.Tuple, typing.List, int]]
+        self.branches = 0
+
+    def get(self, trace: str) -> typing.List[Chunk]:
+        stat = os.stat(split_range(trace)[0])
+        stamp = (stat.st_size, stat.st_mtime_ns)
+        cached = self.traces.pop(trace, None)
+        if cached is not None:
+            self.branches -= cached[2]
+            if cached[0] != stamp:
+                cached = None
+        if cached is None:
+            chunks = decode_trace(trace)
+            cached = (stamp, chunks, sum(len(chunk[3]) for chunk in chunks))
+
+        self.traces[trace] = cached
+        self.branches += cached[2]
+        while self.branches > self.max_branches and len(self.traces) > 1:
+            _, (_, _, branches) = self.traces.popitem(last=False)
+            self.branches -= branches
+        return cached[1]
+
+
+# per worker process state, set up by init_worker
+_traces = None  # type: typing.Optional[TraceCache]
+_cache = None  # type: typing.Optional[ResultCache]
+_module_stamps = dict()  # type: typing.Dict[str, int]
+
+
+def init_worker(max_branches: int, cache_path: typing.Optional[str]):
+    global _traces, _cache
+    _traces = TraceCache(max_branches)
+    _cache = ResultCache(cache_path) if cache_path else None
+
+
+def refresh_predictors():
+    """
+    Reloads the ``predictors`` package and the imported predictor modules if any of their sources changed since they
+    were loaded. The package, with ``AbstractBasePredictor``, is reloaded first and the modules base classes first, so
+    subclasses pick up their reloaded parents.
+    """
+    modules = [module for name, module in list(sys.modules.items())
+               if (name == 'predictors' or name.startswith('predictors.')) and getattr(module, '__file__', None)]
+    stamps = {module.__name__: os.stat(module.__file__).st_mtime_ns for module in modules}
+    changed = any(_module_stamps.get(name, stamp) != stamp for name, stamp in stamps.items())
+    _module_stamps.update(stamps)
+    if not changed:
+        return
+
+    def depth(module):
+        cls = getattr(module, module.__name__.rsplit('.', 1)[-1], None)
+        return len(cls.__mro__) if isinstance(cls, type) else 0
+
+    for module in sorted(modules, key=lambda module: (module.__name__ != 'predictors', depth(module))):
+        importlib.reload(module)
+    resultcache._source_digests.clear()
+
+
+def evaluate_job(predictor_specs: typing.List[typing.Tuple[str, typing.Dict]], trace: str, reset: bool,
+                 use_cache: bool) -> typing.List[typing.Dict]:
+    """
+    Evaluates the predictors on one trace in a worker, from the worker's decoded copy of the trace.
+    """
+    def decoded_chunks():
+        # only decoded once iterated, so results found in the cache (or the site index) never load the trace
+        yield from _traces.get(trace)
+
+    refresh_predictors()
+    predictors = [get_predictor(name)(**kwargs) for name, kwargs in predictor_specs]
+    return test_predictors_single_trace(predictors, trace, reset, _cache if use_cache else None,
+                                        chunks=decoded_chunks())
+
+
+class Server:
+    """
+    Serves evaluation requests on a Unix socket, running each trace on the worker which owns it.
+    """
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, workers: int = None,
+                 max_branches: int = DEFAULT_MAX_BRANCHES, cache_path: typing.Optional[str] = DEFAULT_CACHE_PATH):
+        self.socket_path = socket_path
+        self.max_branches = max_branches
+        self.cache_path = cache_path
+        self.shards = [self._new_shard() for _ in range(workers or os.cpu_count() or 1)]
+        self.stopped = None  # type: typing.Optional[asyncio.Event]
+
+    def _new_shard(self) -> concurrent.futures.ProcessPoolExecutor:
+        return concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                                                      initargs=(self.max_branches, self.cache_path))
+
+    def _shard_of(self, trace: str) -> int:
+        return zlib.crc32(trace.encode('utf-8')) % len(self.shards)
+
+    async def _evaluate(self, request: typing.Dict, trace: str) -> typing.Dict:
+        shard = self._shard_of(trace)
+        specs = [tuple(spec) for spec in request['predictors']]
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.shards[shard], evaluate_job, specs, trace,
+                                                 request.get('reset', True), request.get('cache', True))
+            return {'trace': trace, 'results': results}
+        except BrokenProcessPool:
+            self.shards[shard] = self._new_shard()
+            return {'trace': trace, 'error': 'worker process died'}
+        except Exception as e:
+            traceback.print_exc()
+            return {'trace': trace, 'error': f'{type(e).__name__}: {e}'}
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                except ValueError as e:
+                    writer.write((json.dumps({'error': f'invalid request: {e}'}) + '\n').encode('utf-8'))
+                    continue
+
+                op = request.get('op')
+                if op == 'ping':
+                    writer.write(b'{"ok": true}\n')
+                elif op == 'shutdown':
+                    writer.write(b'{"ok": true}\n')
+                    self.stopped.set()
+                elif op == 'evaluate':
+                    for response in asyncio.as_completed([self._evaluate(request, trace)
+                                                          for trace in request['traces']]):
+                        writer.write((json.dumps(await response) + '\n').encode('utf-8'))
+                        await writer.drain()
+                    writer.write(b'{"done": true}\n')
+                else:
+                    writer.write((json.dumps({'error': f'unknown op {op!r}'}) + '\n').encode('utf-8'))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self):
+        self.stopped = asyncio.Event()
+        if os.path.exists(self.socket_path):
+            if server_running(self.socket_path):
+                raise RuntimeError(f'a server is already listening on {self.socket_path}')
+            os.unlink(self.socket_path)
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), mode=0o700, exist_ok=True)
+        server = await asyncio.start_unix_server(self.handle, path=self.socket_path)
+        print(f'listening on {self.socket_path} with {len(self.shards)} workers', file=sys.stderr)
+        try:
+            await self.stopped.wait()
+        finally:
+            server.close()
+            await server.wait_closed()
+            os.unlink(self.socket_path)
+            for shard in self.shards:
+                shard.shutdown()
+
+
+def _request(socket_path: str, request: typing.Dict, timeout: float = None) -> typing.Iterator[typing.Dict]:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(socket_path)
+        sock.settimeout(None)
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        with sock.makefile('r', encoding='utf-8') as fp:
+            for line in fp:
+                yield json.loads(line)
+
+
+def server_running(socket_path: str = DEFAULT_SOCKET) -> bool:
+    """
+    Returns whether a server answers on ``socket_path``.
+    """
+    if not os.path.exists(socket_path):
+        return False
+    try:
+        return next(_request(socket_path, {'op': 'ping'}, timeout=1.0)).get('ok', False)
+    except (OSError, ValueError, StopIteration):
+        return False
+
+
+def socket_trusted(socket_path: str) -> bool:
+    """
+    Returns whether the socket at ``socket_path`` is owned by the current user and lies in a directory other users
+    can't write to, so no one else can have put a server there, answering with forged results.
+    """
+    try:
+        owner = os.stat(socket_path).st_uid
+        directory_mode = os.stat(os.path.dirname(os.path.abspath(socket_path))).st_mode
+    except OSError:
+        return False
+    return owner == os.getuid() and not directory_mode & stat.S_IWOTH
+
+
+def can_forward(socket_path: str = DEFAULT_SOCKET) -> bool:
+    """
+    Returns whether runs can be forwarded to a server on ``socket_path``: the socket is trusted (see
+    ``socket_trusted``) and a server answers on it. Warns about a socket which isn't trusted.
+    """
+    if not os.path.exists(socket_path):
+        return False
+    if not socket_trusted(socket_path):
+        print(f"warning: not forwarding to the server on '{socket_path}', the socket isn't owned by you or its "
+              f"directory is writable by everyone. evaluating locally", file=sys.stderr)
+        return False
+    return server_running(socket_path)
+
+
+def evaluate_remote(predictor_specs: typing.List[typing.Tuple[str, typing.Dict]], traces: typing.List[str],
+                    reset=True, use_cache=True,
+                    socket_path: str = DEFAULT_SOCKET) -> typing.Iterator[typing.Tuple[str, typing.List[typing.Dict]]]:
+    """
+    Evaluates the predictors on every trace on the server, yielding ``(trace, results)`` as each trace completes,
+    with one ``test_predictor_single_trace`` result per predictor. Raises RuntimeError if the server fails a trace.
+    """
+    # the server resolves paths from its own working directory, so send absolute ones and map them back
+    paths = collections.OrderedDict((os.path.abspath(trace), trace) for trace in traces)
+    request = {
+        'op': 'evaluate',
+        'predictors': [[name, kwargs] for name, kwargs in predictor_specs],
+        'traces': list(paths),
+        'reset': reset,
+        'cache': use_cache
+    }
+    for response in _request(socket_path, request):
+        if response.get('done'):
+            return
+        if 'error' in response:
+            raise RuntimeError(f"{paths.get(response.get('trace'), 'server')}: {response['error']}")
+        trace = paths[response['trace']]
+        for result in response['results']:
+            result['trace'] = trace
+        yield trace, response['results']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run a resident evaluation server which keeps decoded traces and predictor classes in memory, "
+                    "used by branch.py whenever it is running."
+    )
+    parser.add_argument(
+        "--socket",
+        help=f"the Unix socket to listen on (default: {DEFAULT_SOCKET})",
+        default=DEFAULT_SOCKET
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes. defaults to the number of cores",
+        type=int
+    )
+    parser.add_argument(
+        "--max-branches",
+        help=f"branches of decoded traces each worker keeps in memory (default: {DEFAULT_MAX_BRANCHES})",
+        type=int,
+        default=DEFAULT_MAX_BRANCHES
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="never use the result cache, always re-run the simulation",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cache-path",
+        help="location of the result cache database",
+        default=DEFAULT_CACHE_PATH
+    )
+    parser.add_argument(
+        "--stop",
+        help="stop the server listening on the socket and exit",
+        action="store_true"
+    )
+
+    parsed = parser.parse_args()
+
+    if parsed.stop:
+        if not server_running(parsed.socket):
+            print(f'no server is listening on {parsed.socket}')
+            exit(1)
+        next(_request(parsed.socket, {'op': 'shutdown'}))
+        exit()
+
+    evaluation_server = Server(parsed.socket, parsed.jobs, parsed.max_branches,
+                               None if parsed.no_cache else parsed.cache_path)
+    try:
+        asyncio.run(evaluation_server.serve())
+    except KeyboardInterrupt:
+        pass
+    except RuntimeError as e:
+        print(e)
+        exit(1)
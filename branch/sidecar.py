@@ -0,0 +1,95 @@
+"""
+Indexes saved next to their trace.
+
+Some facts about a trace are costly to gather but never change while the trace doesn't, such as the per-site counts
+of siteindex.py or the seek offsets of offsetindex.py. A :class:`TraceIndex` is built once and saved next to its trace
+as a hidden ``.<trace name><extension>`` JSON file (hidden files are skipped when a directory of traces is evaluated),
+stamped with the trace's size and mtime, and is rebuilt whenever either of them changes.
+"""
+
+import json
+import os
+import typing
+
+
+def sidecar_path(trace: str, extension: str) -> str:
+    directory, name = os.path.split(trace)
+    return os.path.join(directory, f'.{name}{extension}')
+
+
+def trace_stamp(trace: str) -> typing.List[int]:
+    stat = os.stat(trace)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class TraceIndex:
+    """
+    Base of the indexes saved next to their trace. Subclasses set ``extension`` and ``version`` (to be bumped whenever
+    what they save changes), and implement ``build``, ``to_json`` and ``from_json``.
+    """
+    extension = None  # type: str
+    version = 1
+
+    def __init__(self, trace: str):
+        self.trace = trace
+
+    @classmethod
+    def path(cls, trace: str) -> str:
+        return sidecar_path(trace, cls.extension)
+
+    @classmethod
+    def build(cls, trace: str) -> 'TraceIndex':
+        raise NotImplementedError
+
+    def to_json(self) -> typing.Dict:
+        """
+        Returns the contents of the index as a JSON object.
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def from_json(cls, trace: str, data: typing.Dict) -> 'TraceIndex':
+        """
+        Returns the index of ``trace`` saved as ``data`` by ``to_json``.
+        """
+        raise NotImplementedError
+
+    def save(self, path: str = None):
+        """
+        Saves the index, by default next to its trace. Failing to write (e.g. a read-only trace directory) is not an
+        error, the index is simply rebuilt next time.
+        """
+        path = path or self.path(self.trace)
+        try:
+            data = {'version': self.version, 'stamp': trace_stamp(self.trace)}
+            data.update(self.to_json())
+            with open(path + '.tmp', 'w') as fp:
+                json.dump(data, fp)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, trace: str, path: str = None) -> typing.Optional['TraceIndex']:
+        """
+        Loads the saved index of ``trace``, or returns None if there is none or the trace changed since it was built.
+        """
+        try:
+            with open(path or cls.path(trace), 'r') as fp:
+                data = json.load(fp)
+            if data.get('version') != cls.version or data.get('stamp') != trace_stamp(trace):
+                return None
+        except (OSError, ValueError):
+            return None
+        return cls.from_json(trace, data)
+
+    @classmethod
+    def open(cls, trace: str) -> 'TraceIndex':
+        """
+        Returns the saved index of ``trace``, building and saving it first if needed.
+        """
+        index = cls.load(trace)
+        if index is None:
+            index = cls.build(trace)
+            index.save()
+        return index
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+"""
+Per-branch-site aggregate index of a trace.
+
+For every static branch site, identified by its (opcode, pc, target), the index holds how many of its dynamic
+executions were taken and not taken. That is all a stateless predictor's result depends on, so predictors marked
+``stateless`` (AlwaysTaken, AlwaysNotTaken, BackTakeForwardNot) are evaluated from the index in time proportional to
+the number of static branches instead of replaying every dynamic one. The index also gives the per-site oracle
+bound: the accuracy of always predicting each site's majority direction.
+
+An index is built once per trace and saved next to it as a hidden ``.<trace name>.sites`` file (see sidecar.py). Build
+indexes and print their oracle bounds with ``./siteindex.py traces/*.trace``.
+"""
+
+import argparse
+import collections
+import typing
+
+from predictors import AbstractBasePredictor, Predict
+from sidecar import TraceIndex
+from tracereader import read_chunks
+
+Site = typing.Tuple[str, int, int]
+
+
+class SiteIndex(TraceIndex):
+    """
+    Taken and not-taken execution counts of every branch site of a trace, in order of first execution.
+    """
+    extension = '.sites'
+    version = 1
+
+    def __init__(self, trace: str):
+        super().__init__(trace)
+        self.sites = collections.OrderedDict()  # type: typing.Dict[Site, typing.List[int]]
+
+    def add_chunk(self, chunk):
+        """
+        Accumulates one chunk of branches (see tracereader.py) into the index.
+        """
+        opcodes, pcs, targets, outcomes = chunk
+        for (opcode, pc, target, taken), count in collections.Counter(zip(opcodes, pcs, targets, outcomes)).items():
+            counts = self.sites.get((opcode, pc, target))
+            if counts is None:
+                counts = self.sites[(opcode, pc, target)] = [0, 0]
+            counts[0 if taken == Predict.TAKEN else 1] += count
+
+    @classmethod
+    def build(cls, trace: str) -> 'SiteIndex':
+        index = cls(trace)
+        for chunk in read_chunks(trace):
+            index.add_chunk(chunk)
+        return index
+
+    def to_json(self) -> typing.Dict:
+        return {'sites': [[opcode, pc, target, taken, not_taken]
+                          for (opcode, pc, target), (taken, not_taken) in self.sites.items()]}
+
+    @classmethod
+    def from_json(cls, trace: str, data: typing.Dict) -> 'SiteIndex':
+        index = cls(trace)
+        for opcode, pc, target, taken, not_taken in data['sites']:
+            index.sites[(opcode, pc, target)] = [taken, not_taken]
+        return index
+
+    def total_branches(self) -> int:
+        return sum(taken + not_taken for taken, not_taken in self.sites.values())
+
+    def oracle_correct(self) -> int:
+        """
+        Returns the number of correct predictions made by always predicting each site's majority direction, an upper
+        bound for any predictor which gives every site a single fixed prediction.
+        """
+        return sum(max(counts) for counts in self.sites.values())
+
+    def evaluate(self, predictor: AbstractBasePredictor, results: typing.Dict):
+        """
+        Adds the result of a stateless predictor over the whole trace to ``results``, asking it for one prediction
+        per site rather than per dynamic branch. Raises ValueError for a predictor which isn't stateless (see
+        ``AbstractBasePredictor.is_stateless``).
+        """
+        if not predictor.is_stateless():
+            raise ValueError(f'{predictor.name()} is not stateless, it can\'t be evaluated from the site index')
+        histogram = results['opcode_histogram']
+        for (opcode, pc, target), (taken, not_taken) in self.sites.items():
+            executions = taken + not_taken
+            if predictor.predict(opcode, pc, target) == Predict.TAKEN:
+                correct = taken
+                results['correct_takes'] += taken
+                results['incorrect_not_takes'] += not_taken
+            else:
+                correct = not_taken
+                results['correct_not_takes'] += not_taken
+                results['incorrect_takes'] += taken
+            results['total_predictions'] += executions
+            results['correct_predicts'] += correct
+            results['incorrect_predicts'] += executions - correct
+            if opcode not in histogram:
+                histogram[opcode] = [0, 0]
+            histogram[opcode][0] += executions
+            histogram[opcode][1] += correct
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Build the per-branch-site index of each trace and print its static branch count and per-site "
+                    "oracle bound (the accuracy of always predicting each site's majority direction)."
+    )
+    parser.add_argument(
+        'traces',
+        help="the trace(s) to index",
+        nargs='+'
+    )
+    parser.add_argument(
+        "--rebuild",
+        help="rebuild indexes even if an up to date one exists",
+        action="store_true"
+    )
+
+    parsed = parser.parse_args()
+
+    print('trace,sites,total_predictions,oracle_correct_predicts,oracle_accuracy')
+    for trace_file in parsed.traces:
+        if parsed.rebuild:
+            site_index = SiteIndex.build(trace_file)
+            site_index.save()
+        else:
+            site_index = SiteIndex.open(trace_file)
+        total_branches = site_index.total_branches()
+        oracle = site_index.oracle_correct()
+        print(f'{trace_file},{len(site_index.sites)},{total_branches},{oracle},'
+              f'{oracle / total_branches if total_branches else 0:.6f}')
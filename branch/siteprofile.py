@@ -0,0 +1,172 @@
+"""
+Per-branch-site misprediction profiling.
+
+Totals and the opcode histogram say how well a predictor does, not which static branches it gets wrong. With a
+:class:`SiteProfiler` passed to ``test_predictors_single_trace`` (``--sites K`` on the command line), every predictor
+also keeps per-PC counters of executions, taken outcomes and mispredictions. PCs are mapped to dense ids as they are
+first seen and the counters are flat arrays indexed by those ids, updated a whole chunk at a time, so the overhead on
+hot loops stays small.
+
+For predictors with a prediction table (those implementing ``table_indices``, such as Bimodal, TwoLevel and GShare)
+the profile also measures aliasing: an access is aliased when its table slot was last used by a different PC, and a
+slot is conflicting when the PCs sharing it lean in different directions (their taken rates fall on either side of
+one half). The summary of a profile gives the sites with the most mispredictions and the aliasing statistics.
+"""
+
+import collections
+import itertools
+import operator
+import typing
+from array import array
+
+from predictors import AbstractBasePredictor
+
+DEFAULT_TOP_K = 10
+
+
+class SiteProfile:
+    """
+    Per-site counters of one predictor over one trace.
+    """
+    def __init__(self):
+        self.site_ids = dict()  # type: typing.Dict[int, int]
+        self.pcs = array('Q')
+        self.executions = array('Q')
+        self.taken = array('Q')
+        self.mispredictions = array('Q')
+        self.aliased = array('Q')
+        self.has_table = False
+        self.slot_owners = dict()  # type: typing.Dict[int, int]
+        self.slot_sites = dict()  # type: typing.Dict[int, typing.Set[int]]
+
+    def _ids(self, pcs) -> typing.List[int]:
+        site_ids = self.site_ids
+        try:
+            return list(map(site_ids.__getitem__, pcs))
+        except KeyError:
+            for pc in pcs:
+                if pc not in site_ids:
+                    site_ids[pc] = len(site_ids)
+                    self.pcs.append(pc)
+            grow = len(site_ids) - len(self.executions)
+            for counters in (self.executions, self.taken, self.mispredictions, self.aliased):
+                counters.extend(itertools.repeat(0, grow))
+            return list(map(site_ids.__getitem__, pcs))
+
+    def add_chunk(self, pcs, predictions, outcomes, indices=None):
+        """
+        Accumulates one chunk of branches and their predictions and, if given, the table slot of each prediction.
+        """
+        if hasattr(predictions, 'tolist'):
+            predictions = predictions.tolist()
+        if hasattr(outcomes, 'tolist'):
+            outcomes = outcomes.tolist()
+        ids = self._ids(pcs)
+        mispredicted = bytes(map(operator.ne, predictions, outcomes))
+        for counters, selected in ((self.executions, ids),
+                                   (self.taken, itertools.compress(ids, outcomes)),
+                                   (self.mispredictions, itertools.compress(ids, mispredicted))):
+            for site, count in collections.Counter(selected).items():
+                counters[site] += count
+
+        if indices is None:
+            return
+        self.has_table = True
+        owners, slot_sites, aliased = self.slot_owners, self.slot_sites, self.aliased
+        for slot, site in zip(indices, ids):
+            previous = owners.get(slot)
+            if previous != site:
+                if previous is None:
+                    slot_sites[slot] = {site}
+                else:
+                    aliased[site] += 1
+                    slot_sites[slot].add(site)
+                owners[slot] = site
+
+    def simulate_chunk(self, predictor: AbstractBasePredictor, results: typing.Dict, chunk):
+        """
+        The profiled equivalent of ``branch.simulate_chunk``: runs ``predictor`` over the chunk, adding the outcome to
+        ``results`` and to this profile.
+        """
+        from branch import batch_predictions, tally_predictions
+
+        opcodes, pcs, targets, outcomes = chunk
+        indices = predictor.table_indices(pcs, outcomes)
+        predictions = batch_predictions(predictor, chunk)
+        tally_predictions(results, opcodes, predictions, outcomes)
+        self.add_chunk(pcs, predictions, outcomes, indices)
+
+    def site(self, site: int) -> typing.Dict:
+        executions, taken, mispredictions = self.executions[site], self.taken[site], self.mispredictions[site]
+        record = {
+            'pc': self.pcs[site],
+            'executions': executions,
+            'taken_rate': taken / executions if executions else 0.0,
+            'mispredictions': mispredictions,
+            'misprediction_rate': mispredictions / executions if executions else 0.0,
+        }
+        if self.has_table:
+            record['alias_rate'] = self.aliased[site] / executions if executions else 0.0
+        return record
+
+    def sites(self) -> typing.List[typing.Dict]:
+        """
+        Returns the counters of every site, in order of first execution.
+        """
+        return [self.site(site) for site in range(len(self.pcs))]
+
+    def top(self, k: int = DEFAULT_TOP_K) -> typing.List[typing.Dict]:
+        """
+        Returns the ``k`` sites with the most mispredictions (all sites if ``k`` is 0), worst first.
+        """
+        worst = sorted(range(len(self.pcs)), key=self.mispredictions.__getitem__, reverse=True)
+        return [self.site(site) for site in (worst[:k] if k else worst)]
+
+    def aliasing(self) -> typing.Optional[typing.Dict]:
+        """
+        Returns the aliasing statistics of the predictor's table, or None for predictors without one.
+        """
+        if not self.has_table:
+            return None
+        shared = [sites for sites in self.slot_sites.values() if len(sites) > 1]
+        conflicting = sum(1 for sites in shared
+                          if len({2 * self.taken[site] >= self.executions[site] for site in sites}) > 1)
+        total, aliased = sum(self.executions), sum(self.aliased)
+        return {
+            'slots_used': len(self.slot_sites),
+            'slots_shared': len(shared),
+            'slots_conflicting': conflicting,
+            'max_sites_per_slot': max(map(len, self.slot_sites.values()), default=0),
+            'aliased_accesses': aliased,
+            'alias_rate': aliased / total if total else 0.0,
+        }
+
+    def summary(self, k: int = DEFAULT_TOP_K) -> typing.Dict:
+        summary = {
+            'sites': len(self.pcs),
+            'top': self.top(k),
+        }
+        aliasing = self.aliasing()
+        if aliasing is not None:
+            summary['aliasing'] = aliasing
+        return summary
+
+
+class SiteProfiler:
+    """
+    Collects a :class:`SiteProfile` per predictor for every trace evaluated. ``profiles[trace]`` holds the profiles of
+    each trace, in predictor order.
+    """
+    def __init__(self, top_k: int = DEFAULT_TOP_K):
+        self.top_k = top_k
+        self.profiles = dict()  # type: typing.Dict[str, typing.List[SiteProfile]]
+
+    def begin(self, trace: str, num_predictors: int) -> typing.List[SiteProfile]:
+        self.profiles[trace] = [SiteProfile() for _ in range(num_predictors)]
+        return self.profiles[trace]
+
+    def summaries(self, i: int) -> typing.Dict[str, typing.Dict]:
+        """
+        Returns the summary of the ``i``th predictor on every trace, keyed by trace.
+        """
+        return {trace: profiles[i].summary(self.top_k) for trace, profiles in self.profiles.items()}
@@ -0,0 +1,166 @@
+"""
+Code generator specializing table predictors to one configuration.
+
+``TwoLevel`` and ``GShare`` are written for any configuration, so their batch loop still shifts, masks and takes
+remainders by parameters which never change after construction. :func:`specialize` generates the source of a
+``run_trace`` loop for the predictor's exact configuration, compiles it and switches the predictor over to it. In the
+generated loop
+
+  - every parameter is a literal: masks, shift amounts, thresholds and table sizes,
+  - the counter index ``((history << pc_bits) | (pc & pc_mask)) % num_pht_entries`` is folded to
+    ``(history * (2 ** pc_bits % num_pht_entries) + (pc & pc_mask)) % num_pht_entries`` (XOR, for GShare, is the same
+    as OR here, the shifted history has no bits in common with the masked PC) and then simplified: terms which are
+    always zero are dropped, a mask which keeps every bit of a 64-bit PC is dropped, ``%`` by a power of two becomes
+    ``&`` and a remainder which can't change the value is dropped altogether,
+  - a single history register is kept in a local variable instead of the register table.
+
+Predictions and the state left in the tables are identical to the generic classes'. Kernels are cached per generated
+source, so configurations which fold to the same code share one, and registered with ``linecache`` so tracebacks and
+profilers show the generated lines. Pass ``--specialize`` to branch.py (or the ``specialized`` path to bench.py).
+"""
+
+import linecache
+import typing
+
+from predictors import AbstractBasePredictor
+from predictors.GShare import GShare
+from predictors.TwoLevel import TwoLevel
+
+SUPPORTED_PREDICTORS = (TwoLevel, GShare)
+
+_PC_LIMIT = 1 << 64  # PCs are 64-bit addresses
+
+_kernels = dict()  # type: typing.Dict[str, typing.Callable]
+_classes = dict()  # type: typing.Dict[typing.Tuple[type, typing.Callable], type]
+
+
+def _reduce(expr: str, bound: int, modulus: int) -> str:
+    """
+    Returns ``expr % modulus`` for an expression whose value is below ``bound``, in its cheapest form.
+    """
+    if bound <= modulus:
+        return expr
+    if ' ' in expr:
+        expr = f'({expr})'
+    if modulus & (modulus - 1) == 0:
+        return f'{expr} & {modulus - 1}'
+    return f'{expr} % {modulus}'
+
+
+def kernel_source(predictor: TwoLevel) -> str:
+    """
+    Returns the source of the specialized ``run_trace(bhr, pht, pcs, outcomes)`` loop of ``predictor``.
+    """
+    num_bhrs, num_pht_entries = predictor.num_bhrs, predictor.num_pht_entries
+    history_bits, pc_bits, history_mask = predictor.history_size_bits, predictor.pc_bits, predictor.history_mask
+
+    # the PC's contribution to the counter index
+    if pc_bits == 0:
+        pc_term, pc_bound = None, 1
+    elif pc_bits >= 64:
+        pc_term, pc_bound = 'pc', _PC_LIMIT
+    else:
+        pc_term, pc_bound = f'(pc & {predictor.pc_mask})', 2 ** pc_bits
+    # the history's contribution, (history << pc_bits) % num_pht_entries == history * multiplier % num_pht_entries
+    multiplier = pow(2, pc_bits, num_pht_entries)
+    history_bound = 2 ** history_bits
+    if multiplier == 0 or history_bits == 0:
+        history_term = None
+    elif multiplier == 1:
+        history_term = 'history'
+    else:
+        history_term = f'history * {multiplier}'
+        history_bound = (history_bound - 1) * multiplier + 1
+
+    terms = [term for term in (history_term, pc_term) if term is not None]
+    bound = (history_bound if history_term else 1) + (pc_bound if pc_term else 1) - 1
+    pht_index = _reduce(' + '.join(terms) or '0', bound, num_pht_entries)
+
+    single = num_bhrs == 1
+    if single:
+        bhr_index = None
+    elif num_bhrs & (num_bhrs - 1) == 0:
+        bhr_index = f'pc & {num_bhrs - 1}'
+    else:
+        bhr_index = f'pc % {num_bhrs}'
+    store = 'history = ' if single else 'bhr[bhr_index] = '
+
+    lines = [
+        'def run_trace(bhr, pht, pcs, outcomes):',
+        '    predictions = bytearray(len(outcomes))',
+    ]
+    if single:
+        lines.append('    history = bhr[0]')
+    lines.append('    for i, (pc, result) in enumerate(zip(pcs, outcomes)):')
+    if not single:
+        lines += [
+            f'        bhr_index = {bhr_index}',
+            '        history = bhr[bhr_index]',
+        ]
+    lines += [
+        f'        pht_index = {pht_index}',
+        '        state = pht[pht_index]',
+        f'        if state >= {predictor.threshold}:',
+        '            predictions[i] = 1',
+        '        if result:',
+        f'            if state < {predictor.saturated}:',
+        '                pht[pht_index] = state + 1',
+        f'            {store}((history << 1) | 1) & {history_mask}',
+        '        else:',
+        '            if state:',
+        '                pht[pht_index] = state - 1',
+        f'            {store}(history << 1) & {history_mask}',
+    ]
+    if single:
+        lines.append('    bhr[0] = history')
+    lines.append('    return predictions')
+    return '\n'.join(lines) + '\n'
+
+
+def compile_kernel(source: str) -> typing.Callable:
+    """
+    Compiles a kernel source, or returns the kernel already compiled from it.
+    """
+    kernel = _kernels.get(source)
+    if kernel is None:
+        filename = f'<specialized kernel {len(_kernels)}>'
+        namespace = dict()  # type: typing.Dict[str, typing.Any]
+        exec(compile(source, filename, 'exec'), namespace)
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        kernel = _kernels[source] = namespace['run_trace']
+    return kernel
+
+
+def specialize(predictor: AbstractBasePredictor) -> AbstractBasePredictor:
+    """
+    Switches ``predictor`` (a TwoLevel or GShare) to a generated subclass whose ``run_trace`` is specialized to its
+    configuration, keeping its state, and returns it. The subclass keeps the predictor's name. Raises ValueError for
+    other predictors.
+    """
+    cls = type(predictor)
+    if cls not in SUPPORTED_PREDICTORS:
+        raise ValueError(f'{predictor.name()} can\'t be specialized, only '
+                         f'{", ".join(supported.__name__ for supported in SUPPORTED_PREDICTORS)} can')
+
+    kernel = compile_kernel(kernel_source(predictor))
+    specialized = _classes.get((cls, kernel))
+    if specialized is None:
+        def run_trace(self, pcs, targets, opcodes, outcomes):
+            return kernel(self.bhr, self.pht, pcs, outcomes)
+
+        specialized = _classes[(cls, kernel)] = type(cls.__name__, (cls,), {
+            '__slots__': (),
+            '__module__': __name__,
+            '__doc__': cls.__doc__,
+            'run_trace': run_trace,
+        })
+    predictor.__class__ = specialized
+    return predictor
+
+
+def is_specializable(predictor: AbstractBasePredictor) -> bool:
+    return type(predictor) in SUPPORTED_PREDICTORS
+
+
+def is_specialized(predictor: AbstractBasePredictor) -> bool:
+    return type(predictor).__module__ == __name__
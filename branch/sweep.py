@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+
+"""
+Parallel design-space sweep over (predictor, kwargs, trace) grids.
+
+A grid spec is a JSON or YAML (requires PyYAML) document such as:
+
+    traces: [traces]                      # trace files, directories or glob patterns
+    predictors:
+      - name: AlwaysTaken
+      - name: Bimodal
+        args:
+          counter_bits: [1, 2, 3]         # a list of values
+          table_size: {start: 6, stop: 14, base: 2}   # 2^6, 2^7, ... 2^14
+      - name: GShare
+        args:
+          history_size_bits: {start: 4, stop: 16, step: 2}   # 4, 6, ... 16 (stop is inclusive)
+          pht_counter_bits: 2             # a single value
+
+Every predictor entry may also give its own ``traces``. The cross product of each entry's arguments and traces is run
+on a process pool and every result is written to the output as soon as it completes, in any of the formats of
+writers.py. Jobs lost to a crashed worker are retried, each in a process of its own; jobs that raise are reported and
+skipped without affecting the rest of the sweep.
+"""
+
+import argparse
+import concurrent.futures
+import glob
+import itertools
+import json
+import os
+import sys
+import traceback
+import typing
+from concurrent.futures.process import BrokenProcessPool
+
+from branch import get_predictor, test_predictor_single_trace
+from resultcache import DEFAULT_CACHE_PATH, ResultCache
+from tracereader import list_traces
+from writers import FORMATS, ResultWriter, open_writer
+
+Job = typing.Tuple[str, typing.Dict, str]
+
+
+def load_spec(path: str) -> typing.Dict:
+    """
+    Loads a grid spec from a JSON file, or a YAML file when the extension is ``.yaml``/``.yml``.
+    """
+    with open(path, 'r') as fp:
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise ImportError(f"PyYAML is required to read '{path}', or write the grid spec as JSON instead")
+            return yaml.safe_load(fp)
+        return json.load(fp)
+
+
+def expand_values(value) -> typing.List:
+    """
+    Expands one parameter of a grid spec: a list is taken as-is, a mapping with ``start``/``stop`` and optional
+    ``step``/``base`` is an inclusive range (raised as exponents of ``base`` if given), anything else is a single value.
+    """
+    if isinstance(value, list):
+        return value
+    if isinstance(value, dict):
+        values = list(range(value['start'], value['stop'] + 1, value.get('step', 1)))
+        if 'base' in value:
+            values = [value['base'] ** v for v in values]
+        return values
+    return [value]
+
+
+def expand_traces(patterns: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Expands trace files, directories (every file within, like ``test_predictor_all_traces``) and glob patterns.
+    """
+    traces = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            traces.extend(sorted(list_traces(pattern)))
+        elif glob.has_magic(pattern):
+            traces.extend(sorted(glob.glob(pattern)))
+        else:
+            traces.append(pattern)
+    return traces
+
+
+def expand_grid(spec: typing.Dict) -> typing.List[Job]:
+    """
+    Returns every ``(predictor name, kwargs, trace)`` job described by a grid spec.
+    """
+    jobs = []
+    for entry in spec['predictors']:
+        traces = expand_traces(entry.get('traces', spec.get('traces', ['traces'])))
+        args = entry.get('args') or dict()
+        keys = list(args)
+        for values in itertools.product(*(expand_values(args[key]) for key in keys)):
+            kwargs = dict(zip(keys, values))
+            jobs.extend((entry['name'], kwargs, trace) for trace in traces)
+    return jobs
+
+
+# per worker process result cache, opened by init_worker
+_cache = None  # type: typing.Optional[ResultCache]
+
+
+def init_worker(cache_path: typing.Optional[str]):
+    global _cache
+    _cache = ResultCache(cache_path) if cache_path else None
+
+
+def run_job(predictor_name: str, kwargs: typing.Dict, trace: str) -> typing.Dict:
+    """
+    Evaluates a single job, returning the result of ``test_predictor_single_trace`` with a ``_meta`` block added.
+    """
+    predictor = get_predictor(predictor_name)(**kwargs)
+    result = test_predictor_single_trace(predictor, trace, cache=_cache)
+    result['_meta'] = {
+        'predictor': predictor.name(),
+        'kwargs': kwargs,
+        'storage_bits': predictor.storage_bits()
+    }
+    return result
+
+
+def run_isolated(job: Job, cache_path: typing.Optional[str]) -> typing.Dict:
+    """
+    Runs a single job in its own worker process, so that if it crashes the process it takes no other job with it.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, initializer=init_worker,
+                                                initargs=(cache_path,)) as pool:
+        return pool.submit(run_job, *job).result()
+
+
+def sweep(jobs: typing.List[Job], writer: ResultWriter, workers: int = None, retries: int = 1,
+          cache_path: typing.Optional[str] = DEFAULT_CACHE_PATH) -> typing.List[Job]:
+    """
+    Runs ``jobs`` on a process pool of ``workers`` processes (all cores by default), writing each result as it
+    completes. Results are looked up in and saved to the result cache at ``cache_path`` unless it is None. A crashed
+    worker breaks the whole pool, so jobs lost that way are retried up to ``retries`` times, each in a process of its
+    own. Returns the jobs which failed, either by raising or by crashing every attempt.
+    """
+    failed = []
+    lost = []
+
+    def collect(futures, on_lost):
+        for future in concurrent.futures.as_completed(futures):
+            job = futures[future]
+            try:
+                writer.write(future.result())
+            except BrokenProcessPool:
+                on_lost(job)
+            except Exception:
+                print(f'job {job} failed:', file=sys.stderr)
+                traceback.print_exc()
+                failed.append(job)
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                                initargs=(cache_path,)) as pool:
+        collect({pool.submit(run_job, *job): job for job in jobs}, lost.append)
+
+    for _ in range(retries):
+        retry, lost = lost, []
+        if not retry:
+            break
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            collect({pool.submit(run_isolated, job, cache_path): job for job in retry}, lost.append)
+
+    for job in lost:
+        print(f'job {job} failed: worker process died', file=sys.stderr)
+        failed.append(job)
+    return failed
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Run every combination of predictor, predictor arguments and trace in a grid spec in parallel, "
+                    "streaming results into a single CSV or JSON table."
+    )
+    parser.add_argument(
+        'spec',
+        help="the grid spec (JSON, or YAML with PyYAML installed)"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="save output into a file. if omitted, results are printed to the console"
+    )
+    parser.add_argument(
+        "-f", "--format",
+        help="output format, see writers.py. JSON output is a list of result dicts, each with its own _meta block",
+        choices=FORMATS,
+        default='csv'
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        help="number of worker processes. defaults to the number of cores",
+        type=int
+    )
+    parser.add_argument(
+        "--retries",
+        help="how many times to retry a job whose worker process died",
+        type=int,
+        default=1
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="always re-run the simulation instead of returning previously cached results",
+        action="store_true"
+    )
+    parser.add_argument(
+        "--cache-path",
+        help="location of the result cache database",
+        default=DEFAULT_CACHE_PATH
+    )
+
+    parsed = parser.parse_args()
+
+    grid_jobs = expand_grid(load_spec(parsed.spec))
+    print(f'running {len(grid_jobs)} jobs', file=sys.stderr)
+
+    result_writer = open_writer(parsed.output, parsed.format)
+    try:
+        failed_jobs = sweep(grid_jobs, result_writer, parsed.jobs, parsed.retries,
+                            None if parsed.no_cache else parsed.cache_path)
+    finally:
+        result_writer.close()
+
+    print(f'{result_writer.rows} of {len(grid_jobs)} jobs completed', file=sys.stderr)
+    if failed_jobs:
+        exit(1)
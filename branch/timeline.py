@@ -0,0 +1,137 @@
+"""
+Windowed accuracy timelines.
+
+The totals of a trace hide its phases: the cost of warming up a predictor's tables, or the change in behaviour between
+a program's initialisation and its steady state. With a :class:`TimelineRecorder` passed to
+``test_predictors_single_trace`` (``--timeline N`` on the command line), every predictor also records its accuracy,
+mispredictions per thousand branches (``mpkb``) and the taken rate over consecutive windows of N branches.
+
+Windows are counted in arrays preallocated for ``--timeline-capacity`` windows, so memory stays the same however long
+the trace is. Once they are full, either the oldest windows are overwritten (a ring buffer keeping the most recent
+part of the trace), or, with ``--timeline-downsample``, adjacent pairs of windows are merged into windows twice as
+long, so the timeline always covers the whole trace at a resolution which halves as it grows.
+
+The timeline is added to each predictor's ``_meta`` as columns: the first branch, number of branches, accuracy, mpkb
+and taken rate of every window, oldest first.
+"""
+
+import operator
+import typing
+from array import array
+
+from predictors import AbstractBasePredictor
+
+DEFAULT_CAPACITY = 4096
+
+
+class Timeline:
+    """
+    The windows of one predictor over one trace.
+    """
+    def __init__(self, window: int, capacity: int = DEFAULT_CAPACITY, downsample: bool = False):
+        self.window = window
+        self.capacity = capacity
+        self.downsample = downsample
+        self.branches = array('Q', [0]) * capacity
+        self.correct = array('Q', [0]) * capacity
+        self.taken = array('Q', [0]) * capacity
+        self.index = 0  # of the current window, counted from the start of the trace
+        self.filled = 0  # branches in the current window
+
+    def _open_window(self):
+        if self.index < self.capacity:
+            return
+        if self.downsample:
+            half = self.capacity // 2
+            for counters in (self.branches, self.correct, self.taken):
+                counters[:half] = array('Q', map(operator.add, counters[0::2], counters[1::2]))
+                counters[half:] = array('Q', [0]) * (self.capacity - half)
+            self.window *= 2
+            self.index = half
+        else:
+            slot = self.index % self.capacity
+            self.branches[slot] = self.correct[slot] = self.taken[slot] = 0
+
+    def add_chunk(self, predictions, outcomes):
+        """
+        Accumulates one chunk of predictions and actual outcomes.
+        """
+        if hasattr(predictions, 'tolist'):
+            predictions = predictions.tolist()
+        if hasattr(outcomes, 'tolist'):
+            outcomes = outcomes.tolist()
+        correct = bytes(map(operator.eq, predictions, outcomes))
+        outcomes = bytes(outcomes)
+
+        position, length = 0, len(correct)
+        while position < length:
+            if self.filled == 0:
+                self._open_window()
+            end = min(length, position + self.window - self.filled)
+            slot = self.index % self.capacity
+            self.branches[slot] += end - position
+            self.correct[slot] += correct.count(1, position, end)
+            self.taken[slot] += outcomes.count(1, position, end)
+            self.filled += end - position
+            position = end
+            if self.filled == self.window:
+                self.index += 1
+                self.filled = 0
+
+    def simulate_chunk(self, predictor: AbstractBasePredictor, results: typing.Dict, chunk):
+        """
+        The recording equivalent of ``branch.simulate_chunk``: runs ``predictor`` over the chunk, adding the outcome to
+        ``results`` and to this timeline.
+        """
+        from branch import batch_predictions, tally_predictions
+
+        opcodes, pcs, targets, outcomes = chunk
+        predictions = batch_predictions(predictor, chunk)
+        tally_predictions(results, opcodes, predictions, outcomes)
+        self.add_chunk(predictions, outcomes)
+
+    def summary(self) -> typing.Dict:
+        """
+        Returns the windows held, oldest first, as columns.
+        """
+        last = self.index + (1 if self.filled else 0)  # one past the last window with any branches
+        first = max(0, last - self.capacity)
+        windows = range(first, last)
+        branches = [self.branches[i % self.capacity] for i in windows]
+        correct = [self.correct[i % self.capacity] for i in windows]
+        taken = [self.taken[i % self.capacity] for i in windows]
+        return {
+            'window': self.window,
+            'mode': 'downsample' if self.downsample else 'ring',
+            'dropped_windows': first,
+            'start': [i * self.window for i in windows],
+            'branches': branches,
+            'accuracy': [c / n if n else 0.0 for c, n in zip(correct, branches)],
+            'mpkb': [1000 * (n - c) / n if n else 0.0 for c, n in zip(correct, branches)],
+            'taken_rate': [t / n if n else 0.0 for t, n in zip(taken, branches)],
+        }
+
+
+class TimelineRecorder:
+    """
+    Records a :class:`Timeline` per predictor for every trace evaluated. ``timelines[trace]`` holds the timelines of
+    each trace, in predictor order.
+    """
+    def __init__(self, window: int, capacity: int = DEFAULT_CAPACITY, downsample: bool = False):
+        if window < 1 or capacity < 2 or downsample and capacity % 2:
+            raise ValueError(f'the timeline window ({window}) must be positive and its capacity ({capacity}) at least '
+                             f'2, and even to be downsampled')
+        self.window = window
+        self.capacity = capacity
+        self.downsample = downsample
+        self.timelines = dict()  # type: typing.Dict[str, typing.List[Timeline]]
+
+    def begin(self, trace: str, num_predictors: int) -> typing.List[Timeline]:
+        self.timelines[trace] = [Timeline(self.window, self.capacity, self.downsample) for _ in range(num_predictors)]
+        return self.timelines[trace]
+
+    def summaries(self, i: int) -> typing.Dict[str, typing.Dict]:
+        """
+        Returns the timeline of the ``i``th predictor on every trace, keyed by trace.
+        """
+        return {trace: timelines[i].summary() for trace, timelines in self.timelines.items()}
@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Synthetic branch trace generator.
+
+Generates traces of any length, without a RISC-V toolchain, from a small model of a program: ``sites`` static branch
+sites, a ``backward`` fraction of which are loop back-edges while the rest are forward branches spread over the loop
+bodies. The program repeatedly picks a loop and runs it for its trip count (drawn once per loop from
+``[min_trip, max_trip]``), executing every forward branch of the body on each iteration. Each forward branch either
+
+  - follows the global history, repeating (or inverting) the outcome of one of the last few branches executed, for a
+    ``correlation`` fraction of the sites,
+  - is a data-dependent coin flip, for a ``randomness`` fraction of the sites,
+  - or is biased, taken with a fixed per-site probability, for the remaining sites.
+
+The same seed and parameters always give the same trace. Records are streamed, so memory use does not depend on the
+trace length. Text traces use the usual ``opcode,pc,target,taken`` lines and are compressed according to the output's
+extension (.gz, .xz, .bz2); binary traces are written in the ``.btrace`` format (see btrace.py). Example:
+
+    ./tracegen.py -n 100000000 --sites 4096 --correlation 0.4 --seed 7 -o big.btrace
+"""
+
+import argparse
+import bz2
+import gzip
+import itertools
+import lzma
+import random
+import sys
+import typing
+
+from btrace import write_btrace
+from predictors import Predict
+
+FORWARD_OPCODES = ['beq', 'bne', 'blt', 'bltu', 'bge', 'bgeu', 'beqz', 'bnez']
+BACKWARD_OPCODES = ['bne', 'blt', 'bltu', 'bnez']
+# the furthest back a correlated branch looks in the global history
+MAX_CORRELATION_LAG = 8
+
+_HISTORY_MASK = (1 << MAX_CORRELATION_LAG) - 1
+_BIASED, _CORRELATED, _RANDOM = range(3)
+
+
+def generate(num_branches: int, sites: int = 1024, min_trip: int = 4, max_trip: int = 64, correlation: float = 0.2,
+             randomness: float = 0.1, backward: float = 0.25,
+             seed: int = 0) -> typing.Iterator[typing.Tuple[str, int, int, int]]:
+    """
+    Yields ``num_branches`` ``(opcode, pc, target, taken)`` records of the synthetic workload described at the top of
+    this module.
+    """
+    if sites < 1 or not 1 <= min_trip <= max_trip:
+        raise ValueError('sites must be positive and 1 <= min_trip <= max_trip')
+    for name, fraction in (('correlation', correlation), ('randomness', randomness), ('backward', backward)):
+        if not 0 <= fraction <= 1:
+            raise ValueError(f'{name} must be in range [0, 1]')
+    if correlation + randomness > 1:
+        raise ValueError('correlation and randomness may add up to at most 1')
+
+    rng = random.Random(seed)
+    pcs = [0x10000 + 4 * slot for slot in rng.sample(range(sites * 64), sites)]
+    num_loops = round(sites * backward)
+
+    # loops are (opcode, pc, target, trip count) back-edges, or None for straight-line code when there are no loops
+    loops = []  # type: typing.List[typing.Optional[typing.Tuple[str, int, int, int]]]
+    for pc in pcs[:num_loops]:
+        loops.append((rng.choice(BACKWARD_OPCODES), pc, pc - 4 * rng.randrange(2, 256),
+                      rng.randint(min_trip, max_trip)))
+    if not loops:
+        loops.append(None)
+
+    # forward branches are (opcode, pc, target, kind, parameter), dealt out over the loop bodies
+    bodies = [[] for _ in loops]  # type: typing.List[typing.List[typing.Tuple[str, int, int, int, typing.Any]]]
+    for i, pc in enumerate(pcs[num_loops:]):
+        kind = rng.random()
+        if kind < correlation:
+            # the history lag to follow, and whether to invert it
+            branch = (_CORRELATED, (rng.randrange(MAX_CORRELATION_LAG), rng.randrange(2)))
+        elif kind < correlation + randomness:
+            branch = (_RANDOM, None)
+        else:
+            branch = (_BIASED, rng.betavariate(0.5, 0.5))  # mostly strongly biased one way or the other
+        bodies[i % len(bodies)].append((rng.choice(FORWARD_OPCODES), pc, pc + 4 * rng.randrange(2, 256)) + branch)
+
+    history = 0
+    emitted = 0
+    uniform = rng.random
+    while True:
+        loop = rng.randrange(len(loops))
+        back_edge, body = loops[loop], bodies[loop]
+        trip_count = back_edge[3] if back_edge is not None else 1
+        for trip in range(trip_count):
+            for opcode, pc, target, kind, parameter in body:
+                if emitted == num_branches:
+                    return
+                if kind == _BIASED:
+                    taken = Predict.TAKEN if uniform() < parameter else Predict.NOT_TAKEN
+                elif kind == _CORRELATED:
+                    taken = ((history >> parameter[0]) & 1) ^ parameter[1]
+                else:
+                    taken = Predict.TAKEN if uniform() < 0.5 else Predict.NOT_TAKEN
+                history = ((history << 1) | taken) & _HISTORY_MASK
+                emitted += 1
+                yield opcode, pc, target, taken
+
+            if back_edge is not None:
+                if emitted == num_branches:
+                    return
+                taken = Predict.TAKEN if trip < trip_count - 1 else Predict.NOT_TAKEN
+                history = ((history << 1) | taken) & _HISTORY_MASK
+                emitted += 1
+                yield back_edge[0], back_edge[1], back_edge[2], taken
+
+
+def open_output(path: typing.Optional[str]) -> typing.TextIO:
+    """
+    Opens a text trace for writing, compressing it according to its extension. ``None`` or '-' is stdout.
+    """
+    if path is None or path == '-':
+        return sys.stdout
+    if path.endswith('.gz'):
+        return gzip.open(path, 'wt')
+    if path.endswith('.xz'):
+        return lzma.open(path, 'wt')
+    if path.endswith('.bz2'):
+        return bz2.open(path, 'wt')
+    return open(path, 'w')
+
+
+def write_text(records: typing.Iterable[typing.Tuple[str, int, int, int]], fp: typing.TextIO,
+               chunk_size: int = 1 << 16) -> int:
+    """
+    Writes records as text trace lines, returning the number of branches written.
+    """
+    count = 0
+    records = iter(records)
+    while True:
+        lines = [f'{opcode},{pc:x},{target:x},{taken}\n'
+                 for opcode, pc, target, taken in itertools.islice(records, chunk_size)]
+        if not lines:
+            return count
+        fp.write(''.join(lines))
+        count += len(lines)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Generate a reproducible synthetic branch trace with controllable workload characteristics."
+    )
+    parser.add_argument(
+        "-n", "--branches",
+        help="number of branches to generate",
+        type=int,
+        required=True
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="save the trace into a file (.gz, .xz and .bz2 text traces are compressed). if omitted, a text trace is "
+             "printed to the console"
+    )
+    parser.add_argument(
+        "-f", "--format",
+        help="whether to write a text or binary trace. defaults to binary for .btrace outputs, text otherwise",
+        choices=['text', 'btrace']
+    )
+    parser.add_argument(
+        "--sites",
+        help="number of static branch sites",
+        type=int,
+        default=1024
+    )
+    parser.add_argument(
+        "--min-trip",
+        help="smallest loop trip count",
+        type=int,
+        default=4
+    )
+    parser.add_argument(
+        "--max-trip",
+        help="largest loop trip count",
+        type=int,
+        default=64
+    )
+    parser.add_argument(
+        "--correlation",
+        help="fraction of forward branches whose outcome follows a recent branch in the global history",
+        type=float,
+        default=0.2
+    )
+    parser.add_argument(
+        "--randomness",
+        help="fraction of forward branches with random, data-dependent outcomes",
+        type=float,
+        default=0.1
+    )
+    parser.add_argument(
+        "--backward",
+        help="fraction of branch sites which are loop back-edges, the rest are forward branches",
+        type=float,
+        default=0.25
+    )
+    parser.add_argument(
+        "--seed",
+        help="random seed, the same seed and parameters always give the same trace",
+        type=int,
+        default=0
+    )
+
+    parsed = parser.parse_args()
+
+    out_format = parsed.format or ('btrace' if (parsed.output or '').endswith('.btrace') else 'text')
+    try:
+        trace_records = generate(parsed.branches, parsed.sites, parsed.min_trip, parsed.max_trip, parsed.correlation,
+                                 parsed.randomness, parsed.backward, parsed.seed)
+        if out_format == 'btrace':
+            if not parsed.output or parsed.output == '-':
+                raise ValueError('binary traces must be written to a file, use -o')
+            write_btrace(trace_records, parsed.output)
+        else:
+            out = open_output(parsed.output)
+            try:
+                write_text(trace_records, out)
+            finally:
+                if out is not sys.stdout:
+                    out.close()
+    except ValueError as e:
+        print(e)
+        exit(1)
@@ -0,0 +1,424 @@
+"""
+Streaming trace reader.
+
+Traces are read in fixed-size chunks of branches so memory use is bounded by the chunk size rather than the trace
+length. Each chunk is a tuple of four equal-length columns ``(opcodes, pcs, targets, outcomes)``. Text traces may be
+compressed with gzip, xz, bzip2 or zstd (the latter only when the ``zstandard`` package is installed); compression is
+detected from the file contents, not its extension. Text traces are decompressed and parsed on a background thread
+a few chunks ahead of the simulation, while binary ``.btrace`` files are sliced directly out of the memory map.
+
+A trace may also be a live stream, stdin (``-``) or a named pipe, of uncompressed text lines such as a tracer's output.
+Streams are read as the lines arrive, and a partial chunk is handed on whenever the stream goes quiet for a while, so
+the consumer sees every branch shortly after it was written.
+
+A trace name may select a region of interest of the trace with a slice, ``traces/gol.trace[1000000:5000000]`` for the
+branches 1M up to 5M, or ``[:N]`` / ``[N:]``. Binary traces are sliced directly, and text traces use their offset index
+(see offsetindex.py) to start reading close to the region instead of at the first line.
+"""
+
+import bz2
+import gzip
+import io
+import itertools
+import lzma
+import os
+import queue
+import re
+import select
+import stat
+import sys
+import threading
+import time
+import typing
+
+import btrace
+from predictors import Predict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# number of branches per chunk
+DEFAULT_CHUNK_SIZE = 1 << 16
+# number of parsed chunks the background reader may run ahead of the consumer
+DEFAULT_PREFETCH = 2
+# longest time, in seconds, that branches read from a stream are held back waiting for a chunk to fill
+DEFAULT_STREAM_INTERVAL = 1.0
+# the trace name of stdin
+STDIN = '-'
+
+Chunk = typing.Tuple[typing.Sequence[str], typing.Sequence[int], typing.Sequence[int], typing.Sequence[int]]
+
+_MAGICS = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'BZh', 'bz2'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+
+def detect_compression(path: str) -> typing.Optional[str]:
+    """
+    Returns the compression of the file at ``path`` ('gzip', 'xz', 'bz2' or 'zstd'), or None if it is uncompressed.
+    """
+    with open(path, 'rb') as fp:
+        head = fp.read(6)
+    for magic, kind in _MAGICS:
+        if head.startswith(magic):
+            return kind
+    return None
+
+
+def open_binary(path: str) -> typing.BinaryIO:
+    """
+    Opens a text trace for reading as bytes, transparently decompressing it if needed.
+    """
+    kind = detect_compression(path)
+    if kind == 'gzip':
+        return gzip.open(path, 'rb')
+    if kind == 'xz':
+        return lzma.open(path, 'rb')
+    if kind == 'bz2':
+        return bz2.open(path, 'rb')
+    if kind == 'zstd':
+        if zstandard is None:
+            raise ImportError(f"'{path}' is zstd compressed, install the 'zstandard' package to read it")
+        return io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+    return open(path, 'rb')
+
+
+def open_text(path: str) -> typing.TextIO:
+    """
+    Opens a text trace for reading, transparently decompressing it if needed.
+    """
+    return io.TextIOWrapper(open_binary(path))
+
+
+_RANGE = re.compile(r'^(.+)\[(\d*):(\d*)\]$')
+
+
+def split_range(trace: str) -> typing.Tuple[str, int, typing.Optional[int]]:
+    """
+    Splits a trace name selecting a region of interest, ``path[start:end]`` with either bound optional, into the path
+    of the trace, the first branch and the branch after the last (None up to the end). Names without a region, or
+    naming an existing file, are the whole trace.
+    """
+    match = _RANGE.match(trace)
+    if match is None or os.path.exists(trace):
+        return trace, 0, None
+    path, start, end = match.groups()
+    return path, int(start or 0), int(end) if end else None
+
+
+def is_range(trace: str) -> bool:
+    """
+    Returns whether ``trace`` selects a region of interest of a trace (see ``split_range``).
+    """
+    return split_range(trace)[0] != trace
+
+
+def _shift_ranges(ranges: typing.Iterable[typing.Tuple[int, int]], low: int,
+                  high: typing.Optional[int]) -> typing.Iterator[typing.Tuple[int, int]]:
+    # ranges of the region [low, high) as ranges of the whole trace
+    for start, end in ranges:
+        start, end = low + start, low + end if high is None else min(low + end, high)
+        if high is not None and start >= high:
+            return
+        yield start, end
+
+
+def parse_lines(lines: typing.Iterable[str]) -> Chunk:
+    """
+    Parses text trace lines into a column chunk, skipping blank lines.
+    """
+    opcodes, pcs, targets, outcomes = [], [], [], []
+    for line in lines:
+        if not line.strip():
+            continue
+
+        opcode, pc, target, taken = line.split(',')
+        taken = taken.strip()
+        if taken != '0' and taken != '1':
+            raise ValueError('result type not valid')
+        opcodes.append(opcode)
+        pcs.append(int(pc, 16))
+        targets.append(int(target, 16))
+        outcomes.append(Predict.TAKEN if taken == '1' else Predict.NOT_TAKEN)
+    return opcodes, pcs, targets, outcomes
+
+
+def iter_text_chunks(fp: typing.TextIO, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[Chunk]:
+    """
+    Yields column chunks of at most ``chunk_size`` branches from an open text trace.
+    """
+    while True:
+        lines = list(itertools.islice(fp, chunk_size))
+        if not lines:
+            return
+        chunk = parse_lines(lines)
+        if chunk[0]:
+            yield chunk
+
+
+def iter_btrace_chunks(bt: btrace.BTrace, chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[Chunk]:
+    """
+    Yields zero-copy column chunks of at most ``chunk_size`` branches from an open binary trace.
+    """
+    opcodes = bt.opcode_column
+    for start in range(0, len(bt), chunk_size):
+        end = start + chunk_size
+        yield opcodes[start:end], bt.pcs[start:end], bt.targets[start:end], bt.outcomes[start:end]
+
+
+def _text_chunks(trace: str, chunk_size: int) -> typing.Iterator[Chunk]:
+    with open_text(trace) as fp:
+        yield from iter_text_chunks(fp, chunk_size)
+
+
+def _btrace_chunks(trace: str, chunk_size: int) -> typing.Iterator[Chunk]:
+    with btrace.BTrace(trace) as bt:
+        for chunk in iter_btrace_chunks(bt, chunk_size):
+            yield chunk
+            del chunk  # drop our views into the map so it can be closed
+
+
+def prefetch(chunks: typing.Iterator[Chunk], depth: int = DEFAULT_PREFETCH) -> typing.Iterator[Chunk]:
+    """
+    Drains ``chunks`` on a background thread, keeping at most ``depth`` chunks queued ahead of the consumer. Errors
+    raised by the producer are re-raised in the consumer. Decompression releases the GIL, so it genuinely overlaps
+    with simulation on the consuming thread.
+    """
+    done = object()
+    buffer = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put((chunk, None)):
+                    return
+            put((done, None))
+        except BaseException as e:
+            put((None, e))
+        finally:
+            close = getattr(chunks, 'close', None)
+            if close is not None:
+                close()
+
+    worker = threading.Thread(target=produce, name='trace-reader', daemon=True)
+    worker.start()
+    try:
+        while True:
+            chunk, error = buffer.get()
+            if error is not None:
+                raise error
+            if chunk is done:
+                return
+            yield chunk
+    finally:
+        stop.set()
+        worker.join()
+
+
+def is_stream(trace: str) -> bool:
+    """
+    Returns whether ``trace`` is stdin or a named pipe rather than a regular file.
+    """
+    if trace == STDIN:
+        return True
+    try:
+        return stat.S_ISFIFO(os.stat(trace).st_mode)
+    except OSError:
+        return False
+
+
+def iter_stream_chunks(fd: int, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       interval: float = DEFAULT_STREAM_INTERVAL) -> typing.Iterator[Chunk]:
+    """
+    Yields column chunks from the text lines arriving on file descriptor ``fd``: a full chunk as soon as
+    ``chunk_size`` branches have arrived, or whatever has arrived once ``interval`` seconds passed since the last one.
+    """
+    buffered = b''
+    lines = []  # type: typing.List[bytes]
+    deadline = time.monotonic() + interval
+    while True:
+        ready, _, _ = select.select([fd], [], [], max(0.0, deadline - time.monotonic()))
+        if ready:
+            data = os.read(fd, 1 << 16)
+            if not data:
+                break
+            *complete, buffered = (buffered + data).split(b'\n')
+            lines.extend(line for line in complete if line.strip())  # chunks count branches, not blank lines
+            while len(lines) >= chunk_size:
+                yield parse_lines(line.decode('utf-8') for line in lines[:chunk_size])
+                del lines[:chunk_size]
+        if time.monotonic() >= deadline:
+            if lines:
+                chunk = parse_lines(line.decode('utf-8') for line in lines)
+                lines = []
+                if chunk[0]:
+                    yield chunk
+            deadline = time.monotonic() + interval
+
+    lines.append(buffered)
+    chunk = parse_lines(line.decode('utf-8') for line in lines)
+    if chunk[0]:
+        yield chunk
+
+
+def read_stream(trace: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+                interval: float = DEFAULT_STREAM_INTERVAL) -> typing.Iterator[Chunk]:
+    """
+    Yields column chunks from the stream ``trace`` (stdin or a named pipe, see ``iter_stream_chunks``).
+    """
+    if trace == STDIN:
+        yield from iter_stream_chunks(sys.stdin.fileno(), chunk_size, interval)
+        return
+    fd = os.open(trace, os.O_RDONLY)
+    try:
+        yield from iter_stream_chunks(fd, chunk_size, interval)
+    finally:
+        os.close(fd)
+
+
+def read_chunks(trace: str, chunk_size: int = DEFAULT_CHUNK_SIZE, background: bool = True) -> typing.Iterator[Chunk]:
+    """
+    Yields column chunks ``(opcodes, pcs, targets, outcomes)`` of at most ``chunk_size`` branches from ``trace``,
+    which may be a binary ``.btrace``, a plain or compressed text trace, or a stream (see ``read_stream``). With
+    ``background``, text trace files are read on a separate thread.
+    """
+    if is_stream(trace):
+        return read_stream(trace, chunk_size)
+    if is_range(trace):
+        chunks = (chunk for _, chunk in read_ranges(trace, [(0, sys.maxsize)], chunk_size))
+        return prefetch(chunks) if background and not btrace.is_btrace(split_range(trace)[0]) else chunks
+    if btrace.is_btrace(trace):
+        return _btrace_chunks(trace, chunk_size)
+    chunks = _text_chunks(trace, chunk_size)
+    return prefetch(chunks) if background else chunks
+
+
+def head_chunks(chunks: typing.Iterator[Chunk], num_branches: int) -> typing.Iterator[Chunk]:
+    """
+    Yields the chunks of the first ``num_branches`` branches of ``chunks``, cutting the last one short, and closes
+    ``chunks`` once they have been read.
+    """
+    try:
+        if num_branches <= 0:
+            return
+        for chunk in chunks:
+            if len(chunk[0]) >= num_branches:
+                yield tuple(column[:num_branches] for column in chunk) if len(chunk[0]) > num_branches else chunk
+                return
+            num_branches -= len(chunk[0])
+            yield chunk
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def read_ranges(trace: str, ranges: typing.Iterable[typing.Tuple[int, int]],
+                chunk_size: int = DEFAULT_CHUNK_SIZE) -> typing.Iterator[typing.Tuple[int, Chunk]]:
+    """
+    Yields ``(index, chunk)`` for the branches of every ``[start, end)`` range of ``ranges``, which must be ascending,
+    not overlap and may be endless, in chunks of at most ``chunk_size`` branches. The rest of the trace is read as
+    little as possible: binary traces are sliced directly and text traces skipped over line by line without being
+    parsed (only counting the lines which aren't blank), after seeking to the closest point of their offset
+    index before any skip longer than its interval. Returns the length of the trace (as the value of the generator's
+    StopIteration) if it is known: binary traces always know it, text traces once read to their end or indexed.
+    The ranges of a region of interest (see ``split_range``) are relative to its start, and its length is returned.
+    """
+    path, low, high = split_range(trace)
+    if path != trace:
+        length = yield from read_ranges(path, _shift_ranges(ranges, low, high), chunk_size)
+        if length is None:
+            return None
+        return max(0, (length if high is None else min(length, high)) - low)
+
+    if btrace.is_btrace(trace):
+        with btrace.BTrace(trace) as bt:
+            length, opcodes = len(bt), bt.opcode_column
+            for index, (start, end) in enumerate(ranges):
+                if start >= length:
+                    break
+                for chunk_start in range(start, min(end, length), chunk_size):
+                    chunk_end = min(chunk_start + chunk_size, end, length)
+                    chunk = (opcodes[chunk_start:chunk_end], bt.pcs[chunk_start:chunk_end],
+                             bt.targets[chunk_start:chunk_end], bt.outcomes[chunk_start:chunk_end])
+                    yield index, chunk
+                    del chunk  # drop our views into the map so it can be closed
+        return length
+
+    from offsetindex import DEFAULT_INTERVAL, OffsetIndex
+
+    position = 0
+    offsets = None
+    with open_text(trace) as fp:
+        for index, (start, end) in enumerate(ranges):
+            if start - position >= DEFAULT_INTERVAL and fp.seekable():
+                offsets = offsets or OffsetIndex.open(trace)
+                if start >= offsets.length:
+                    break
+                line, offset = offsets.seek_point(start)
+                if line > position:
+                    fp.seek(offset)
+                    position = line
+            while position < start:
+                lines = list(itertools.islice(fp, min(start - position, chunk_size)))
+                if not lines:
+                    return position
+                position += len(lines) - sum(map(str.isspace, lines))  # blank lines aren't branches
+            while position < end:
+                lines = list(itertools.islice(fp, min(end - position, chunk_size)))
+                if not lines:
+                    return position
+                chunk = parse_lines(lines)
+                position += len(chunk[0])
+                if chunk[0]:
+                    yield index, chunk
+    return offsets.length if offsets else None
+
+
+def trace_length(trace: str) -> int:
+    """
+    Returns the number of branches in ``trace``, or in its region of interest: read from the header of binary traces,
+    from the offset index of text traces (counting their non-blank lines, without parsing them, to build it if needed).
+    """
+    from offsetindex import OffsetIndex
+
+    path, low, high = split_range(trace)
+    if btrace.is_btrace(path):
+        with btrace.BTrace(path) as bt:
+            length = len(bt)
+    else:
+        length = OffsetIndex.open(path).length
+    return max(0, (length if high is None else min(length, high)) - low)
+
+
+def list_traces(trace_dir: str) -> typing.List[str]:
+    """
+    Returns the path of every trace in ``trace_dir``, skipping subdirectories and hidden files (such as the sidecar
+    indexes some tools save next to traces).
+    """
+    return [os.path.join(trace_dir, trace_file) for trace_file in os.listdir(trace_dir)
+            if not trace_file.startswith('.') and os.path.isfile(os.path.join(trace_dir, trace_file))]
+
+
+def read_trace(trace: str, chunk_size: int = DEFAULT_CHUNK_SIZE,
+               background: bool = True) -> typing.Iterator[typing.Tuple[str, int, int, int]]:
+    """
+    Yields ``(opcode, pc, target, taken)`` for every branch in ``trace`` while holding at most a few chunks in memory.
+    """
+    for chunk in read_chunks(trace, chunk_size, background):
+        yield from zip(*chunk)
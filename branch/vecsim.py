@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+"""
+Configuration-axis vectorized simulation of many table predictor configurations at once.
+
+Bimodal, TwoLevel and GShare differ only in how a branch is mapped onto a table of saturating counters, and all three
+fit one indexing scheme: a PC-selected history register ``h`` (absent for Bimodal) and a counter index of
+
+    ((h << pc_bits) | (pc & pc_mask)) % table_size  ==  (h * (2 ** pc_bits % table_size) + (pc & pc_mask)) % table_size
+
+(for GShare the ``^`` in place of ``|`` is equivalent, since the shifted history has no bits in common with the masked
+PC). The :class:`VectorSimulator` packs the counter tables and history registers of K configurations side by side into
+flat NumPy arrays and steps every configuration through each branch with a handful of vector operations, instead of
+K separate predictor objects. Anything that does not depend on predictor state (PC masking, register selection, the
+final accounting) is computed for a whole chunk of branches at once.
+
+Results are identical to ``test_predictor_single_trace`` for every configuration. Requires NumPy. Run a sweep grid
+spec (see sweep.py) through it with ``./vecsim.py grid.yaml -o results.csv``; configurations of other predictors in
+the grid are rejected.
+"""
+
+import argparse
+import collections
+import sys
+import typing
+
+import numpy
+
+from branch import get_predictor, new_results
+from predictors import AbstractBasePredictor
+from predictors.Bimodal import Bimodal
+from predictors.GShare import GShare
+from predictors.TwoLevel import TwoLevel
+from tracereader import read_chunks
+from writers import FORMATS, open_writer
+
+SUPPORTED_PREDICTORS = (Bimodal, TwoLevel, GShare)
+
+_UINT64_MAX = (1 << 64) - 1
+
+
+def _table_dtype(max_state: int):
+    for dtype in (numpy.uint8, numpy.uint16, numpy.uint32):
+        if max_state <= numpy.iinfo(dtype).max:
+            return dtype
+    return numpy.uint64
+
+
+class VectorSimulator:
+    """
+    Simulates K Bimodal, TwoLevel and/or GShare configurations side by side. Configurations are given as predictor
+    objects, which are only read for their parameters; their own state is left untouched.
+    """
+    def __init__(self, predictors: typing.List[AbstractBasePredictor]):
+        params = collections.defaultdict(list)
+        for predictor in predictors:
+            if type(predictor) not in SUPPORTED_PREDICTORS:
+                raise ValueError(f'{predictor.name()} is not supported, only '
+                                 f'{", ".join(cls.__name__ for cls in SUPPORTED_PREDICTORS)} can be vectorized')
+            if isinstance(predictor, Bimodal):
+                # a single, history-less register and an index of just pc % table_size
+                table_size, num_bhrs, history_bits, pc_bits = len(predictor.prediction_table), 1, 0, 64
+                counter_bits, initial_pht, initial_bhr = predictor.counter_bits, predictor.initial_state, 0
+            else:
+                table_size, num_bhrs = len(predictor.pht), len(predictor.bhr)
+                history_bits, pc_bits = predictor.history_size_bits, predictor.pc_bits
+                counter_bits = predictor.pht_counter_bits
+                initial_pht, initial_bhr = predictor.initial_pht_state, predictor.initial_bhr_state
+            params['table_size'].append(table_size)
+            params['num_bhrs'].append(num_bhrs)
+            params['history_multiplier'].append(0 if history_bits == 0 else pow(2, pc_bits, table_size))
+            params['history_mask'].append((2 ** history_bits) - 1)
+            params['pc_mask'].append(min((2 ** pc_bits) - 1, _UINT64_MAX))
+            params['threshold'].append(2 ** (counter_bits - 1))
+            params['saturated'].append((2 ** counter_bits) - 1)
+            params['initial_pht'].append(initial_pht)
+            params['initial_bhr'].append(initial_bhr)
+
+        self.predictors = predictors
+        self.has_history = any(params['history_mask'])
+        for name in ('table_size', 'num_bhrs', 'history_multiplier', 'history_mask', 'pc_mask'):
+            setattr(self, name, numpy.array(params[name], dtype=numpy.uint64))
+        self.pht_offset = numpy.concatenate(([0], numpy.cumsum(self.table_size)[:-1])).astype(numpy.uint64)
+        self.bhr_offset = numpy.concatenate(([0], numpy.cumsum(self.num_bhrs)[:-1])).astype(numpy.uint64)
+
+        dtype = _table_dtype(max(params['saturated']))
+        self.threshold = numpy.array(params['threshold'], dtype=numpy.uint64)
+        self.saturated = numpy.array(params['saturated'], dtype=dtype)
+        self.initial_pht = numpy.repeat(numpy.array(params['initial_pht'], dtype=dtype),
+                                        self.table_size.astype(numpy.intp))
+        self.initial_bhr = numpy.repeat(numpy.array(params['initial_bhr'], dtype=numpy.uint64),
+                                        self.num_bhrs.astype(numpy.intp))
+        self.reset()
+
+    def __len__(self):
+        return len(self.predictors)
+
+    def reset(self):
+        self.pht = self.initial_pht.copy()
+        self.bhr = self.initial_bhr.copy()
+        self.results = [new_results(None) for _ in self.predictors]
+
+    def run_chunk(self, chunk):
+        """
+        Steps every configuration through one chunk of branches (see tracereader.py) and adds the outcome to
+        ``results``.
+        """
+        opcodes, pcs, targets, outcomes = chunk
+        pcs = numpy.asarray(pcs, dtype=numpy.uint64)
+        outcomes = numpy.asarray(outcomes, dtype=numpy.uint8)
+
+        # everything independent of predictor state is computed for the whole chunk, one row per branch
+        pc_part = (pcs[:, None] & self.pc_mask) % self.table_size
+        if self.has_history:
+            bhr_slots = pcs[:, None] % self.num_bhrs + self.bhr_offset
+        else:
+            pc_part += self.pht_offset
+
+        pht, bhr, saturated = self.pht, self.bhr, self.saturated
+        table_size, multiplier, pht_offset, history_mask = \
+            self.table_size, self.history_multiplier, self.pht_offset, self.history_mask
+        states = numpy.empty((len(outcomes), len(self)), dtype=pht.dtype)
+        for t, taken in enumerate(outcomes.tolist()):
+            if self.has_history:
+                slots = bhr_slots[t]
+                history = bhr[slots]
+                index = (history * multiplier + pc_part[t]) % table_size + pht_offset
+            else:
+                index = pc_part[t]
+            state = pht[index]
+            states[t] = state
+            if taken:
+                pht[index] = state + (state < saturated)  # state + 1 would wrap at the max of the dtype
+                if self.has_history:
+                    bhr[slots] = ((history << 1) | 1) & history_mask
+            else:
+                pht[index] = state - (state > 0)
+                if self.has_history:
+                    bhr[slots] = (history << 1) & history_mask
+
+        self._tally(opcodes, states >= self.threshold, outcomes.astype(bool))
+
+    def _tally(self, opcodes, predictions, taken):
+        correct = predictions == taken[:, None]
+        total, total_taken = len(taken), int(taken.sum())
+        total_correct = correct.sum(axis=0)
+        correct_takes = correct[taken].sum(axis=0)
+
+        opcode_ids = dict()  # type: typing.Dict[str, int]
+        ids = numpy.fromiter((opcode_ids.setdefault(opcode, len(opcode_ids)) for opcode in opcodes),
+                             dtype=numpy.int64, count=total)
+        opcode_counts = numpy.bincount(ids, minlength=len(opcode_ids))
+        opcode_correct = [correct[ids == i].sum(axis=0) for i in range(len(opcode_ids))]
+
+        for k, results in enumerate(self.results):
+            correct_k, takes_k = int(total_correct[k]), int(correct_takes[k])
+            results['total_predictions'] += total
+            results['correct_predicts'] += correct_k
+            results['correct_takes'] += takes_k
+            results['correct_not_takes'] += correct_k - takes_k
+            results['incorrect_predicts'] += total - correct_k
+            results['incorrect_takes'] += total_taken - takes_k
+            results['incorrect_not_takes'] += (total - total_taken) - (correct_k - takes_k)
+            histogram = results['opcode_histogram']
+            for opcode, i in opcode_ids.items():
+                if opcode not in histogram:
+                    histogram[opcode] = [0, 0]
+                histogram[opcode][0] += int(opcode_counts[i])
+                histogram[opcode][1] += int(opcode_correct[i][k])
+
+
+def simulate_configs(predictors: typing.List[AbstractBasePredictor], trace: str) -> typing.List[typing.Dict]:
+    """
+    Evaluates every configuration on ``trace`` from a reset state, returning the same result dict per configuration as
+    ``test_predictor_single_trace`` would.
+    """
+    simulator = VectorSimulator(predictors)
+    for chunk in read_chunks(trace):
+        simulator.run_chunk(chunk)
+    for results in simulator.results:
+        results['trace'] = trace
+    return simulator.results
+
+
+if __name__ == '__main__':
+    import sweep
+
+    parser = argparse.ArgumentParser(
+        description="Evaluate every Bimodal, TwoLevel and GShare configuration of a sweep grid spec together in one "
+                    "vectorized pass per trace."
+    )
+    parser.add_argument(
+        'spec',
+        help="the grid spec, in the format read by sweep.py"
+    )
+    parser.add_argument(
+        "-o", "--output",
+        help="save output into a file. if omitted, results are printed to the console"
+    )
+    parser.add_argument(
+        "-f", "--format",
+        help="output format, see writers.py",
+        choices=FORMATS,
+        default='csv'
+    )
+
+    parsed = parser.parse_args()
+
+    configs_by_trace = collections.OrderedDict()  # type: typing.Dict[str, typing.List[typing.Tuple[str, typing.Dict]]]
+    for name, kwargs, trace_file in sweep.expand_grid(sweep.load_spec(parsed.spec)):
+        configs_by_trace.setdefault(trace_file, []).append((name, kwargs))
+
+    result_writer = open_writer(parsed.output, parsed.format)
+    try:
+        for trace_file, configs in configs_by_trace.items():
+            print(f'{trace_file}: {len(configs)} configurations', file=sys.stderr)
+            predictor_objects = [get_predictor(name)(**kwargs) for name, kwargs in configs]
+            for predictor_object, (_, kwargs), result in zip(predictor_objects, configs,
+                                                              simulate_configs(predictor_objects, trace_file)):
+                result['_meta'] = {
+                    'predictor': predictor_object.name(),
+                    'kwargs': kwargs,
+                    'storage_bits': predictor_object.storage_bits()
+                }
+                result_writer.write(result)
+    finally:
+        result_writer.close()
@@ -0,0 +1,297 @@
+"""
+Streaming result writers shared by branch.py, sweep.py and vecsim.py.
+
+A writer appends one result at a time, a ``test_predictor_single_trace`` dict carrying the ``_meta`` block of its
+predictor, as soon as it completes, and flushes it so finished results survive an interrupted run. Formats:
+
+    csv      one row per result: the predictor, its arguments, the trace and the counters, a total / correct column pair
+             per opcode, the predictor's storage_bits and, for --profile, --sample and --segments runs, the columns of
+             their block of _meta
+    json     a JSON list of result dicts
+    ndjson   one result dict per line
+    parquet  columnar Parquet file, requires pyarrow
+    arrow    columnar Arrow IPC (Feather v2) file, requires pyarrow
+
+Every RISC-V branch opcode of ``CSV_OPCODES`` always has its columns, in that order; any other opcode found in the
+results follows in order of appearance. A CSV file is rewritten with the wider header if such an opcode turns up after
+the header was written; columnar outputs fix their schema with their first batch of rows.
+"""
+
+import csv
+import json
+import sys
+import typing
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+from profiling import PROFILE_COLUMNS
+from sampling import SAMPLING_COLUMNS
+from segments import SEGMENT_COLUMNS
+
+FORMATS = ['csv', 'json', 'ndjson', 'parquet', 'arrow']
+# canonical order of the opcode columns
+CSV_OPCODES = ['beq', 'bne', 'blt', 'bltu', 'bge', 'bgeu', 'beqz', 'bnez']
+COUNTER_COLUMNS = [
+    'total_predictions',
+    'correct_predicts',
+    'correct_takes',
+    'correct_not_takes',
+    'incorrect_predicts',
+    'incorrect_takes',
+    'incorrect_not_takes',
+]
+# optional blocks of _meta, keyed by trace, flattened into columns of their own when present
+META_BLOCKS = {
+    'profile': PROFILE_COLUMNS,
+    'sampling': SAMPLING_COLUMNS,
+    'segments': SEGMENT_COLUMNS,
+}
+# number of rows per record batch of columnar outputs
+DEFAULT_BATCH_SIZE = 65536
+
+
+def order_opcodes(opcodes: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Orders opcodes for output: all of ``CSV_OPCODES`` in its order, whether given or not, then any others in the
+    order given.
+    """
+    return CSV_OPCODES + [opcode for opcode in dict.fromkeys(opcodes) if opcode not in CSV_OPCODES]
+
+
+def columns(opcodes: typing.List[str], blocks: typing.Iterable[str] = ()) -> typing.List[str]:
+    """
+    Returns the flat columns of results with the given (ordered) opcodes, and those of the given ``META_BLOCKS``.
+    """
+    return ['predictor', 'args', 'trace'] + COUNTER_COLUMNS + \
+           [f'opcode_histogram.{opcode}.{column}' for opcode in opcodes
+            for column in ('total_predictions', 'correct_predicts')] + \
+           ['storage_bits'] + [f'{block}.{column}' for block, block_columns in META_BLOCKS.items() if block in blocks
+                               for column in block_columns]
+
+
+def meta_blocks(meta: typing.Dict) -> typing.List[str]:
+    """
+    Returns the ``META_BLOCKS`` present in a ``_meta`` block.
+    """
+    return [block for block in META_BLOCKS if block in meta]
+
+
+def flatten(result: typing.Dict) -> typing.Dict[str, typing.Any]:
+    """
+    Flattens a result and its ``_meta`` block into a dict of column values, see ``columns``.
+    """
+    meta = result['_meta']
+    row = {
+        'predictor': meta['predictor'],
+        'args': ' '.join([f"{k}={v}" for k, v in meta['kwargs'].items()]),
+        'trace': str(result['trace']),
+    }
+    for column in COUNTER_COLUMNS:
+        row[column] = result[column]
+    for opcode, (total, correct) in result['opcode_histogram'].items():
+        row[f'opcode_histogram.{opcode}.total_predictions'] = total
+        row[f'opcode_histogram.{opcode}.correct_predicts'] = correct
+    row['storage_bits'] = meta.get('storage_bits')
+    for block in meta_blocks(meta):
+        values = meta[block].get(result['trace'], dict())
+        for column in META_BLOCKS[block]:
+            row[f'{block}.{column}'] = values.get(column)
+    return row
+
+
+def _default(column: str):
+    # results without an opcode simply never executed it
+    return 0 if column.startswith('opcode_histogram.') else None
+
+
+# columns of the META_BLOCKS holding whole numbers, the others hold floats
+_BLOCK_COUNTS = {
+    'profile.branches', 'profile.peak_rss_kb',
+    'sampling.period', 'sampling.interval_branches', 'sampling.warmup_branches', 'sampling.intervals',
+    'sampling.detailed_branches', 'sampling.simulated_branches', 'sampling.trace_branches',
+    'segments.segments', 'segments.warmup_branches', 'segments.misprediction_error',
+}
+
+
+def _arrow_type(column: str):
+    if column in ('predictor', 'args', 'trace', 'sampling.mode'):
+        return pyarrow.string()
+    if column.split('.')[0] in META_BLOCKS and column not in _BLOCK_COUNTS:
+        return pyarrow.float64()
+    return pyarrow.int64()
+
+
+class ResultWriter:
+    """
+    Base class of the writers. ``rows`` counts the results written.
+    """
+    def __init__(self, fp, owns_fp: bool = False):
+        self.fp = fp
+        self.owns_fp = owns_fp
+        self.rows = 0
+
+    def write(self, result: typing.Dict):
+        raise NotImplementedError()
+
+    def close(self):
+        self.fp.flush()
+        if self.owns_fp:
+            self.fp.close()
+
+
+class CSVResultWriter(ResultWriter):
+    """
+    Writes results as CSV rows. The header is written with the first result; if a later result has opcodes outside
+    ``CSV_OPCODES`` without a column, a seekable file is rewritten with the extra columns, otherwise they are dropped
+    with a warning.
+    """
+    def __init__(self, fp: typing.TextIO, owns_fp: bool = False):
+        super().__init__(fp, owns_fp)
+        self.writer = csv.writer(fp, lineterminator='\n')
+        self.opcodes = None  # type: typing.Optional[typing.List[str]]
+        self.blocks = []  # type: typing.List[str]
+        self.columns = []  # type: typing.List[str]
+
+    def write(self, result: typing.Dict):
+        opcodes = list(result['opcode_histogram'])
+        if self.opcodes is None:
+            self.opcodes = order_opcodes(opcodes)
+            self.blocks = meta_blocks(result['_meta'])
+            self.columns = columns(self.opcodes, self.blocks)
+            self.writer.writerow(self.columns)
+        elif not set(opcodes) <= set(self.opcodes):
+            self._widen(opcodes)
+
+        row = flatten(result)
+        self.writer.writerow([row.get(column, _default(column)) for column in self.columns])
+        self.rows += 1
+        self.fp.flush()
+
+    def _widen(self, opcodes: typing.List[str]):
+        new_opcodes = [opcode for opcode in opcodes if opcode not in self.opcodes]
+        seekable = getattr(self.fp, 'seekable', lambda: False)() and getattr(self.fp, 'readable', lambda: False)()
+        if not seekable:
+            print(f"warning: no CSV columns for opcode(s) {', '.join(new_opcodes)}, which first appeared after the "
+                  f"header was written", file=sys.stderr)
+            return
+
+        old_columns = self.columns
+        self.opcodes = order_opcodes(self.opcodes + new_opcodes)
+        self.columns = columns(self.opcodes, self.blocks)
+        self.fp.flush()
+        self.fp.seek(0)
+        old_rows = list(csv.reader(self.fp))[1:]
+        self.fp.seek(0)
+        self.fp.truncate()
+        self.writer.writerow(self.columns)
+        for old_row in old_rows:
+            values = dict(zip(old_columns, old_row))
+            self.writer.writerow([values.get(column, _default(column)) for column in self.columns])
+
+    def close(self):
+        if self.opcodes is None:  # no results, but still a valid (empty) table
+            self.writer.writerow(columns(order_opcodes([])))
+        super().close()
+
+
+class JSONResultWriter(ResultWriter):
+    """
+    Writes results as a JSON list of result dicts, each with its own ``_meta`` block.
+    """
+    def __init__(self, fp: typing.TextIO, owns_fp: bool = False):
+        super().__init__(fp, owns_fp)
+        fp.write('[')
+        fp.flush()
+
+    def write(self, result: typing.Dict):
+        self.fp.write(('\n' if self.rows == 0 else ',\n') + json.dumps(result))
+        self.rows += 1
+        self.fp.flush()
+
+    def close(self):
+        self.fp.write('\n]\n')
+        super().close()
+
+
+class NDJSONResultWriter(ResultWriter):
+    """
+    Writes one JSON result dict per line.
+    """
+    def write(self, result: typing.Dict):
+        self.fp.write(json.dumps(result) + '\n')
+        self.rows += 1
+        self.fp.flush()
+
+
+class ColumnarResultWriter(ResultWriter):
+    """
+    Writes results to a Parquet or Arrow IPC file in record batches of ``batch_size`` rows. The schema, including the
+    opcode columns, is taken from the first batch; opcodes first seen after it are dropped with a warning.
+    """
+    def __init__(self, path: str, fmt: str, batch_size: int = DEFAULT_BATCH_SIZE):
+        if pyarrow is None:
+            raise ImportError(f"the {fmt} format requires the 'pyarrow' package")
+        super().__init__(None)
+        self.path = path
+        self.format = fmt
+        self.batch_size = batch_size
+        self.pending = []  # type: typing.List[typing.Dict[str, typing.Any]]
+        self.writer = None
+        self.columns = []  # type: typing.List[str]
+
+    def write(self, result: typing.Dict):
+        self.pending.append(flatten(result))
+        self.rows += 1
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        if self.writer is None:
+            opcodes = order_opcodes(column.split('.')[1] for row in self.pending for column in row
+                                    if column.startswith('opcode_histogram.'))
+            self.columns = columns(opcodes, {column.split('.')[0] for column in self.pending[0]})
+        else:
+            dropped = {column for row in self.pending for column in row} - set(self.columns)
+            if dropped:
+                print(f"warning: dropping column(s) {', '.join(sorted(dropped))}, which first appeared after the "
+                      f"schema was written", file=sys.stderr)
+
+        schema = pyarrow.schema([(column, _arrow_type(column)) for column in self.columns])
+        table = pyarrow.table({column: [row.get(column, _default(column)) for row in self.pending]
+                               for column in self.columns}, schema=schema)
+        if self.writer is None:
+            if self.format == 'parquet':
+                self.writer = pyarrow.parquet.ParquetWriter(self.path, schema)
+            else:
+                self.writer = pyarrow.ipc.new_file(self.path, schema)
+        self.writer.write_table(table)
+        self.pending = []
+
+    def close(self):
+        self.flush()
+        if self.writer is not None:
+            self.writer.close()
+
+
+def open_writer(path: typing.Optional[str], fmt: str) -> ResultWriter:
+    """
+    Returns a writer of the given format saving to ``path``, or printing to the console if ``path`` is None (not
+    possible for the columnar formats). Closing the writer closes the file.
+    """
+    if fmt in ('parquet', 'arrow'):
+        if path is None:
+            raise ValueError(f'{fmt} output must be saved into a file, use -o')
+        return ColumnarResultWriter(path, fmt)
+
+    writer_class = {'csv': CSVResultWriter, 'json': JSONResultWriter, 'ndjson': NDJSONResultWriter}[fmt]
+    if path is None:
+        return writer_class(sys.stdout)
+    # CSV files are opened for reading too, so they can be rewritten with a wider header
+    return writer_class(open(path, 'w+' if fmt == 'csv' else 'w'), owns_fp=True)